@@ -0,0 +1,338 @@
+"""
+Model Load Benchmark
+Times every phase of inference worker startup and reports peak RSS per phase
+
+Usage:
+    python bench_load.py
+    python bench_load.py --format checkpoint --model_path ./saved_models/best_model.pth
+    python bench_load.py --compare encrypted checkpoint --runs 3 --json bench_load.json
+
+Each run happens in a fresh Python process so import time and peak memory
+are measured from a cold start, exactly as a respawned worker sees them.
+"""
+
+import sys
+import os
+import io
+import json
+import time
+import hashlib
+import argparse
+import platform
+import statistics
+import subprocess
+from contextlib import contextmanager
+from datetime import datetime
+
+DEFAULT_PATHS = {
+    'encrypted': os.getenv('MODEL_PATH', './saved_models/best_model.encrypted'),
+    'checkpoint': './saved_models/best_model.pth'
+}
+MODEL_KEY_PATH = os.getenv('MODEL_KEY_PATH', './secrets/model.key')
+
+
+def get_peak_rss_mb():
+    """Peak resident set size of this process in MB (None if unavailable)"""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is reported in bytes on macOS and kilobytes on Linux
+        if sys.platform == 'darwin':
+            return peak / 1024 / 1024
+        return peak / 1024
+    except ImportError:
+        pass
+
+    try:
+        import psutil
+        info = psutil.Process().memory_info()
+        return getattr(info, 'peak_wset', info.rss) / 1024 / 1024
+    except ImportError:
+        return None
+
+
+class PhaseTimer:
+    """Collects wall time and peak RSS for named startup phases"""
+
+    def __init__(self):
+        self.phases = []
+
+    @contextmanager
+    def phase(self, name):
+        rss_before = get_peak_rss_mb()
+        start = time.perf_counter()
+        yield
+        elapsed = time.perf_counter() - start
+        rss_after = get_peak_rss_mb()
+
+        self.phases.append({
+            'phase': name,
+            'seconds': elapsed,
+            'peak_rss_mb': rss_after,
+            'peak_rss_delta_mb': (
+                rss_after - rss_before
+                if rss_before is not None and rss_after is not None else None
+            )
+        })
+
+
+def _import_stack(timer):
+    with timer.phase('imports'):
+        import numpy  # noqa: F401
+        import cv2  # noqa: F401
+        import torch
+        import timm  # noqa: F401
+        import inference_engine
+
+    return torch, inference_engine
+
+
+def _build_and_run(timer, torch, engine, checkpoint, device):
+    """Phases shared by every format once the checkpoint dict is in memory"""
+    with timer.phase('create_model'):
+        model = engine.create_model()
+
+    with timer.phase('load_state_dict'):
+        model.load_state_dict(engine.extract_state_dict(checkpoint))
+
+    with timer.phase('eval'):
+        model.to(device)
+        model.eval()
+
+    img_size = engine.CONFIG['image']['size']
+    dummy = torch.zeros(1, 3, img_size, img_size, device=device)
+
+    with timer.phase('first_forward'):
+        with torch.no_grad():
+            model(dummy)
+        if device.type == 'cuda':
+            torch.cuda.synchronize()
+
+    with timer.phase('second_forward'):
+        with torch.no_grad():
+            model(dummy)
+        if device.type == 'cuda':
+            torch.cuda.synchronize()
+
+    return model
+
+
+def bench_encrypted(model_path, device_name, timer):
+    """Encrypted package produced by model_encryption.py"""
+    torch, engine = _import_stack(timer)
+    from cryptography.fernet import Fernet
+
+    device = torch.device(device_name)
+
+    with timer.phase('key_load'):
+        with open(MODEL_KEY_PATH, 'rb') as f:
+            cipher = Fernet(f.read())
+
+    with timer.phase('package_load'):
+        package = torch.load(model_path, map_location='cpu', weights_only=False)
+
+    with timer.phase('decrypt'):
+        decrypted_data = cipher.decrypt(package['data'])
+
+    with timer.phase('sha256'):
+        data_hash = hashlib.sha256(decrypted_data).hexdigest()
+        if data_hash != package['metadata']['hash']:
+            raise ValueError("Model integrity check failed - possible tampering")
+
+    with timer.phase('checkpoint_load'):
+        checkpoint = engine.torch_load(io.BytesIO(decrypted_data), device)
+
+    _build_and_run(timer, torch, engine, checkpoint, device)
+
+
+def bench_checkpoint(model_path, device_name, timer):
+    """Plain .pth checkpoint as written by training/model.py"""
+    torch, engine = _import_stack(timer)
+
+    device = torch.device(device_name)
+
+    with timer.phase('checkpoint_load'):
+        checkpoint = engine.torch_load(model_path, device)
+
+    _build_and_run(timer, torch, engine, checkpoint, device)
+
+
+FORMATS = {
+    'encrypted': bench_encrypted,
+    'checkpoint': bench_checkpoint
+}
+
+
+def run_single(fmt, model_path, device_name):
+    """Benchmark one format in the current process"""
+    timer = PhaseTimer()
+    start = time.perf_counter()
+    FORMATS[fmt](model_path, device_name, timer)
+    total = time.perf_counter() - start
+
+    import torch
+
+    return {
+        'format': fmt,
+        'model_path': model_path,
+        'model_size_mb': os.path.getsize(model_path) / 1024 / 1024,
+        'device': device_name,
+        'torch_version': torch.__version__,
+        'python_version': platform.python_version(),
+        'platform': platform.platform(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'total_seconds': total,
+        'peak_rss_mb': get_peak_rss_mb(),
+        'phases': timer.phases
+    }
+
+
+def run_in_subprocess(fmt, model_path, device_name):
+    """Run one benchmark in a fresh interpreter and return its JSON result"""
+    cmd = [
+        sys.executable, os.path.abspath(__file__),
+        '--format', fmt,
+        '--model_path', model_path,
+        '--device', device_name,
+        '--json', '-',
+        '--quiet'
+    ]
+    completed = subprocess.run(
+        cmd,
+        cwd=os.getcwd(),
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(
+            f"Benchmark for '{fmt}' failed:\n{completed.stderr.strip()}"
+        )
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def summarize_runs(runs):
+    """Median per phase across repeated cold-start runs"""
+    phase_names = [p['phase'] for p in runs[0]['phases']]
+    phases = []
+    for name in phase_names:
+        samples = [
+            next(p for p in run['phases'] if p['phase'] == name)
+            for run in runs
+        ]
+        rss = [s['peak_rss_mb'] for s in samples if s['peak_rss_mb'] is not None]
+        phases.append({
+            'phase': name,
+            'seconds': statistics.median(s['seconds'] for s in samples),
+            'seconds_min': min(s['seconds'] for s in samples),
+            'seconds_max': max(s['seconds'] for s in samples),
+            'peak_rss_mb': statistics.median(rss) if rss else None
+        })
+
+    summary = dict(runs[0])
+    summary['runs'] = len(runs)
+    summary['total_seconds'] = statistics.median(r['total_seconds'] for r in runs)
+    peaks = [r['peak_rss_mb'] for r in runs if r['peak_rss_mb'] is not None]
+    summary['peak_rss_mb'] = statistics.median(peaks) if peaks else None
+    summary['phases'] = phases
+    return summary
+
+
+def print_report(results):
+    """Side-by-side phase table for one or more formats"""
+    phase_names = []
+    for result in results:
+        for p in result['phases']:
+            if p['phase'] not in phase_names:
+                phase_names.append(p['phase'])
+
+    def fmt_rss(value):
+        return f"{value:8.1f}" if value is not None else f"{'n/a':>8}"
+
+    print("\n" + "=" * 70)
+    print("MODEL LOAD BENCHMARK")
+    print("=" * 70)
+    for result in results:
+        print(f"  {result['format']:12}: {result['model_path']} "
+              f"({result['model_size_mb']:.1f} MB, {result['device']}, "
+              f"runs={result.get('runs', 1)})")
+    print("-" * 70)
+
+    header = f"{'phase':18}" + "".join(
+        f"{r['format'][:12]:>14}{'RSS MB':>9}" for r in results
+    )
+    print(header)
+
+    for name in phase_names:
+        row = f"{name:18}"
+        for result in results:
+            phase = next((p for p in result['phases'] if p['phase'] == name), None)
+            if phase is None:
+                row += f"{'-':>14}{'-':>9}"
+            else:
+                row += f"{phase['seconds'] * 1000:12.1f}ms {fmt_rss(phase['peak_rss_mb'])}"
+        print(row)
+
+    print("-" * 70)
+    row = f"{'TOTAL':18}"
+    for result in results:
+        row += f"{result['total_seconds'] * 1000:12.1f}ms {fmt_rss(result['peak_rss_mb'])}"
+    print(row)
+    print("=" * 70 + "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Inference worker startup benchmark')
+    parser.add_argument('--format', choices=sorted(FORMATS), default='encrypted',
+                        help='Model format to benchmark (default: encrypted)')
+    parser.add_argument('--compare', nargs='+', choices=sorted(FORMATS), default=None,
+                        help='Benchmark several formats side by side')
+    parser.add_argument('--model_path', type=str, default=None,
+                        help='Model file (single format only)')
+    parser.add_argument('--device', type=str, default='cpu',
+                        help='Device to load the model on (default: cpu)')
+    parser.add_argument('--runs', type=int, default=1,
+                        help='Cold-start runs per format; the median is reported')
+    parser.add_argument('--json', type=str, default=None,
+                        help="Write results as JSON to this path ('-' for stdout)")
+    parser.add_argument('--quiet', action='store_true',
+                        help='Do not print the phase table')
+
+    args = parser.parse_args()
+
+    formats = args.compare or [args.format]
+
+    if args.compare is None and args.runs == 1 and args.json == '-':
+        # Child process of a comparison run: measure in-process
+        model_path = args.model_path or DEFAULT_PATHS[args.format]
+        results = [run_single(args.format, model_path, args.device)]
+    else:
+        results = []
+        for fmt in formats:
+            model_path = args.model_path if len(formats) == 1 and args.model_path else DEFAULT_PATHS[fmt]
+            if not os.path.exists(model_path):
+                print(f"✗ Skipping '{fmt}': model not found at {model_path}", file=sys.stderr)
+                continue
+            runs = [run_in_subprocess(fmt, model_path, args.device) for _ in range(args.runs)]
+            results.append(summarize_runs(runs))
+
+    if not results:
+        print("✗ Nothing to benchmark", file=sys.stderr)
+        sys.exit(1)
+
+    if not args.quiet and args.json != '-':
+        print_report(results)
+
+    if args.json:
+        payload = results[0] if len(results) == 1 and args.json == '-' else {'results': results}
+        if args.json == '-':
+            sys.stdout.write(json.dumps(payload) + "\n")
+            sys.stdout.flush()
+        else:
+            with open(args.json, 'w') as f:
+                json.dump(payload, f, indent=2)
+            print(f"✓ Benchmark JSON saved: {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,25 @@
+"""
+Header-only image probing shared by the backend and training
+
+The inference engine uses it to validate uploads and pick a reduced JPEG
+decode; training/image_probe.py uses it to scan the raw dataset. Only the
+header is read, never the pixel data.
+"""
+
+from PIL import Image
+
+
+def probe_image(image_path):
+    """
+    Read (width, height, format) from the image header without decoding pixels
+
+    Returns:
+        Tuple, or None if the file is missing or the header is not a
+        recognised image
+    """
+    try:
+        with Image.open(image_path) as img:
+            width, height = img.size
+            return width, height, img.format
+    except Exception:
+        return None
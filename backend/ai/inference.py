@@ -5,186 +5,52 @@ CRITICAL FIXES:
 2. Uses TIMM (not torchvision)
 3. Recreates EXACT classifier architecture
 4. Proper error handling
+
+Model definition, preprocessing and response building live in
+inference_engine.py (shared with inference_server.py and training).
+
+Usage:
+    python inference.py <image_path>
+    python inference.py --bulk <directory|glob|manifest.txt> --output results.jsonl
+    python inference.py --decode-parity <directory|glob|manifest.txt>
 """
 
 import sys
+import csv
 import json
 import os
-import cv2
+import glob
+import time
+import argparse
 import torch
-import torch.nn as nn
-import numpy as np
 import warnings
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 warnings.filterwarnings('ignore')
 
-# ============================================================================
-# CONFIGURATION - MATCHES TRAINING EXACTLY
-# ============================================================================
-
-CONFIG = {
-    'image': {
-        'size': 224,
-        'normalize_mean': [0.485, 0.456, 0.406],
-        'normalize_std': [0.229, 0.224, 0.225],
-        'max_pixel_value': 255.0
-    },
-   'classes': [
-    "Healthy",
-    "Pest_Fungal",
-    "Pest_Bacterial",
-    "Pest_Insect",
-    "Nutrient_Nitrogen",
-    "Nutrient_Potassium",
-    "Water_Stress",
-    "Not_Plant"
-],
-    'model': {
-        'name': 'efficientnet_b2',
-        'dropout': 0.2,
-        'num_classes': 8
-    }
-}
+import numpy as np
+from inference_engine import (CONFIG, PlantHealthModel, InferenceEngine,
+                              get_calibration, load_model, read_image)
 
 MODEL_PATH = os.getenv('MODEL_PATH', './models/best_model.pth')
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp'}
+MANIFEST_EXTENSIONS = {'.txt', '.lst'}
+CSV_FIELDS = [
+    'image_path', 'success', 'predicted_class', 'category', 'subtype',
+    'confidence', 'confidence_level', 'calibrated', 'error'
+]
 DEVICE = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
 
-_model = None
-_transform = None
-
+_engine = None
 
-# ============================================================================
-# MODEL DEFINITION - EXACT MATCH TO TRAINING
-# ============================================================================
-
-class PlantHealthModel(nn.Module):
-    """
-    CRITICAL FIX: Recreates EXACT architecture from training
-    Uses efficientnet_b2 (NOT efficientnetv2_b2)
-    """
-    def __init__(self, model_name='efficientnet_b2', num_classes=7, dropout=0.2):
-        super(PlantHealthModel, self).__init__()
-        
-        # CRITICAL: Use TIMM (not torchvision)
-        try:
-            import timm
-        except ImportError:
-            raise ImportError("TIMM is required: pip install timm==0.9.16")
-        
-        # CRITICAL: Normalize model name (remove tf_ prefix if present)
-        timm_model_name = model_name.replace('tf_', '')
-        
-        # Load base model (EXACT match to training)
-        self.base_model = timm.create_model(
-            timm_model_name, 
-            pretrained=False, 
-            num_classes=0  # Remove head
-        )
-        
-        feature_dim = self.base_model.num_features
-        
-        # CRITICAL: EXACT classifier architecture from training
-        self.classifier = nn.Sequential(
-            nn.BatchNorm1d(feature_dim),
-            nn.Dropout(dropout),
-            nn.Linear(feature_dim, 512),
-            nn.ReLU(inplace=True),
-            
-            nn.BatchNorm1d(512),
-            nn.Dropout(dropout * 0.5),
-            nn.Linear(512, 256),
-            nn.ReLU(inplace=True),
-            
-            nn.BatchNorm1d(256),
-            nn.Dropout(dropout * 0.3),
-            nn.Linear(256, num_classes)
-        )
-    
-    def forward(self, x):
-        features = self.base_model(x)
-        output = self.classifier(features)
-        return output
-
-
-def load_model(model_path, device):
-    """
-    FIXED: Load model with exact architecture matching training
-    Handles both old and new PyTorch checkpoint formats
-    """
-    # Create model with EXACT architecture from training
-    model = PlantHealthModel(
-        model_name=CONFIG['model']['name'],
-        num_classes=CONFIG['model']['num_classes'],
-        dropout=CONFIG['model']['dropout']
-    )
-    
-    # Load checkpoint with safe_globals for PyTorch >= 2.6
-    try:
-        # Try with safe_globals (PyTorch >= 2.6)
-        import numpy as np
-        safe_globals = [
-            np.dtype, np.int64, np.float32, np.float64, 
-            np.bool_, np.core.multiarray.scalar
-        ]
-        
-        with torch.serialization.safe_globals(safe_globals):
-            checkpoint = torch.load(model_path, map_location=device, weights_only=False)
-    except (AttributeError, TypeError):
-        # Fallback for older PyTorch
-        checkpoint = torch.load(model_path, map_location=device)
-    
-    # Handle different checkpoint formats
-    if isinstance(checkpoint, dict):
-        if 'model_state_dict' in checkpoint:
-            model.load_state_dict(checkpoint['model_state_dict'])
-            epoch = checkpoint.get('epoch', 'unknown')
-            best_metric = checkpoint.get('best_metric', 'unknown')
-        elif 'state_dict' in checkpoint:
-            model.load_state_dict(checkpoint['state_dict'])
-            epoch = 'unknown'
-            best_metric = 'unknown'
-        else:
-            # Assume checkpoint is state_dict
-            model.load_state_dict(checkpoint)
-            epoch = 'unknown'
-            best_metric = 'unknown'
-    else:
-        raise ValueError("Unexpected checkpoint format")
-    
-    model = model.to(device)
-    model.eval()
-    
-    # GPU optimizations
-    if device.type == 'cuda':
-        torch.backends.cudnn.benchmark = True
-        if hasattr(torch.backends.cuda.matmul, 'allow_tf32'):
-            torch.backends.cuda.matmul.allow_tf32 = True
-        if hasattr(torch.backends.cudnn, 'allow_tf32'):
-            torch.backends.cudnn.allow_tf32 = True
-    
-    return model, {'epoch': epoch, 'best_metric': best_metric}
-
-
-def get_transform():
-    """Backend-safe normalization (matches training exactly)"""
-    mean = np.array(CONFIG['image']['normalize_mean'], dtype=np.float32)
-    std = np.array(CONFIG['image']['normalize_std'], dtype=np.float32)
-    max_pixel = CONFIG['image']['max_pixel_value']
-
-    def transform(img):
-        img = img.astype(np.float32) / max_pixel
-        img = (img - mean) / std
-        img = torch.from_numpy(img).permute(2, 0, 1)
-        return img
-
-    return transform
 
 def initialize_model():
     """Load model once and cache"""
-    global _model, _transform
-    
-    if _model is not None:
-        return
-    
+    global _engine
+
+    if _engine is not None:
+        return _engine
+
     # Find model file
     if not os.path.exists(MODEL_PATH):
         alt_paths = [
@@ -192,157 +58,364 @@ def initialize_model():
             './saved_models/best_model.pth',
             './saved_models/model_final.pth'
         ]
-        
+
         model_path = None
         for alt_path in alt_paths:
             if os.path.exists(alt_path):
                 model_path = alt_path
                 break
-        
+
         if model_path is None:
             raise FileNotFoundError(f"Model not found: {MODEL_PATH}")
     else:
         model_path = MODEL_PATH
-    
-    _model, info = load_model(model_path, DEVICE)
-    _transform = get_transform()
+
+    model, checkpoint = load_model(model_path, DEVICE)
+    temperature, calibrated = get_calibration(checkpoint)
+    _engine = InferenceEngine(model, DEVICE, temperature=temperature, calibrated=calibrated)
+
+    return _engine
 
 
 # ============================================================================
-# PREPROCESSING - EXACT MATCH TO TRAINING
+# PREDICTION
 # ============================================================================
 
-def preprocess_image(image_path):
-    """EXACT preprocessing from training"""
-    img = cv2.imread(image_path)
-    
-    if img is None:
-        raise ValueError(f"Cannot read image: {image_path}")
-    
-    # BGR to RGB
-    img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-    
-    # Resize (EXACT interpolation as training)
-    img_size = CONFIG['image']['size']
-    img = cv2.resize(img, (img_size, img_size), interpolation=cv2.INTER_LANCZOS4)
-    
-    # Apply transform
-    img = _transform(img)
-    img = img.unsqueeze(0)
-    
-    return img
+def predict_many(image_paths):
+    """Run inference on several images in batched forward passes"""
+    return initialize_model().predict_many(image_paths)
+
+
+def predict(image_path):
+    """Run inference"""
+    return initialize_model().predict(image_path)
 
 
 # ============================================================================
-# PREDICTION
+# BULK MODE
 # ============================================================================
 
-def parse_class_name(class_name):
-    """Parse category and subtype"""
-    if class_name.startswith("Pest_"):
-        return "Pest", class_name.replace("Pest_", "")
-    elif class_name.startswith("Nutrient_"):
-        return "Nutrient Deficiency", class_name.replace("Nutrient_", "")
-    elif class_name == "Healthy":
-        return "Healthy", None
-    elif class_name == "Water_Stress":
-        return "Water Stress", None     
-    elif class_name == "Not_Plant": 
-        return "Invalid Input", None
-    else:
-        return class_name, None
+def collect_bulk_inputs(source, root=None):
+    """
+    Resolve a directory (recursive), a manifest file (one path per line,
+    relative paths resolved against `root` or the manifest's directory)
+    or a glob pattern
+    """
+    if os.path.isdir(source):
+        image_paths = []
+        for dirpath, dirs, files in os.walk(source):
+            dirs.sort()
+            for file in sorted(files):
+                if os.path.splitext(file)[1].lower() in IMAGE_EXTENSIONS:
+                    image_paths.append(os.path.join(dirpath, file))
+        return image_paths
+
+    if os.path.isfile(source) and os.path.splitext(source)[1].lower() in MANIFEST_EXTENSIONS:
+        base_dir = root or os.path.dirname(os.path.abspath(source))
+        image_paths = []
+        with open(source, 'r') as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                image_paths.append(line if os.path.isabs(line) else os.path.join(base_dir, line))
+        return image_paths
+
+    return sorted(
+        path for path in glob.glob(source, recursive=True)
+        if os.path.splitext(path)[1].lower() in IMAGE_EXTENSIONS
+    )
+
+
+def load_completed(output_path, output_format):
+    """Image paths already predicted successfully in a previous run"""
+    completed = set()
 
+    if not os.path.exists(output_path):
+        return completed
 
-def get_confidence_level(confidence):
-    """Confidence level from backend constants"""
-    if confidence >= 0.85:
-        return "Very High"
-    elif confidence >= 0.70:
-        return "High"
-    elif confidence >= 0.55:
-        return "Moderate"
+    with open(output_path, 'r', newline='') as f:
+        if output_format == 'csv':
+            for row in csv.DictReader(f):
+                if row.get('success') == 'True':
+                    completed.add(row['image_path'])
+        else:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # Partial line from an interrupted run
+                    continue
+                if record.get('success'):
+                    completed.add(record['image_path'])
+
+    return completed
+
+
+def decode_stream(engine, image_paths, workers, prefetch):
+    """
+    Decode images on a thread pool (OpenCV releases the GIL), yielding
+    (path, image, error) in input order with at most `prefetch` in flight
+    """
+    def decode(path):
+        try:
+            return engine.preprocess_image(path), None
+        except Exception as e:
+            return None, e
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        paths = iter(image_paths)
+
+        for path in paths:
+            pending.append((path, executor.submit(decode, path)))
+            if len(pending) >= prefetch:
+                break
+
+        while pending:
+            path, future = pending.popleft()
+            image, error = future.result()
+
+            next_path = next(paths, None)
+            if next_path is not None:
+                pending.append((next_path, executor.submit(decode, next_path)))
+
+            yield path, image, error
+
+
+class BulkWriter:
+    """Append JSONL or CSV records, flushed after every batch"""
+
+    def __init__(self, output_path, output_format):
+        self.output_format = output_format
+        write_header = not os.path.exists(output_path) or os.path.getsize(output_path) == 0
+        self.file = open(output_path, 'a', newline='')
+
+        if output_format == 'csv':
+            self.writer = csv.DictWriter(self.file, fieldnames=CSV_FIELDS)
+            if write_header:
+                self.writer.writeheader()
+
+    def write(self, image_path, result=None, error=None):
+        if self.output_format == 'csv':
+            row = {'image_path': image_path, 'success': error is None}
+            if result is not None:
+                row.update({key: result.get(key) for key in CSV_FIELDS if key in result})
+            if error is not None:
+                row['error'] = str(error)
+            self.writer.writerow(row)
+        else:
+            record = {'image_path': image_path, 'success': error is None}
+            if result is not None:
+                record['data'] = result
+            if error is not None:
+                record['error'] = str(error)
+                record['error_type'] = type(error).__name__
+            self.file.write(json.dumps(record) + "\n")
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def run_bulk(argv):
+    """Stream a directory / glob / manifest through batched inference"""
+    parser = argparse.ArgumentParser(
+        prog='inference.py --bulk',
+        description='Bulk prediction with parallel decode and batched forward passes'
+    )
+    parser.add_argument('source', help='Directory, glob pattern or manifest (.txt/.lst)')
+    parser.add_argument('--output', default='predictions.jsonl',
+                        help='Output file (default: predictions.jsonl)')
+    parser.add_argument('--format', choices=['jsonl', 'csv'], default=None,
+                        help='Output format (default: from --output extension)')
+    parser.add_argument('--batch_size', type=int, default=32,
+                        help='Images per forward pass (default: 32)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 4,
+                        help='Decode threads (default: CPU count)')
+    parser.add_argument('--no_resume', action='store_true',
+                        help='Re-predict files already present in the output')
+    args = parser.parse_args(argv)
+
+    output_format = args.format or ('csv' if args.output.lower().endswith('.csv') else 'jsonl')
+
+    image_paths = collect_bulk_inputs(args.source)
+    if not image_paths:
+        raise FileNotFoundError(f"No images found for: {args.source}")
+
+    skipped = 0
+    if args.no_resume:
+        if os.path.exists(args.output):
+            os.remove(args.output)
     else:
-        return "Low"
-
-
-def generate_explanation(predicted_class, confidence, conf_level):
-    """Generate explanation"""
-    explanations = {
-        "Healthy": "Plant appears healthy. No visible issues detected.",
-        "Pest_Fungal": "Fungal infection detected. Look for powdery spots, mold, or discoloration. Treatment: fungicide.",
-        "Pest_Bacterial": "Bacterial infection detected. Water-soaked lesions or wilting. Treatment: copper-based spray.",
-        "Pest_Insect": "Insect damage detected. Holes, chewed edges, or insect presence. Treatment: insecticide or natural predators.",
-        "Nutrient_Nitrogen": "Nitrogen deficiency detected. Yellowing of older leaves, stunted growth. Treatment: nitrogen fertilizer.",
-        "Nutrient_Potassium": "Potassium deficiency detected. Leaf edge browning, weak stems. Treatment: potassium fertilizer.",
-        "Water_Stress": "Water stress detected. Wilting or dry soil. Treatment: adjust watering schedule.",
-        "Not_Plant": "This is not a plant image. Please upload a clear image of a plant leaf for disease detection."
-    }
-    
-    explanation = explanations.get(
-        predicted_class,
-        f"Plant classified as {predicted_class}."
+        completed = load_completed(args.output, output_format)
+        remaining = [path for path in image_paths if path not in completed]
+        skipped = len(image_paths) - len(remaining)
+        image_paths = remaining
+
+    sys.stderr.write(
+        f"Bulk prediction: {len(image_paths)} images to process"
+        f" ({skipped} already predicted) -> {args.output}\n"
     )
-    
-    explanation += f" Confidence level: {conf_level} ({confidence*100:.1f}%)."
-    
-    if conf_level == "Low":
-        explanation += " Manual inspection recommended for confirmation."
-    
-    return explanation
+    sys.stderr.flush()
 
+    if not image_paths:
+        return
 
-@torch.no_grad()
-def predict(image_path):
-    """Run inference"""
-    initialize_model()
-    
-    # Preprocess
-    img = preprocess_image(image_path)
-    img = img.to(DEVICE)
-    
-    # Forward pass
-    outputs = _model(img)
-    probabilities = torch.softmax(outputs, dim=1)[0]
-    probabilities = probabilities.cpu().numpy()
-    
-    # Prediction
-    predicted_idx = np.argmax(probabilities)
-    predicted_class = CONFIG['classes'][predicted_idx]
-    confidence = float(probabilities[predicted_idx])
-    
-    # Parse
-    category, subtype = parse_class_name(predicted_class)
-    confidence_level = get_confidence_level(confidence)
-    
-    # All probabilities
-    all_probs = [
-        {
-            "class": CONFIG['classes'][i],
-            "confidence": float(probabilities[i]),
-            "confidence_percentage": float(probabilities[i] * 100)
-        }
-        for i in range(len(CONFIG['classes']))
-    ]
-    all_probs.sort(key=lambda x: x['confidence'], reverse=True)
-    
-    # Explanation
-    explanation = generate_explanation(predicted_class, confidence, confidence_level)
-    
-    # Result
-    result = {
-        "predicted_class": predicted_class,
-        "category": category,
-        "subtype": subtype,
-        "confidence": confidence,
-        "confidence_percentage": confidence * 100,
-        "confidence_level": confidence_level,
-        "all_probabilities": all_probs,
-        "explanation": explanation,
-        "model_version": "v1.0.0",
-        "model_name": "efficientnet_b2"
+    engine = initialize_model()
+    engine.max_batch_size = args.batch_size
+
+    writer = BulkWriter(args.output, output_format)
+    processed = 0
+    failed = 0
+    start = time.perf_counter()
+
+    def flush_batch(batch_paths, batch_images):
+        for path, probabilities in zip(batch_paths, engine.predict_batch(batch_images)):
+            writer.write(path, result=engine.build_result(probabilities))
+
+    try:
+        batch_paths, batch_images = [], []
+        stream = decode_stream(engine, image_paths, args.workers,
+                               prefetch=max(args.batch_size * 2, args.workers * 4))
+
+        for path, image, error in stream:
+            if error is not None:
+                writer.write(path, error=error)
+                failed += 1
+                processed += 1
+                continue
+
+            batch_paths.append(path)
+            batch_images.append(image)
+
+            if len(batch_images) == args.batch_size:
+                flush_batch(batch_paths, batch_images)
+                processed += len(batch_paths)
+                batch_paths, batch_images = [], []
+                writer.flush()
+
+                elapsed = time.perf_counter() - start
+                sys.stderr.write(
+                    f"  {processed}/{len(image_paths)} images | "
+                    f"{processed / elapsed:.1f} img/s\n"
+                )
+                sys.stderr.flush()
+
+        if batch_images:
+            flush_batch(batch_paths, batch_images)
+            processed += len(batch_paths)
+    finally:
+        writer.close()
+
+    elapsed = time.perf_counter() - start
+    sys.stderr.write(
+        f"✅ Bulk prediction complete: {processed} images in {elapsed:.1f}s "
+        f"({processed / elapsed:.1f} img/s), {failed} failed\n"
+    )
+    sys.stderr.flush()
+
+
+# ============================================================================
+# DECODE PARITY CHECK
+# ============================================================================
+
+def label_from_path(image_path):
+    """Class index from a class-named directory in the path (None if absent)"""
+    parts = os.path.normpath(image_path).split(os.sep)
+    for part in reversed(parts[:-1]):
+        if part in CONFIG['classes']:
+            return CONFIG['classes'].index(part)
+    return None
+
+
+def run_decode_parity(argv):
+    """
+    Compare full-resolution decode with the reduced-resolution JPEG path:
+    decode time, decoded bytes, top-1 agreement and (when images sit in
+    class-named folders, e.g. a split manifest with --root) accuracy
+    """
+    parser = argparse.ArgumentParser(
+        prog='inference.py --decode-parity',
+        description='Accuracy and speed parity of reduced-resolution JPEG decode'
+    )
+    parser.add_argument('source', help='Directory, glob pattern or manifest (.txt/.lst)')
+    parser.add_argument('--root', default=None,
+                        help='Base directory for relative manifest entries '
+                             '(e.g. data/raw for a split file)')
+    parser.add_argument('--batch_size', type=int, default=32)
+    parser.add_argument('--min_agreement', type=float, default=0.99,
+                        help='Fail if top-1 agreement is below this (default: 0.99)')
+    args = parser.parse_args(argv)
+
+    image_paths = collect_bulk_inputs(args.source, args.root)
+    if not image_paths:
+        raise FileNotFoundError(f"No images found for: {args.source}")
+
+    engine = initialize_model()
+    img_size = engine.img_size
+
+    stats = {
+        'full': {'seconds': 0.0, 'bytes': 0, 'preds': [], 'probs': []},
+        'reduced': {'seconds': 0.0, 'bytes': 0, 'preds': [], 'probs': []}
     }
-    
-    return result
+    labels = []
+
+    def run_chunk(chunk):
+        batches = {'full': [], 'reduced': []}
+        for path in chunk:
+            for mode in ('full', 'reduced'):
+                start = time.perf_counter()
+                img = read_image(path, img_size, reduced_decode=(mode == 'reduced'))
+                stats[mode]['seconds'] += time.perf_counter() - start
+                if img is None:
+                    raise ValueError(f"Cannot read image: {path}")
+                stats[mode]['bytes'] += img.nbytes
+                batches[mode].append(engine.prepare_image(img))
+            labels.append(label_from_path(path))
+
+        for mode, images in batches.items():
+            probabilities = engine.predict_batch(images)
+            stats[mode]['preds'].extend(np.argmax(probabilities, axis=1).tolist())
+            stats[mode]['probs'].append(probabilities)
+
+    for start in range(0, len(image_paths), args.batch_size):
+        run_chunk(image_paths[start:start + args.batch_size])
+
+    n = len(image_paths)
+    full_preds = np.array(stats['full']['preds'])
+    reduced_preds = np.array(stats['reduced']['preds'])
+    prob_diff = np.abs(np.concatenate(stats['full']['probs']) -
+                       np.concatenate(stats['reduced']['probs']))
+    agreement = float(np.mean(full_preds == reduced_preds))
+
+    print("\n" + "=" * 70)
+    print("REDUCED-RESOLUTION DECODE PARITY")
+    print("=" * 70)
+    print(f"Images: {n}")
+    for mode in ('full', 'reduced'):
+        print(f"  {mode:8}: decode {stats[mode]['seconds'] / n * 1000:7.2f} ms/img | "
+              f"decoded {stats[mode]['bytes'] / n / 1024 / 1024:7.2f} MB/img")
+    print(f"Decode speedup: {stats['full']['seconds'] / max(stats['reduced']['seconds'], 1e-9):.1f}x")
+    print(f"Top-1 agreement: {agreement * 100:.2f}%")
+    print(f"Probability diff: mean {prob_diff.mean():.4f} | max {prob_diff.max():.4f}")
+
+    labelled = [i for i, label in enumerate(labels) if label is not None]
+    if labelled:
+        y_true = np.array([labels[i] for i in labelled])
+        full_acc = float(np.mean(full_preds[labelled] == y_true))
+        reduced_acc = float(np.mean(reduced_preds[labelled] == y_true))
+        print(f"Accuracy ({len(labelled)} labelled): full {full_acc * 100:.2f}% | "
+              f"reduced {reduced_acc * 100:.2f}%")
+    print("=" * 70 + "\n")
+
+    if agreement < args.min_agreement:
+        print(f"✗ Agreement below {args.min_agreement * 100:.1f}%")
+        sys.exit(1)
+
+    print("✓ Reduced-resolution decode matches full decode")
 
 
 # ============================================================================
@@ -351,24 +424,32 @@ def predict(image_path):
 
 def main():
     """Main entry point"""
+    if len(sys.argv) > 1 and sys.argv[1] == "--bulk":
+        run_bulk(sys.argv[2:])
+        return
+
+    if len(sys.argv) > 1 and sys.argv[1] == "--decode-parity":
+        run_decode_parity(sys.argv[2:])
+        return
+
     try:
         if len(sys.argv) < 2:
             raise ValueError("No image path provided")
-        
+
         image_path = sys.argv[1]
-        
+
         if not os.path.exists(image_path):
             raise FileNotFoundError(f"Image not found: {image_path}")
-        
+
         # Run prediction
         result = predict(image_path)
-        
+
         # Output JSON
         print(json.dumps({
             "success": True,
             "data": result
         }))
-    
+
     except Exception as e:
         print(json.dumps({
             "success": False,
@@ -379,4 +460,4 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,543 @@
+"""
+Shared Inference Engine
+Single implementation of model definition, preprocessing, batched softmax
+and response building used by:
+    - backend/ai/inference.py          (single-shot CLI)
+    - backend/ai/inference_server.py   (worker pool server)
+    - training/inference.py            (PlantHealthPredictor)
+
+predict_many() is the primary API; predict() is a batch of one.
+"""
+
+import time
+import cv2
+import torch
+import torch.nn as nn
+import numpy as np
+
+from image_header import probe_image
+
+# ============================================================================
+# CONFIGURATION - MATCHES TRAINING EXACTLY
+# ============================================================================
+
+CONFIG = {
+    'image': {
+        'size': 224,
+        'normalize_mean': [0.485, 0.456, 0.406],
+        'normalize_std': [0.229, 0.224, 0.225],
+        'max_pixel_value': 255.0
+    },
+    'classes': [
+        "Healthy",
+        "Pest_Fungal",
+        "Pest_Bacterial",
+        "Pest_Insect",
+        "Nutrient_Nitrogen",
+        "Nutrient_Potassium",
+        "Water_Stress",
+        "Not_Plant"
+    ],
+    'model': {
+        'name': 'efficientnet_b2',
+        'dropout': 0.2,
+        'num_classes': 8
+    }
+}
+
+MODEL_VERSION = "v1.0.0"
+DEFAULT_MAX_BATCH_SIZE = 16
+
+# libjpeg can decode directly at 1/2, 1/4 or 1/8 scale in the DCT domain
+REDUCED_DECODE_FLAGS = [
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2)
+]
+
+# Upload limits checked from the header before any pixel data is decoded
+MIN_IMAGE_SIZE = 50
+MAX_IMAGE_PIXELS = 100_000_000
+
+
+# ============================================================================
+# MODEL DEFINITION - EXACT MATCH TO TRAINING
+# ============================================================================
+
+class PlantHealthModel(nn.Module):
+    """
+    Recreates EXACT architecture from training
+    Uses efficientnet_b2 (NOT efficientnetv2_b2)
+    """
+    def __init__(self, model_name='efficientnet_b2', num_classes=7, dropout=0.2):
+        super(PlantHealthModel, self).__init__()
+
+        try:
+            import timm
+        except ImportError:
+            raise ImportError("TIMM is required: pip install timm==0.9.16")
+
+        # Normalize model name (remove tf_ prefix if present)
+        timm_model_name = model_name.replace('tf_', '')
+
+        self.base_model = timm.create_model(
+            timm_model_name,
+            pretrained=False,
+            num_classes=0  # Remove head
+        )
+
+        feature_dim = self.base_model.num_features
+
+        self.classifier = nn.Sequential(
+            nn.BatchNorm1d(feature_dim),
+            nn.Dropout(dropout),
+            nn.Linear(feature_dim, 512),
+            nn.ReLU(inplace=True),
+
+            nn.BatchNorm1d(512),
+            nn.Dropout(dropout * 0.5),
+            nn.Linear(512, 256),
+            nn.ReLU(inplace=True),
+
+            nn.BatchNorm1d(256),
+            nn.Dropout(dropout * 0.3),
+            nn.Linear(256, num_classes)
+        )
+
+    def forward(self, x):
+        features = self.base_model(x)
+        output = self.classifier(features)
+        return output
+
+
+def create_model(config=CONFIG):
+    """Instantiate the inference architecture from config"""
+    return PlantHealthModel(
+        model_name=config['model']['name'],
+        num_classes=config['model']['num_classes'],
+        dropout=config['model']['dropout']
+    )
+
+
+def torch_load(source, device):
+    """
+    Load a checkpoint from a path or buffer
+    Allowlists numpy globals for PyTorch >= 2.6, falls back for older PyTorch
+    """
+    try:
+        safe_globals = [
+            np.dtype, np.int64, np.float32, np.float64,
+            np.bool_, np.core.multiarray.scalar
+        ]
+
+        with torch.serialization.safe_globals(safe_globals):
+            return torch.load(source, map_location=device, weights_only=False)
+    except (AttributeError, TypeError):
+        return torch.load(source, map_location=device)
+
+
+def extract_state_dict(checkpoint):
+    """Handle the checkpoint layouts produced by training and older exports"""
+    if not isinstance(checkpoint, dict):
+        raise ValueError("Unexpected checkpoint format")
+
+    if 'model_state_dict' in checkpoint:
+        return checkpoint['model_state_dict']
+    elif 'state_dict' in checkpoint:
+        return checkpoint['state_dict']
+    else:
+        # Assume checkpoint is state_dict
+        return checkpoint
+
+
+def get_calibration(checkpoint):
+    """
+    Temperature written by training/calibrate_confidence.py
+
+    Returns:
+        (temperature, calibrated) - (1.0, False) for uncalibrated checkpoints
+    """
+    if not isinstance(checkpoint, dict) or not checkpoint.get('calibrated', False):
+        return 1.0, False
+
+    temperature = float(checkpoint.get('temperature', 1.0))
+    if temperature <= 0:
+        raise ValueError(f"Invalid calibration temperature: {temperature}")
+
+    return temperature, True
+
+
+def optimize_for_device(device):
+    """GPU optimizations (no-op on CPU)"""
+    if device.type == 'cuda':
+        torch.backends.cudnn.benchmark = True
+        if hasattr(torch.backends.cuda.matmul, 'allow_tf32'):
+            torch.backends.cuda.matmul.allow_tf32 = True
+        if hasattr(torch.backends.cudnn, 'allow_tf32'):
+            torch.backends.cudnn.allow_tf32 = True
+
+
+def load_model(model_path, device, config=CONFIG):
+    """
+    Load a plain .pth checkpoint into the inference architecture
+
+    Returns:
+        (model, checkpoint)
+    """
+    model = create_model(config)
+    checkpoint = torch_load(model_path, device)
+    model.load_state_dict(extract_state_dict(checkpoint))
+
+    model = model.to(device)
+    model.eval()
+    optimize_for_device(device)
+
+    return model, checkpoint
+
+
+# ============================================================================
+# IMAGE DECODING
+# ============================================================================
+
+def validate_image_header(header, image_path):
+    """
+    Reject unreadable, tiny or oversized uploads using only the header
+
+    Raises:
+        ValueError: with a message suitable for the API response
+    """
+    if header is None:
+        raise ValueError(f"Cannot read image: {image_path} (unsupported or corrupt file)")
+
+    width, height, _ = header
+
+    if width < MIN_IMAGE_SIZE or height < MIN_IMAGE_SIZE:
+        raise ValueError(
+            f"Image too small: {width}x{height} (minimum {MIN_IMAGE_SIZE}x{MIN_IMAGE_SIZE})"
+        )
+
+    if width * height > MAX_IMAGE_PIXELS:
+        raise ValueError(
+            f"Image too large: {width}x{height} (maximum {MAX_IMAGE_PIXELS // 1_000_000} MP)"
+        )
+
+
+def select_decode_flag(width, height, fmt, target_size):
+    """
+    Smallest DCT-scaled JPEG decode that still covers target_size on both
+    sides; everything else is decoded at full resolution
+    """
+    if fmt != 'JPEG':
+        return cv2.IMREAD_COLOR, 1
+
+    for factor, flag in REDUCED_DECODE_FLAGS:
+        # libjpeg rounds scaled dimensions up
+        if -(-width // factor) >= target_size and -(-height // factor) >= target_size:
+            return flag, factor
+
+    return cv2.IMREAD_COLOR, 1
+
+
+def read_image(image_path, target_size, reduced_decode=True, header=None):
+    """
+    Decode to BGR, using reduced-resolution JPEG decode for large images
+
+    A 12 MP phone photo is decoded at 1/8 scale (~0.5 MB instead of ~36 MB)
+    before the final LANCZOS4 resize to target_size. Pass `header` when the
+    file has already been probed.
+    """
+    flag = cv2.IMREAD_COLOR
+
+    if reduced_decode:
+        if header is None:
+            header = probe_image(image_path)
+        if header is not None:
+            flag, _ = select_decode_flag(*header, target_size)
+
+    return cv2.imread(image_path, flag)
+
+
+# ============================================================================
+# RESPONSE BUILDING
+# ============================================================================
+
+def parse_class_name(class_name):
+    """Parse category and subtype"""
+    if class_name.startswith("Pest_"):
+        return "Pest", class_name.replace("Pest_", "")
+    elif class_name.startswith("Nutrient_"):
+        return "Nutrient Deficiency", class_name.replace("Nutrient_", "")
+    elif class_name == "Healthy":
+        return "Healthy", None
+    elif class_name == "Water_Stress":
+        return "Water Stress", None
+    elif class_name == "Not_Plant":
+        return "Invalid Input", None
+    else:
+        return class_name, None
+
+
+def get_confidence_level(confidence):
+    """Confidence level from backend constants"""
+    if confidence >= 0.85:
+        return "Very High"
+    elif confidence >= 0.70:
+        return "High"
+    elif confidence >= 0.55:
+        return "Moderate"
+    else:
+        return "Low"
+
+
+def generate_explanation(predicted_class, confidence, conf_level):
+    """Generate detailed explanation"""
+    explanations = {
+        "Healthy": "Plant appears healthy with no visible issues detected.",
+        "Pest_Fungal": "Fungal infection detected. Look for powdery spots, mold, or discoloration. Treatment: Apply fungicide and improve air circulation.",
+        "Pest_Bacterial": "Bacterial infection detected. Water-soaked lesions or wilting observed. Treatment: Use copper-based bactericide and remove infected parts.",
+        "Pest_Insect": "Insect damage detected. Holes, chewed edges, or insect presence. Treatment: Apply appropriate insecticide or use neem oil.",
+        "Nutrient_Nitrogen": "Nitrogen deficiency detected. Yellowing of older leaves, stunted growth. Treatment: Apply nitrogen-rich fertilizer.",
+        "Nutrient_Potassium": "Potassium deficiency detected. Leaf edge browning, weak stems. Treatment: Apply potassium fertilizer.",
+        "Water_Stress": "Water stress detected. Wilting or dry soil conditions. Treatment: Adjust watering schedule.",
+        "Not_Plant": "This is not a plant image. Please upload a clear image of a plant leaf for disease detection."
+    }
+
+    explanation = explanations.get(
+        predicted_class,
+        f"Plant classified as {predicted_class}."
+    )
+
+    explanation += f" Confidence level: {conf_level} ({confidence*100:.1f}%)."
+
+    if conf_level == "Low":
+        explanation += " Manual inspection recommended for confirmation."
+
+    return explanation
+
+
+def get_recommendations(predicted_class):
+    """Get treatment recommendations"""
+    recommendations = {
+        "Healthy": [
+            "Continue current care routine",
+            "Monitor for any changes",
+            "Maintain proper watering and sunlight"
+        ],
+        "Pest_Fungal": [
+            "Apply fungicide (copper-based or organic)",
+            "Improve air circulation around plant",
+            "Remove affected leaves",
+            "Reduce humidity if possible"
+        ],
+        "Pest_Bacterial": [
+            "Use copper-based bactericide",
+            "Remove and destroy infected parts",
+            "Avoid overhead watering",
+            "Sterilize tools between plants"
+        ],
+        "Pest_Insect": [
+            "Identify specific insect pest",
+            "Apply appropriate insecticide",
+            "Use neem oil for organic treatment",
+            "Introduce beneficial insects"
+        ],
+        "Nutrient_Nitrogen": [
+            "Apply nitrogen-rich fertilizer",
+            "Use compost or manure",
+            "Consider foliar feeding",
+            "Test soil pH"
+        ],
+        "Nutrient_Potassium": [
+            "Apply potassium fertilizer",
+            "Use wood ash or kelp meal",
+            "Avoid over-fertilization with nitrogen",
+            "Monitor leaf symptoms"
+        ],
+        "Water_Stress": [
+            "Adjust watering schedule",
+            "Check soil moisture regularly",
+            "Improve drainage if waterlogged",
+            "Mulch to retain moisture"
+        ],
+        "Not_Plant": [
+            "Please upload a clear image of a plant leaf for disease detection."
+        ]
+    }
+
+    return recommendations.get(predicted_class, ["Consult agricultural expert"])
+
+
+# ============================================================================
+# ENGINE
+# ============================================================================
+
+class InferenceEngine:
+    """
+    Batched inference around a loaded PlantHealthModel
+
+    Images are decoded and resized to uint8 on the host; normalization,
+    the NHWC -> NCHW permute and the (temperature-scaled) softmax run
+    once per batch on the model device. With a calibrated temperature the
+    logits are divided inside the same softmax, so confidence levels and
+    low-confidence warnings are derived from calibrated probabilities.
+    """
+
+    def __init__(self, model, device, config=CONFIG, temperature=1.0,
+                 calibrated=False, max_batch_size=DEFAULT_MAX_BATCH_SIZE,
+                 reduced_decode=True):
+        self.model = model
+        self.device = device
+        self.config = config
+        self.class_names = config['classes']
+        self.img_size = config['image']['size']
+        self.max_batch_size = max_batch_size
+        self.reduced_decode = reduced_decode
+        self.temperature = float(temperature)
+        self.calibrated = calibrated
+
+        self.model_name = config.get('model', {}).get('name', CONFIG['model']['name'])
+
+        max_pixel = config['image'].get('max_pixel_value', 255.0)
+        mean = torch.tensor(config['image']['normalize_mean'], dtype=torch.float32)
+        std = torch.tensor(config['image']['normalize_std'], dtype=torch.float32)
+
+        # (x / max_pixel - mean) / std folded into one scale and shift
+        self._scale = (1.0 / (max_pixel * std)).view(1, 3, 1, 1).to(device)
+        self._shift = (mean / std).view(1, 3, 1, 1).to(device)
+
+    def preprocess_image(self, image_path):
+        """
+        EXACT preprocessing from training: BGR->RGB, LANCZOS4 resize
+        Large JPEGs are decoded at reduced resolution first (see read_image)
+        Unreadable, tiny or oversized files are rejected from the header
+        before any pixel data is decoded.
+
+        Returns:
+            uint8 RGB array of shape (size, size, 3)
+        """
+        header = probe_image(image_path)
+        validate_image_header(header, image_path)
+
+        img = read_image(image_path, self.img_size, self.reduced_decode, header=header)
+
+        if img is None:
+            raise ValueError(f"Cannot read image: {image_path}")
+
+        return self.prepare_image(img)
+
+    def prepare_image(self, img):
+        """Decoded BGR array -> resized uint8 RGB model input"""
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+        img = cv2.resize(img, (self.img_size, self.img_size),
+                         interpolation=cv2.INTER_LANCZOS4)
+
+        return img
+
+    def normalize(self, images):
+        """uint8 NHWC numpy batch -> normalized float NCHW tensor on device"""
+        batch = torch.from_numpy(np.ascontiguousarray(images)).to(self.device, non_blocking=True)
+        batch = batch.permute(0, 3, 1, 2).float()
+        return batch * self._scale - self._shift
+
+    @torch.no_grad()
+    def predict_batch(self, images):
+        """
+        Forward preprocessed images in chunks of max_batch_size
+
+        Args:
+            images: sequence of uint8 (size, size, 3) arrays
+
+        Returns:
+            numpy array (N, num_classes) of probabilities
+        """
+        if len(images) == 0:
+            return np.zeros((0, len(self.class_names)), dtype=np.float32)
+
+        chunks = []
+        for start in range(0, len(images), self.max_batch_size):
+            batch = self.normalize(np.stack(images[start:start + self.max_batch_size]))
+            logits = self.model(batch)
+            if self.temperature != 1.0:
+                logits = logits / self.temperature
+            chunks.append(torch.softmax(logits.float(), dim=1).cpu())
+
+        return torch.cat(chunks).numpy()
+
+    def build_result(self, probabilities):
+        """Build the response dict for one row of probabilities"""
+        predicted_idx = int(np.argmax(probabilities))
+        predicted_class = self.class_names[predicted_idx]
+        confidence = float(probabilities[predicted_idx])
+
+        category, subtype = parse_class_name(predicted_class)
+        confidence_level = get_confidence_level(confidence)
+
+        all_probs = [
+            {
+                "class": self.class_names[i],
+                "confidence": float(probabilities[i]),
+                "confidence_percentage": float(probabilities[i] * 100)
+            }
+            for i in range(len(self.class_names))
+        ]
+        all_probs.sort(key=lambda x: x['confidence'], reverse=True)
+
+        explanation = generate_explanation(predicted_class, confidence, confidence_level)
+
+        return {
+            "predicted_class": predicted_class,
+            "category": category,
+            "subtype": subtype,
+            "confidence": confidence,
+            "confidence_percentage": confidence * 100,
+            "confidence_level": confidence_level,
+            "all_probabilities": all_probs,
+            "explanation": explanation,
+            "recommendations": get_recommendations(predicted_class),
+            "calibrated": self.calibrated,
+            "temperature": self.temperature,
+            "model_version": MODEL_VERSION,
+            "model_name": self.model_name
+        }
+
+    def predict_many(self, image_paths):
+        """Run inference on several images with batched forward passes"""
+        images = [self.preprocess_image(path) for path in image_paths]
+        probabilities = self.predict_batch(images)
+        return [self.build_result(row) for row in probabilities]
+
+    def predict(self, image_path):
+        """Run inference on a single image"""
+        return self.predict_many([image_path])[0]
+
+    @torch.no_grad()
+    def warmup(self, batch_sizes=(1,), iterations=3):
+        """
+        Run synthetic batches through the full inference path
+
+        The first real request would otherwise pay for allocator growth,
+        kernel selection (cudnn.benchmark) and, for TorchScript or compiled
+        models, graph specialization. Each batch size is run `iterations`
+        times so every shape is specialized.
+
+        Returns:
+            Warm-up duration in seconds
+        """
+        if iterations <= 0:
+            return 0.0
+
+        start = time.perf_counter()
+
+        # Exercise the OpenCV resize path once
+        dummy = np.random.randint(0, 256, (self.img_size * 2, self.img_size * 2, 3), dtype=np.uint8)
+        dummy = cv2.resize(dummy, (self.img_size, self.img_size), interpolation=cv2.INTER_LANCZOS4)
+
+        for batch_size in batch_sizes:
+            images = [dummy] * batch_size
+            for _ in range(iterations):
+                self.predict_batch(images)
+
+        if self.device.type == 'cuda':
+            torch.cuda.synchronize()
+
+        return time.perf_counter() - start
@@ -5,6 +5,7 @@ Encrypts the PyTorch model to prevent unauthorized access
 
 import torch
 import os
+import sys
 from cryptography.fernet import Fernet
 import json
 import hashlib
@@ -105,7 +106,9 @@ def encrypt_existing_model():
     """Encrypt your existing model"""
     encryptor = ModelEncryption()
     
-    original = './saved_models/best_model.pth'
+    # Pass the calibrated checkpoint (calibrate_confidence.py output) to ship
+    # calibrated confidence; the temperature travels inside the encrypted data
+    original = sys.argv[1] if len(sys.argv) > 1 else './saved_models/best_model.pth'
     encrypted = './saved_models/best_model.encrypted'
     
     if not os.path.exists(original):
@@ -8,12 +8,14 @@ import torch.nn as nn
 import io
 import os
 from model_encryption import ModelEncryption
+from inference_engine import torch_load, extract_state_dict
 
 class SecureModelLoader:
     def __init__(self, key_path='./secrets/model.key'):
         self.encryptor = ModelEncryption(key_path)
     
-    def load_encrypted_model(self, encrypted_path, model_class, device='cpu'):
+    def load_encrypted_model(self, encrypted_path, model_class, device='cpu',
+                             return_checkpoint=False):
         """
         Load and decrypt model
         
@@ -21,9 +23,11 @@ class SecureModelLoader:
             encrypted_path: Path to encrypted model
             model_class: Model class to instantiate
             device: Device to load model on
+            return_checkpoint: Also return the decrypted checkpoint dict
+                (calibration temperature, metadata)
             
         Returns:
-            Loaded model
+            Loaded model, or (model, checkpoint) if return_checkpoint
         """
         # Decrypt model data
         decrypted_data = self.encryptor.decrypt_model(encrypted_path)
@@ -31,36 +35,19 @@ class SecureModelLoader:
         # Load from memory (never write to disk)
         buffer = io.BytesIO(decrypted_data)
         
-        try:
-            # Try new PyTorch format
-            import numpy as np
-            safe_globals = [
-                np.dtype, np.int64, np.float32, np.float64,
-                np.bool_, np.core.multiarray.scalar
-            ]
-            
-            with torch.serialization.safe_globals(safe_globals):
-                checkpoint = torch.load(buffer, map_location=device, weights_only=False)
-        except (AttributeError, TypeError):
-            # Fallback for older PyTorch
-            checkpoint = torch.load(buffer, map_location=device)
+        checkpoint = torch_load(buffer, device)
         
         # Create model
         model = model_class()
         
         # Load weights
-        if isinstance(checkpoint, dict):
-            if 'model_state_dict' in checkpoint:
-                model.load_state_dict(checkpoint['model_state_dict'])
-            elif 'state_dict' in checkpoint:
-                model.load_state_dict(checkpoint['state_dict'])
-            else:
-                model.load_state_dict(checkpoint)
-        else:
-            raise ValueError("Unexpected checkpoint format")
+        model.load_state_dict(extract_state_dict(checkpoint))
         
         model.to(device)
         model.eval()
         
+        if return_checkpoint:
+            return model, checkpoint
+        
         return model
     
\ No newline at end of file
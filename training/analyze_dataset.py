@@ -1,19 +1,25 @@
 import os
-import cv2
+import time
 import yaml
+import argparse
 import numpy as np
 from pathlib import Path
 from collections import Counter
 import matplotlib.pyplot as plt
+from image_probe import probe_images, verify_images
 
 # Load configuration
 with open('config.yaml', 'r') as f:
     config = yaml.safe_load(f)
 
 
-def analyze_raw_dataset():
+def analyze_raw_dataset(deep_verify=False, workers=None):
     """
     Comprehensive analysis of the raw dataset
+
+    Dimensions and format come from image headers only. With deep_verify
+    every image that passes the header probe is also fully decoded to
+    catch truncated or corrupt pixel data.
     """
     print("\n" + "="*70)
     print("DATASET ANALYSIS TOOL")
@@ -28,8 +34,10 @@ def analyze_raw_dataset():
     class_stats = {}
     total_images = 0
     file_extensions = Counter()
+    image_formats = Counter()
     image_sizes = []
     corrupted = []
+    start_time = time.time()
     
     # Analyze each class
     for cls in os.listdir(raw_dir):
@@ -55,20 +63,28 @@ def analyze_raw_dataset():
                     images.append(os.path.join(root, file))
                     file_extensions[ext] += 1
         
-        # Analyze images
+        # Analyze images (header only)
         valid_count = 0
         sizes = []
+        probed = []
         
-        for img_path in images:
-            try:
-                img = cv2.imread(img_path)
-                if img is not None:
-                    sizes.append((img.shape[0], img.shape[1]))
-                    valid_count += 1
-                else:
-                    corrupted.append(img_path)
-            except:
+        for img_path, header in zip(images, probe_images(images, workers)):
+            if header is None:
                 corrupted.append(img_path)
+            else:
+                probed.append((img_path, header))
+        
+        if deep_verify and probed:
+            verified = verify_images([img_path for img_path, _ in probed], workers)
+            for (img_path, _), ok in zip(probed, verified):
+                if not ok:
+                    corrupted.append(img_path)
+            probed = [item for item, ok in zip(probed, verified) if ok]
+        
+        for img_path, (width, height, fmt) in probed:
+            sizes.append((height, width))
+            image_formats[fmt] += 1
+            valid_count += 1
         
         class_stats[cls] = {
             'total': len(images),
@@ -129,6 +145,12 @@ def analyze_raw_dataset():
         print(f"  {ext:10} : {count:4} files")
     print()
     
+    # Actual formats (from headers; catches e.g. PNGs saved as .jpg)
+    print("Image Formats:")
+    for fmt, count in image_formats.most_common():
+        print(f"  {fmt:10} : {count:4} files")
+    print()
+    
     # Image sizes
     if image_sizes:
         heights, widths = zip(*image_sizes)
@@ -143,6 +165,12 @@ def analyze_raw_dataset():
         print()
     
     # Corrupted files
+    scan_mode = "header probe + deep verify" if deep_verify else "header probe"
+    print(f"Scan: {scan_mode} in {time.time() - start_time:.1f}s")
+    if not deep_verify:
+        print("  (run with --deep_verify to fully decode every image)")
+    print()
+    
     if corrupted:
         print(f"■ Corrupted Files: {len(corrupted)}")
         for corrupt_file in corrupted[:5]:
@@ -271,7 +299,14 @@ def visualize_class_distribution():
 
 
 if __name__ == "__main__":
-    analyze_raw_dataset()
+    parser = argparse.ArgumentParser(description='Analyze the raw dataset')
+    parser.add_argument('--deep_verify', action='store_true',
+                        help='Fully decode every image to detect corrupt pixel data (slow)')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Threads used for probing / verification')
+    args = parser.parse_args()
+    
+    analyze_raw_dataset(deep_verify=args.deep_verify, workers=args.workers)
     
     try:
         visualize_class_distribution()
@@ -0,0 +1,394 @@
+"""
+Batched Tensor Augmentation
+The training augmentations of PlantHealthDataset, applied to whole
+[B, 3, H, W] batches (uint8 or float, 0-255) with vectorized torch ops
+after collation, on the training device. DataLoader workers then only
+decode images, so on CPU the data pipeline no longer bounds throughput.
+
+Same probabilities and ranges as the albumentations chain:
+    - horizontal / vertical flip
+    - Rotate + ShiftScaleRotate + GridDistortion (the ElasticTransform
+      branch is approximated by the smooth grid distortion) combined into
+      one sampling grid and a single reflect-padded resample
+    - RandomBrightnessContrast and HueSaturationValue (OpenCV HSV units)
+    - GaussianBlur / MedianBlur (3 or 5), GaussNoise, CoarseDropout
+    - normalization
+
+Enabled with training.batch_augmentation: the train dataset then returns
+uint8 arrays and get_data_loaders() wraps its loader in AugmentedLoader.
+
+Parity check against the albumentations pipeline:
+    python batch_augment.py --samples 256 --repeats 4
+"""
+
+import os
+import time
+import yaml
+import argparse
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+# Load configuration
+with open('config.yaml', 'r') as f:
+    config = yaml.safe_load(f)
+
+
+def rgb_to_hsv(img):
+    """[N, 3, H, W] RGB in [0, 1] -> hue, saturation, value in [0, 1]"""
+    maxc, argmax = img.max(dim=1)
+    minc = img.min(dim=1).values
+    delta = maxc - minc
+    safe_delta = torch.where(delta > 0, delta, torch.ones_like(delta))
+
+    r, g, b = img[:, 0], img[:, 1], img[:, 2]
+    rc = (maxc - r) / safe_delta
+    gc = (maxc - g) / safe_delta
+    bc = (maxc - b) / safe_delta
+
+    hue = torch.where(argmax == 0, bc - gc, torch.where(argmax == 1, 2.0 + rc - bc, 4.0 + gc - rc))
+    hue = torch.where(delta > 0, (hue / 6.0) % 1.0, torch.zeros_like(hue))
+    saturation = torch.where(maxc > 0, delta / torch.where(maxc > 0, maxc, torch.ones_like(maxc)),
+                             torch.zeros_like(maxc))
+    return hue, saturation, maxc
+
+
+def hsv_to_rgb(hue, saturation, value):
+    """Inverse of rgb_to_hsv -> [N, 3, H, W] RGB in [0, 1]"""
+    sector = torch.floor(hue * 6.0)
+    frac = hue * 6.0 - sector
+    sector = sector.long() % 6
+
+    p = value * (1.0 - saturation)
+    q = value * (1.0 - saturation * frac)
+    t = value * (1.0 - saturation * (1.0 - frac))
+
+    index = sector.unsqueeze(1)
+    r = torch.stack([value, q, p, p, t, value], dim=1).gather(1, index)
+    g = torch.stack([t, value, value, q, p, p], dim=1).gather(1, index)
+    b = torch.stack([p, p, t, value, value, q], dim=1).gather(1, index)
+    return torch.cat([r, g, b], dim=1)
+
+
+def gaussian_kernel(ksize):
+    """OpenCV's default sigma for a kernel size (sigma=0 in cv2.GaussianBlur)"""
+    sigma = 0.3 * ((ksize - 1) * 0.5 - 1) + 0.8
+    coords = torch.arange(ksize, dtype=torch.float32) - (ksize - 1) / 2
+    kernel = torch.exp(-coords ** 2 / (2 * sigma ** 2))
+    kernel = kernel / kernel.sum()
+    return torch.outer(kernel, kernel)
+
+
+class BatchAugmentation:
+    """
+    Vectorized training augmentation + normalization for collated batches
+
+    Random parameters are drawn per sample from the torch RNG of the
+    batch's device, so runs stay reproducible under the training seed.
+    """
+
+    def __init__(self, device=None):
+        aug_config = config['augmentation']
+        prob = aug_config.get('augmentation_prob', 0.65)
+
+        self.hflip_p = 0.5 if aug_config['horizontal_flip'] else 0.0
+        self.vflip_p = 0.5 if aug_config['vertical_flip'] else 0.0
+        self.rotate_p = prob * 0.7
+        self.rotate_limit = aug_config['rotation_range']
+        self.shift_scale_p = prob * 0.7
+        self.shift_x = aug_config['width_shift']
+        self.shift_y = aug_config.get('height_shift', aug_config['width_shift'])
+        self.scale_limit = aug_config['zoom_range']
+        self.distort_p = prob * 0.25
+        self.distort_steps = 5
+        self.distort_limit = 0.2
+        self.brightness_contrast_p = prob * 0.5
+        self.brightness_limit = 0.15
+        self.contrast_limit = 0.15
+        self.hsv_p = prob * 0.5
+        self.hue_limit, self.sat_limit, self.val_limit = 12, 20, 12
+        self.blur_p = prob * 0.2
+        self.noise_p = prob * 0.15
+        self.noise_var = (10.0, 30.0)
+        self.dropout_p = prob * 0.2
+        self.holes = (1, 4)
+        self.hole_size = (8, 20)
+
+        max_pixel = config['image']['max_pixel_value']
+        self.mean = torch.tensor(config['image']['normalize_mean']).view(1, 3, 1, 1) * max_pixel
+        self.std = torch.tensor(config['image']['normalize_std']).view(1, 3, 1, 1) * max_pixel
+        self.kernels = {k: gaussian_kernel(k) for k in (3, 5)}
+        if device is not None:
+            self.to(device)
+
+    def to(self, device):
+        self.mean = self.mean.to(device)
+        self.std = self.std.to(device)
+        self.kernels = {k: kernel.to(device) for k, kernel in self.kernels.items()}
+        return self
+
+    def __call__(self, images):
+        """uint8/float [B, 3, H, W] (0-255) -> augmented, normalized float32 batch"""
+        return self.normalize(self.augment(images))
+
+    def normalize(self, images):
+        return (images - self.mean.to(images.device)) / self.std.to(images.device)
+
+    @torch.no_grad()
+    def augment(self, images):
+        """Augmented float32 batch, still in 0-255"""
+        x = images.float()
+        batch, _, height, width = x.shape
+        device = x.device
+
+        def chance(p):
+            return torch.rand(batch, device=device) < p
+
+        def uniform(low, high, size=None):
+            return low + (high - low) * torch.rand(size or (batch,), device=device)
+
+        # Flips
+        flip = chance(self.hflip_p).view(-1, 1, 1, 1)
+        x = torch.where(flip, x.flip(-1), x)
+        flip = chance(self.vflip_p).view(-1, 1, 1, 1)
+        x = torch.where(flip, x.flip(-2), x)
+
+        # Rotate, shift-scale and grid distortion share one resample
+        rotate = chance(self.rotate_p)
+        shift_scale = chance(self.shift_scale_p)
+        distort = chance(self.distort_p)
+
+        if (rotate | shift_scale | distort).any():
+            angle = torch.where(rotate, uniform(-self.rotate_limit, self.rotate_limit),
+                                torch.zeros(batch, device=device)) * (np.pi / 180)
+            scale = torch.where(shift_scale, 1 + uniform(-self.scale_limit, self.scale_limit),
+                                torch.ones(batch, device=device))
+            # Shifts are fractions of the image size; normalized coordinates span 2
+            tx = torch.where(shift_scale, uniform(-self.shift_x, self.shift_x) * 2,
+                             torch.zeros(batch, device=device))
+            ty = torch.where(shift_scale, uniform(-self.shift_y, self.shift_y) * 2,
+                             torch.zeros(batch, device=device))
+
+            # Output -> input mapping of out = scale * R(angle) @ in + t
+            cos, sin = torch.cos(angle) / scale, torch.sin(angle) / scale
+            theta = torch.stack([
+                torch.stack([cos, sin, -(cos * tx + sin * ty)], dim=1),
+                torch.stack([-sin, cos, sin * tx - cos * ty], dim=1)
+            ], dim=1)
+            grid = F.affine_grid(theta, (batch, 3, height, width), align_corners=False)
+
+            if distort.any():
+                # Control points moved by up to distort_limit of a grid cell,
+                # image borders fixed, bicubically interpolated to a smooth field
+                steps = self.distort_steps
+                offsets = uniform(-1, 1, (batch, 2, steps + 1, steps + 1))
+                offsets = offsets * self.distort_limit * (2.0 / steps)
+                offsets[:, :, [0, -1], :] = 0
+                offsets[:, :, :, [0, -1]] = 0
+                field = F.interpolate(offsets, size=(height, width), mode='bicubic',
+                                      align_corners=True)
+                grid = grid + field.permute(0, 2, 3, 1) * distort.view(-1, 1, 1, 1)
+
+            # BORDER_REFLECT; identity rows resample exactly at pixel centers
+            x = F.grid_sample(x, grid, mode='bilinear', padding_mode='reflection',
+                              align_corners=False)
+
+        # Brightness / contrast: x * alpha + beta * 255
+        adjust = chance(self.brightness_contrast_p).view(-1, 1, 1, 1)
+        alpha = 1 + uniform(-self.contrast_limit, self.contrast_limit).view(-1, 1, 1, 1)
+        beta = uniform(-self.brightness_limit, self.brightness_limit).view(-1, 1, 1, 1) * 255
+        x = torch.where(adjust, (x * alpha + beta).clamp(0, 255), x)
+
+        # Hue / saturation / value shifts (hue in OpenCV units, 180 = full turn)
+        hsv = chance(self.hsv_p)
+        if hsv.any():
+            idx = hsv.nonzero(as_tuple=True)[0]
+            n = idx.numel()
+            hue, sat, val = rgb_to_hsv(x[idx] / 255)
+            hue = (hue + uniform(-self.hue_limit, self.hue_limit, (n,)).view(-1, 1, 1) / 180) % 1.0
+            sat = (sat + uniform(-self.sat_limit, self.sat_limit, (n,)).view(-1, 1, 1) / 255).clamp(0, 1)
+            val = (val + uniform(-self.val_limit, self.val_limit, (n,)).view(-1, 1, 1) / 255).clamp(0, 1)
+            x[idx] = hsv_to_rgb(hue, sat, val) * 255
+
+        # Gaussian or median blur with a 3x3 or 5x5 kernel
+        blur = chance(self.blur_p)
+        if blur.any():
+            use_median = chance(0.5)
+            ksize = 3 + 2 * chance(0.5).long()
+            for k in (3, 5):
+                for median in (False, True):
+                    sel = blur & (ksize == k) & (use_median == median)
+                    if not sel.any():
+                        continue
+                    idx = sel.nonzero(as_tuple=True)[0]
+                    padded = F.pad(x[idx], [k // 2] * 4, mode='reflect')
+                    if median:
+                        patches = padded.unfold(2, k, 1).unfold(3, k, 1)
+                        x[idx] = patches.reshape(*patches.shape[:4], -1).median(dim=-1).values
+                    else:
+                        kernel = self.kernels[k].to(device).view(1, 1, k, k).repeat(3, 1, 1, 1)
+                        x[idx] = F.conv2d(padded, kernel, groups=3)
+
+        # Per-pixel, per-channel Gaussian noise
+        noise = chance(self.noise_p)
+        if noise.any():
+            idx = noise.nonzero(as_tuple=True)[0]
+            sigma = uniform(*self.noise_var, (idx.numel(),)).sqrt().view(-1, 1, 1, 1)
+            x[idx] = (x[idx] + torch.randn_like(x[idx]) * sigma).clamp(0, 255)
+
+        # Coarse dropout: 1-4 black rectangles of 8-20 px
+        dropout = chance(self.dropout_p)
+        if dropout.any():
+            max_holes = self.holes[1]
+            low, high = self.hole_size
+            n_holes = torch.randint(self.holes[0], max_holes + 1, (batch,), device=device)
+            hole_h = torch.randint(low, high + 1, (batch, max_holes), device=device)
+            hole_w = torch.randint(low, high + 1, (batch, max_holes), device=device)
+            y1 = (torch.rand(batch, max_holes, device=device) * (height - hole_h + 1)).long()
+            x1 = (torch.rand(batch, max_holes, device=device) * (width - hole_w + 1)).long()
+
+            active = (torch.arange(max_holes, device=device).view(1, -1) < n_holes.view(-1, 1))
+            active = active & dropout.view(-1, 1)
+
+            ys = torch.arange(height, device=device).view(1, 1, -1, 1)
+            xs = torch.arange(width, device=device).view(1, 1, 1, -1)
+            inside = ((ys >= y1[..., None, None]) & (ys < (y1 + hole_h)[..., None, None]) &
+                      (xs >= x1[..., None, None]) & (xs < (x1 + hole_w)[..., None, None]))
+            mask = (inside & active[..., None, None]).any(dim=1, keepdim=True)
+            x = x.masked_fill(mask, 0)
+
+        return x
+
+
+class AugmentedLoader:
+    """
+    Wraps the training DataLoader (yielding uint8 NHWC batches from a
+    dataset built with batch_augment=True and collated by uint8_collate)
+    and yields augmented, normalized NCHW batches on `device`
+    """
+
+    def __init__(self, loader, device=None):
+        self.loader = loader
+        self.dataset = loader.dataset
+        self.sampler = loader.sampler
+        self.batch_sampler = loader.batch_sampler
+        self.device = device
+        self.augmenter = BatchAugmentation(device)
+
+    def __len__(self):
+        return len(self.loader)
+
+    def __iter__(self):
+        for images, labels in self.loader:
+            if self.device is not None:
+                images = images.to(self.device, non_blocking=True)
+            yield self.augmenter(images.permute(0, 3, 1, 2)), labels
+
+
+# ==================== PARITY CHECK ====================
+
+def image_statistics(images):
+    """Per-image summary statistics of float [N, 3, H, W] batches in 0-255"""
+    gray = images.mean(dim=1)
+    laplacian = (4 * gray[:, 1:-1, 1:-1] - gray[:, :-2, 1:-1] - gray[:, 2:, 1:-1]
+                 - gray[:, 1:-1, :-2] - gray[:, 1:-1, 2:])
+    return {
+        'mean': images.mean(dim=(1, 2, 3)),
+        'contrast': gray.flatten(1).std(dim=1),
+        'colorfulness': (images.max(dim=1).values - images.min(dim=1).values).mean(dim=(1, 2)),
+        'black_fraction': (images.max(dim=1).values < 1).float().mean(dim=(1, 2)),
+        'sharpness': laplacian.abs().mean(dim=(1, 2)),
+        'red_green': (images[:, 0] - images[:, 1]).mean(dim=(1, 2))
+    }
+
+
+def ks_statistic(a, b):
+    """Two-sample Kolmogorov-Smirnov statistic"""
+    a, b = np.sort(a), np.sort(b)
+    values = np.concatenate([a, b])
+    cdf_a = np.searchsorted(a, values, side='right') / len(a)
+    cdf_b = np.searchsorted(b, values, side='right') / len(b)
+    return float(np.abs(cdf_a - cdf_b).max())
+
+
+def main():
+    import albumentations as A
+    from data_loader import PlantHealthDataset
+
+    parser = argparse.ArgumentParser(description='Batched augmentation parity check')
+    parser.add_argument('--samples', type=int, default=256, help='Training images to use')
+    parser.add_argument('--repeats', type=int, default=4, help='Augmentations per image')
+    parser.add_argument('--batch_size', type=int, default=64)
+    parser.add_argument('--max_ks', type=float, default=0.1,
+                        help='Largest acceptable KS statistic per metric (default: 0.1)')
+    args = parser.parse_args()
+
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    torch.manual_seed(config['data']['random_seed'])
+    np.random.seed(config['data']['random_seed'])
+
+    dataset = PlantHealthDataset(
+        split_file=os.path.join(config['paths']['splits'], 'train.txt'), augment=True
+    )
+    # The albumentations chain without Normalize + ToTensorV2
+    reference = A.Compose(dataset.transform.transforms[:-2])
+
+    rng = np.random.default_rng(config['data']['random_seed'])
+    indices = rng.choice(len(dataset), size=min(args.samples, len(dataset)), replace=False)
+    originals = [dataset._load_image(int(i)) for i in indices]
+
+    print("\n" + "="*70)
+    print("BATCHED AUGMENTATION PARITY CHECK")
+    print("="*70)
+    print(f"  {len(originals)} images × {args.repeats} augmentations | Device: {device}")
+
+    # Per-sample albumentations
+    start = time.perf_counter()
+    reference_images = [reference(image=img)['image'] for _ in range(args.repeats) for img in originals]
+    reference_time = time.perf_counter() - start
+    reference_batch = torch.from_numpy(np.stack(reference_images)).permute(0, 3, 1, 2).float()
+
+    # Batched torch
+    augmenter = BatchAugmentation(device)
+    source = torch.from_numpy(np.stack(originals)).permute(0, 3, 1, 2).contiguous()
+    batched = []
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(args.repeats):
+        for b in range(0, len(source), args.batch_size):
+            batched.append(augmenter.augment(source[b:b + args.batch_size].to(device)))
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    batched_time = time.perf_counter() - start
+    batched = torch.cat(batched).cpu()
+
+    ref_stats = image_statistics(reference_batch)
+    new_stats = image_statistics(batched)
+
+    print(f"\n{'Metric':16} {'albumentations':>22} {'batched':>22} {'KS':>7}")
+    print("-" * 70)
+    failures = 0
+    for name in ref_stats:
+        a, b = ref_stats[name].numpy(), new_stats[name].numpy()
+        ks = ks_statistic(a, b)
+        status = "✓" if ks <= args.max_ks else "✗"
+        failures += ks > args.max_ks
+        print(f"{name:16} {a.mean():10.3f} ± {a.std():9.3f} {b.mean():10.3f} ± {b.std():9.3f} "
+              f"{ks:6.3f} {status}")
+
+    n = len(reference_images)
+    print(f"\n■ Throughput (single process):")
+    print(f"  albumentations : {n / reference_time:8.1f} images/s")
+    print(f"  batched        : {n / batched_time:8.1f} images/s ({device})")
+
+    print("\n" + "="*70)
+    if failures:
+        print(f"✗ {failures} metric(s) above KS {args.max_ks}")
+    else:
+        print(f"✓ All augmentation statistics within KS {args.max_ks}")
+    print("="*70)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+"""
+Automatic Batch-Size Probe
+Finds the largest training micro-batch that fits in memory by running
+real phase 2 training steps (backbone unfrozen, forward + backward with
+the training precision and memory format) on synthetic batches.
+
+    - CUDA: the batch is doubled until an out-of-memory error, or until
+      the allocator peak plus optimizer state would exceed `headroom` of
+      the device memory
+    - CPU: running out of memory usually ends the process (OOM killer)
+      instead of raising, so the peak resident memory of two small batches
+      is extrapolated linearly and compared with the available memory
+
+train.py uses the result as micro-batch and raises accumulation_steps so
+the effective batch stays batch_size x accumulation_steps.
+
+Usage:
+    python batch_size_probe.py
+    python batch_size_probe.py --max_batch_size 256 --no_mixed_precision
+"""
+
+import os
+import gc
+import copy
+import yaml
+import argparse
+import torch
+import torch.nn as nn
+
+# Load configuration
+with open('config.yaml', 'r') as f:
+    config = yaml.safe_load(f)
+
+MIN_BATCH_SIZE = 2  # BatchNorm needs more than one sample in train mode
+
+
+def _available_memory():
+    """Bytes available to this process on a Linux host (None elsewhere)"""
+    try:
+        with open('/proc/meminfo', 'r') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    available = int(line.split()[1]) * 1024
+                    # torchrun processes on one node share its memory
+                    return available // int(os.environ.get('LOCAL_WORLD_SIZE', 1))
+    except OSError:
+        pass
+    return None
+
+
+def _read_status(field):
+    """Memory field of /proc/self/status in bytes"""
+    with open('/proc/self/status', 'r') as f:
+        for line in f:
+            if line.startswith(field + ':'):
+                return int(line.split()[1]) * 1024
+    raise OSError(f"{field} not in /proc/self/status")
+
+
+def _step_peak_memory(run_step, batch_size):
+    """Peak resident memory of the process during one training step (Linux)"""
+    # Writing 5 to clear_refs resets the VmHWM high-water mark to the current RSS
+    with open('/proc/self/clear_refs', 'w') as f:
+        f.write('5')
+    run_step(batch_size)
+    return _read_status('VmHWM')
+
+
+def _is_oom(error):
+    return isinstance(error, MemoryError) or 'out of memory' in str(error).lower() \
+        or "can't allocate memory" in str(error).lower()
+
+
+def probe_batch_size(model, device, use_amp, amp_dtype, channels_last=True,
+                     max_batch_size=256, headroom=0.8):
+    """
+    Largest power-of-two micro-batch (<= max_batch_size) whose phase 2
+    training step fits in memory
+
+    The model is copied, so its weights and BatchNorm statistics are untouched.
+    """
+    probe_model = copy.deepcopy(model).to(device)
+    probe_model.unfreeze_base()
+    probe_model.train()
+    criterion = nn.CrossEntropyLoss()
+
+    trainable = [p for p in probe_model.parameters() if p.requires_grad]
+    # AdamW keeps two fp32 moments per trainable parameter
+    optimizer_bytes = 2 * sum(p.numel() * 4 for p in trainable)
+
+    size = config['image']['size']
+    num_classes = config['model']['num_classes']
+
+    def run_step(batch_size):
+        images = torch.randn(batch_size, 3, size, size, device=device)
+        if channels_last:
+            images = images.contiguous(memory_format=torch.channels_last)
+        labels = torch.randint(0, num_classes, (batch_size,), device=device)
+        with torch.autocast(device_type=device.type, dtype=amp_dtype, enabled=use_amp):
+            loss = criterion(probe_model(images), labels)
+        loss.backward()
+        probe_model.zero_grad(set_to_none=False)
+        del images, labels, loss
+
+    print("\n■ Probing the largest batch size that fits...")
+
+    if device.type == 'cuda':
+        total = torch.cuda.get_device_properties(device).total_memory
+        best = None
+        batch_size = MIN_BATCH_SIZE
+        while batch_size <= max_batch_size:
+            try:
+                torch.cuda.reset_peak_memory_stats(device)
+                run_step(batch_size)
+                peak = torch.cuda.max_memory_allocated(device) + optimizer_bytes
+            except RuntimeError as e:
+                if not _is_oom(e):
+                    raise
+                print(f"  {batch_size:5d} : out of memory")
+                break
+            finally:
+                gc.collect()
+                torch.cuda.empty_cache()
+
+            if peak > headroom * total:
+                print(f"  {batch_size:5d} : {peak / 1024**3:.2f} GB (over {headroom:.0%} of device memory)")
+                break
+            print(f"  {batch_size:5d} : {peak / 1024**3:.2f} GB")
+            best = batch_size
+            batch_size *= 2
+
+    else:
+        available = _available_memory()
+        small, large = MIN_BATCH_SIZE, MIN_BATCH_SIZE * 4
+        try:
+            start = _read_status('VmRSS')
+            # Warm-up allocates the gradient buffers, which persist in training too
+            run_step(small)
+            # Linear model of step memory vs batch size from two small batches
+            peak_small = _step_peak_memory(run_step, small) - start
+            peak_large = _step_peak_memory(run_step, large) - start
+        except OSError:
+            available = None
+        if available is None:
+            print("  ■ Memory statistics unavailable on this platform → keeping the configured batch")
+            return max_batch_size
+
+        per_sample = max(peak_large - peak_small, 0) / (large - small)
+        fixed = max(peak_small - per_sample * small, 0) + optimizer_bytes
+        budget = headroom * available
+        print(f"  ~{per_sample / 1024**2:.1f} MB per sample, {fixed / 1024**2:.0f} MB fixed, "
+              f"{budget / 1024**3:.1f} GB budget")
+
+        best = None
+        batch_size = MIN_BATCH_SIZE
+        while batch_size <= max_batch_size and fixed + per_sample * batch_size <= budget:
+            best = batch_size
+            batch_size *= 2
+
+    del probe_model
+    gc.collect()
+
+    if best is None:
+        print(f"  ■ Even batch size {MIN_BATCH_SIZE} exceeds the budget → using {MIN_BATCH_SIZE}")
+        return MIN_BATCH_SIZE
+
+    print(f"✓ Largest fitting batch size: {best}")
+    return best
+
+
+def main():
+    from model import build_model
+    from train import device, AMP_DTYPE, CHANNELS_LAST, cpu_supports_bf16
+
+    parser = argparse.ArgumentParser(description='Find the largest training batch size that fits')
+    parser.add_argument('--max_batch_size', type=int, default=512)
+    parser.add_argument('--headroom', type=float, default=0.8,
+                        help='Fraction of the available memory to use (default: 0.8)')
+    parser.add_argument('--no_mixed_precision', action='store_true')
+    args = parser.parse_args()
+
+    use_amp = (config['training']['use_mixed_precision'] and not args.no_mixed_precision
+               and (device.type == 'cuda' or cpu_supports_bf16()))
+
+    model = build_model(num_classes=config['model']['num_classes'], pretrained=False).to(device)
+    if CHANNELS_LAST:
+        model = model.to(memory_format=torch.channels_last)
+
+    probe_batch_size(model, device, use_amp, AMP_DTYPE, CHANNELS_LAST,
+                     max_batch_size=args.max_batch_size, headroom=args.headroom)
+
+
+if __name__ == "__main__":
+    main()
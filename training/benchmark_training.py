@@ -0,0 +1,162 @@
+"""
+Training Throughput Benchmark
+Times full optimizer steps (forward, loss, backward, clipping, AdamW step)
+of PlantHealthModel on synthetic batches for each precision/layout setting
+that train.py can use, so the gain of the CPU training path can be measured
+on the node that will run it:
+
+    fp32                  contiguous NCHW, float32 (the old CPU path)
+    fp32 + channels_last
+    amp + channels_last   bfloat16 autocast on CPU, float16 + GradScaler on CUDA
+    amp + channels_last + compile   (with --compile)
+
+Results are printed and written to outputs/training_benchmark.txt.
+
+Usage:
+    python benchmark_training.py
+    python benchmark_training.py --device cpu --threads 32 --batch_size 32
+    python benchmark_training.py --phase 1 --compile
+"""
+
+import os
+import time
+import yaml
+import argparse
+import platform
+import torch
+from torch.cuda.amp import GradScaler
+
+from model import build_model, FocalLoss
+from train import cpu_supports_bf16
+
+# Load configuration
+with open('config.yaml', 'r') as f:
+    config = yaml.safe_load(f)
+
+
+def benchmark_setting(device, phase, batch_size, steps, warmup, use_amp, channels_last, compile_model):
+    """Images per second for one setting (fresh model, same synthetic batch)"""
+    torch.manual_seed(config['data']['random_seed'])
+
+    model = build_model(num_classes=config['model']['num_classes'], pretrained=False).to(device)
+    if phase == 2:
+        model.unfreeze_base()
+    if channels_last:
+        model = model.to(memory_format=torch.channels_last)
+    model.train()
+
+    forward_model = torch.compile(model) if compile_model else model
+    optimizer = torch.optim.AdamW([p for p in model.parameters() if p.requires_grad], lr=1e-4)
+    criterion = FocalLoss(alpha=config['training'].get('focal_alpha', 0.25),
+                          gamma=config['training'].get('focal_gamma', 2.5))
+
+    amp_dtype = torch.float16 if device.type == 'cuda' else torch.bfloat16
+    scaler = GradScaler(enabled=use_amp and amp_dtype == torch.float16)
+
+    size = config['image']['size']
+    images = torch.randn(batch_size, 3, size, size, device=device)
+    if channels_last:
+        images = images.contiguous(memory_format=torch.channels_last)
+    labels = torch.randint(0, config['model']['num_classes'], (batch_size,), device=device)
+
+    def step():
+        with torch.autocast(device_type=device.type, dtype=amp_dtype, enabled=use_amp):
+            loss = criterion(forward_model(images), labels)
+        optimizer.zero_grad()
+        scaler.scale(loss).backward()
+        scaler.unscale_(optimizer)
+        torch.nn.utils.clip_grad_norm_(model.parameters(), config['training']['gradient_clip'])
+        scaler.step(optimizer)
+        scaler.update()
+
+    # Warmup also absorbs torch.compile and oneDNN kernel selection
+    for _ in range(warmup):
+        step()
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+
+    start = time.perf_counter()
+    for _ in range(steps):
+        step()
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    elapsed = time.perf_counter() - start
+
+    return batch_size * steps / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Training throughput benchmark')
+    parser.add_argument('--device', type=str, default=None,
+                        help='cpu or cuda (default: cuda if available)')
+    parser.add_argument('--phase', type=int, choices=[1, 2], default=2,
+                        help='1 = frozen backbone, 2 = fine-tuning (default: 2)')
+    parser.add_argument('--batch_size', type=int, default=None,
+                        help='Default: training.batch_size')
+    parser.add_argument('--steps', type=int, default=20, help='Timed steps per setting')
+    parser.add_argument('--warmup', type=int, default=5, help='Untimed steps per setting')
+    parser.add_argument('--threads', type=int, default=None,
+                        help='CPU intra-op threads (default: all cores)')
+    parser.add_argument('--compile', action='store_true',
+                        help='Also benchmark torch.compile')
+    args = parser.parse_args()
+
+    device = torch.device(args.device or ('cuda' if torch.cuda.is_available() else 'cpu'))
+    batch_size = args.batch_size or config['training']['batch_size']
+    if device.type == 'cpu':
+        torch.set_num_threads(args.threads or os.cpu_count() or 1)
+
+    amp_supported = device.type == 'cuda' or cpu_supports_bf16()
+    amp_name = 'fp16' if device.type == 'cuda' else 'bf16'
+
+    settings = [('fp32', False, False, False),
+                ('fp32 + channels_last', False, True, False)]
+    if amp_supported:
+        settings.append((f'{amp_name} + channels_last', True, True, False))
+    if args.compile:
+        settings.append((f"{amp_name if amp_supported else 'fp32'} + channels_last + compile",
+                         amp_supported, True, True))
+
+    print("\n" + "="*70)
+    print("TRAINING THROUGHPUT BENCHMARK")
+    print("="*70)
+    print(f"  Model: {config['model']['name']} | Phase {args.phase} | Batch: {batch_size}")
+    print(f"  Device: {device} | CPU: {platform.processor() or platform.machine()} | "
+          f"Threads: {torch.get_num_threads()}")
+    if not amp_supported:
+        print("  ■ No native bf16 support on this CPU → mixed precision skipped")
+    print("="*70)
+
+    results = []
+    for name, use_amp, channels_last, compile_model in settings:
+        print(f"\n■ {name}...")
+        throughput = benchmark_setting(device, args.phase, batch_size, args.steps, args.warmup,
+                                       use_amp, channels_last, compile_model)
+        results.append((name, throughput))
+        print(f"  {throughput:.1f} images/s")
+
+    baseline = results[0][1]
+    lines = [
+        f"Model: {config['model']['name']} | Phase {args.phase} | Batch: {batch_size} | "
+        f"Device: {device} | Threads: {torch.get_num_threads()} | torch {torch.__version__}",
+        "",
+        f"{'Setting':45} {'images/s':>10} {'speedup':>9}"
+    ]
+    for name, throughput in results:
+        lines.append(f"{name:45} {throughput:10.1f} {throughput / baseline:8.2f}x")
+
+    print("\n" + "="*70)
+    print("\n".join(lines))
+    print("="*70)
+
+    os.makedirs(config['paths']['outputs'], exist_ok=True)
+    report_path = os.path.join(config['paths']['outputs'], 'training_benchmark.txt')
+    with open(report_path, 'w') as f:
+        f.write("TRAINING THROUGHPUT BENCHMARK\n")
+        f.write("="*70 + "\n\n")
+        f.write("\n".join(lines) + "\n")
+    print(f"\n✓ Report saved: {report_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -24,8 +24,9 @@ from scipy.optimize import minimize
 from sklearn.metrics import log_loss, brier_score_loss
 from tqdm import tqdm
 
-from model import load_model
+from model import load_model, load_checkpoint
 from data_loader import get_data_loaders
+from logits_cache import load_or_compute_logits, compute_logits
 
 # Load config
 with open('config.yaml', 'r') as f:
@@ -181,36 +182,24 @@ def evaluate_calibration(model, loader, temperature=1.0, n_bins=15):
     Returns:
         Dictionary with calibration metrics
     """
-    model.eval()
-    
-    all_confidences = []
-    all_predictions = []
-    all_labels = []
-    all_probabilities = []
+    if isinstance(model, ModelWithTemperature):
+        temperature = model.temperature.item()
+        model = model.model
     
-    with torch.no_grad():
-        for images, labels in tqdm(loader, desc='Evaluating'):
-            images = images.to(device)
-            labels = labels.to(device)
-            
-            if hasattr(model, 'predict_with_temperature'):
-                probabilities = model.predict_with_temperature(images)
-            else:
-                logits = model(images)
-                scaled_logits = logits / temperature
-                probabilities = F.softmax(scaled_logits, dim=1)
-            
-            confidences, predictions = torch.max(probabilities, 1)
-            
-            all_confidences.extend(confidences.cpu().numpy())
-            all_predictions.extend(predictions.cpu().numpy())
-            all_labels.extend(labels.cpu().numpy())
-            all_probabilities.extend(probabilities.cpu().numpy())
+    logits, labels = collect_predictions(model, loader)
+    return calibration_metrics(logits.numpy(), labels.numpy(), temperature, n_bins)
+
+
+def calibration_metrics(logits, labels, temperature=1.0, n_bins=15):
+    """
+    Calibration metrics from precomputed logits (no forward passes)
     
-    confidences = np.array(all_confidences)
-    predictions = np.array(all_predictions)
-    labels = np.array(all_labels)
-    probabilities = np.array(all_probabilities)
+    Returns:
+        Dictionary with calibration metrics
+    """
+    probabilities = F.softmax(torch.from_numpy(logits) / temperature, dim=1).numpy()
+    confidences = probabilities.max(axis=1)
+    predictions = probabilities.argmax(axis=1)
     
     # Calculate metrics
     accuracy = (predictions == labels).mean()
@@ -478,27 +467,31 @@ def main():
     print("■ No retraining required - fast calibration in minutes")
     print("="*70 + "\n")
     
-    # Load model
-    print("■ Loading trained model...")
-    model, checkpoint = load_model(args.model_path, device)
-    model.eval()
-    
-    # Load data
-    print("■ Loading validation data...")
-    _, val_loader, _ = get_data_loaders()
+    # Collect predictions on validation set (reused from the logits cache
+    # when this checkpoint has already been evaluated on val)
+    def run_model():
+        print("■ Loading trained model...")
+        model, _ = load_model(args.model_path, device)
+        model.eval()
+        
+        print("■ Loading validation data...")
+        _, val_loader, _ = get_data_loaders(device=device)
+        
+        print("\n■ Collecting validation predictions...")
+        return compute_logits(model, val_loader, device)
     
-    # Collect predictions on validation set
-    print("\n■ Collecting validation predictions...")
-    val_logits, val_labels = collect_predictions(model, val_loader)
+    val_logits, val_labels, _ = load_or_compute_logits(args.model_path, 'val', run_model)
     
     # Find optimal temperature
-    optimal_temp = find_optimal_temperature(val_logits, val_labels, args.init_temp)
+    optimal_temp = find_optimal_temperature(
+        torch.from_numpy(val_logits), torch.from_numpy(val_labels), args.init_temp
+    )
     
     # Evaluate before calibration
     print("\n" + "="*70)
     print("EVALUATING BEFORE CALIBRATION")
     print("="*70)
-    before_metrics = evaluate_calibration(model, val_loader, temperature=1.0)
+    before_metrics = calibration_metrics(val_logits, val_labels, temperature=1.0)
     
     print(f"\n■ Before Calibration:")
     print(f"   Accuracy: {before_metrics['accuracy']:.4f}")
@@ -507,16 +500,11 @@ def main():
     print(f"   Avg Confidence (Correct): {before_metrics['avg_conf_correct']:.4f}")
     print(f"   Avg Confidence (Incorrect): {before_metrics['avg_conf_incorrect']:.4f}")
     
-    # Wrap model with temperature
-    calibrated_model = ModelWithTemperature(model, temperature=optimal_temp)
-    calibrated_model = calibrated_model.to(device)
-    calibrated_model.eval()
-    
-    # Evaluate after calibration
+    # Evaluate after calibration (same logits, scaled by T)
     print("\n" + "="*70)
     print("EVALUATING AFTER CALIBRATION")
     print("="*70)
-    after_metrics = evaluate_calibration(calibrated_model, val_loader)
+    after_metrics = calibration_metrics(val_logits, val_labels, temperature=optimal_temp)
     
     print(f"\n■ After Calibration (T={optimal_temp:.4f}):")
     print(f"   Accuracy: {after_metrics['accuracy']:.4f}")
@@ -559,7 +547,8 @@ def main():
     
     # Save calibrated model
     save_path = os.path.join(config['paths']['models'], args.output_name)
-    save_calibrated_model(model, optimal_temp, checkpoint, save_path)
+    checkpoint = load_checkpoint(args.model_path, 'cpu')
+    save_calibrated_model(None, optimal_temp, checkpoint, save_path)
     
     print("\n" + "="*70)
     print("✓ CALIBRATION COMPLETE!")
@@ -0,0 +1,126 @@
+"""
+Asynchronous Checkpoint Writer
+torch.save() inside the epoch loop stalls training for the whole disk
+write. The writer only snapshots the checkpoint to CPU memory on the
+calling thread; a background thread serializes it to a temp file and
+atomically renames it into place, so a reader never sees a partial file.
+
+Retention: saving to a path that already exists rotates the previous
+files (best_model.pth -> best_model_1.pth -> best_model_2.pth ...), keeping
+at most `keep` files per path. The fixed names used by evaluate.py and
+--resume always hold the newest checkpoint.
+"""
+
+import os
+import copy
+import queue
+import shutil
+import atexit
+import threading
+import torch
+
+
+def snapshot_state(obj):
+    """Deep copy of a (nested) checkpoint with every tensor copied to CPU"""
+    if isinstance(obj, torch.Tensor):
+        return obj.detach().to('cpu', copy=True)
+    if isinstance(obj, dict):
+        return {key: snapshot_state(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(snapshot_state(value) for value in obj)
+    return copy.deepcopy(obj)
+
+
+def rotated_path(path, index):
+    """best_model.pth, 1 -> best_model_1.pth"""
+    root, ext = os.path.splitext(path)
+    return f"{root}_{index}{ext}"
+
+
+def write_checkpoint(state, path, keep=1):
+    """torch.save to a temp file, rotate older copies, then atomic rename"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    tmp_path = path + '.tmp'
+    torch.save(state, tmp_path)
+
+    # Rotate older copies: path_{keep-2} -> path_{keep-1}, ..., path -> path_1.
+    # path_1 is a hard link (a copy where links are unsupported), so `path`
+    # itself is only ever replaced atomically and never missing.
+    if keep > 1 and os.path.exists(path):
+        for index in range(keep - 1, 1, -1):
+            if os.path.exists(rotated_path(path, index - 1)):
+                os.replace(rotated_path(path, index - 1), rotated_path(path, index))
+        link_path = rotated_path(path, 1)
+        try:
+            os.link(path, link_path + '.tmp')
+        except OSError:
+            shutil.copy2(path, link_path + '.tmp')
+        os.replace(link_path + '.tmp', link_path)
+
+    os.replace(tmp_path, path)
+
+
+class AsyncCheckpointWriter:
+    """
+    Background torch.save with temp file + atomic rename and bounded retention
+
+    Args:
+        max_pending: snapshots waiting to be written before save() blocks
+                     (bounds the extra host memory)
+    """
+
+    def __init__(self, max_pending=2):
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._error = None
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='checkpoint-writer', daemon=True)
+        self._thread.start()
+        # Pending writes still finish if training exits without close()
+        atexit.register(self.close)
+
+    def save(self, state, path, keep=1):
+        """
+        Snapshot `state` now and write it to `path` in the background
+
+        Args:
+            keep: files kept for this path (newest at `path`, older ones
+                  rotated to path_1, path_2, ...)
+        """
+        self._raise_pending_error()
+        if self._closed:
+            raise RuntimeError("AsyncCheckpointWriter is closed")
+        self._queue.put((snapshot_state(state), path, keep))
+
+    def flush(self):
+        """Block until every queued checkpoint is on disk"""
+        self._queue.join()
+        self._raise_pending_error()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.join()
+        self._queue.put(None)
+        self._thread.join()
+        self._raise_pending_error()
+
+    def _raise_pending_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise RuntimeError(f"Checkpoint write failed: {error}") from error
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                write_checkpoint(*item)
+            except Exception as e:
+                self._error = e
+            finally:
+                self._queue.task_done()
@@ -1,26 +1,45 @@
 from cProfile import label
 import os
 import cv2
+import time
+import random
 import yaml
 import numpy as np
 import albumentations as A
 from albumentations.pytorch import ToTensorV2
 import torch
-from torch.utils.data import Dataset, DataLoader, WeightedRandomSampler
+from torch.utils.data import (Dataset, DataLoader, Sampler, WeightedRandomSampler,
+                              DistributedSampler)
 from collections import Counter
+from pack_dataset import load_index
+from tensor_cache import CachedSplitLoader, normalize_batch
+from batch_augment import AugmentedLoader
+from distributed import (get_rank, get_world_size, barrier, DistributedWeightedSampler,
+                         ShardSampler)
 
 with open('config.yaml', 'r') as f:
     config = yaml.safe_load(f)
 
 
 class PlantHealthDataset(Dataset):
-    """Optimized dataset with mixup support"""
+    """
+    Optimized dataset with mixup support
+
+    With uint8_output=True samples are returned as un-normalized uint8 HWC
+    arrays (after augmentation) for uint8_collate(); NormalizedLoader then
+    normalizes whole batches. With batch_augment=True (and augment=True)
+    the augmentation is skipped as well and runs per batch in
+    batch_augment.AugmentedLoader.
+    """
 
-    def __init__(self, split_file, transform=None, augment=True, mixup_alpha=0.0):
+    def __init__(self, split_file, transform=None, augment=True, mixup_alpha=0.0,
+                 batch_augment=False, uint8_output=False):
         self.img_size = config['image']['size']
         self.processed_dir = config['paths']['processed_data']
         self.augment = augment
         self.mixup_alpha = mixup_alpha
+        self.batch_augment = augment and batch_augment
+        self.uint8_output = uint8_output or self.batch_augment
 
         self.label_map = {cls: idx for idx, cls in enumerate(config['classes'])}
         self.classes = config['classes']
@@ -45,8 +64,11 @@ class PlantHealthDataset(Dataset):
             max_pixel_value=config['image']['max_pixel_value']
         )
 
-        if not self.augment:
-            return A.Compose([normalize, ToTensorV2()])
+        # uint8 output: normalization and the NCHW permute happen per batch
+        to_tensor = [] if self.uint8_output else [normalize, ToTensorV2()]
+
+        if not self.augment or self.batch_augment:
+            return A.Compose(to_tensor)
 
         aug_config = config['augmentation']
         aug_prob = aug_config.get('augmentation_prob', 0.65)
@@ -78,21 +100,22 @@ class PlantHealthDataset(Dataset):
                 min_holes=1, min_height=8, min_width=8,
                 fill_value=0, p=aug_prob * 0.2
             ),
-            normalize,
-            ToTensorV2()
+            *to_tensor
         ])
 
     def __len__(self):
         return len(self.data)
 
-    def __getitem__(self, idx):
-        img_path, label = self.data[idx]
-    
-        img = cv2.imread(img_path)
+    def _load_image(self, idx):
+        """Decoded uint8 RGB image (black if unreadable)"""
+        img = cv2.imread(self.data[idx][0])
         if img is None:
-            img = np.zeros((self.img_size, self.img_size, 3), dtype=np.uint8)
-        else:
-            img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+            return np.zeros((self.img_size, self.img_size, 3), dtype=np.uint8)
+        return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+    def __getitem__(self, idx):
+        label = self.data[idx][1]
+        img = self._load_image(idx)
     
         augmented = self.transform(image=img)
         img_tensor = augmented['image']
@@ -103,6 +126,165 @@ class PlantHealthDataset(Dataset):
         return [label for _, label in self.data]
 
 
+class PackedPlantHealthDataset(PlantHealthDataset):
+    """
+    Same samples and transforms as PlantHealthDataset, read from the shard
+    files written by pack_dataset.py instead of one JPEG file per sample
+
+    Shards are memory-mapped lazily in each worker process, so a sample
+    costs a slice of an already-open mapping rather than a file open.
+    """
+
+    def __init__(self, split_file, transform=None, augment=True, mixup_alpha=0.0,
+                 batch_augment=False, uint8_output=False):
+        super().__init__(split_file, transform=transform, augment=augment,
+                         mixup_alpha=mixup_alpha, batch_augment=batch_augment,
+                         uint8_output=uint8_output)
+
+        split_name = os.path.splitext(os.path.basename(split_file))[0]
+        with open(split_file, 'r') as f:
+            entries = [line.strip() for line in f if line.strip()]
+
+        index = load_index(split_name, entries)
+        self.shard_files = index['shard_files']
+        self.shard = index['shard']
+        self.offset = index['offset']
+        self.length = index['length']
+        self._maps = None
+
+    def __getstate__(self):
+        # Mappings are per process; workers reopen them on first access
+        state = self.__dict__.copy()
+        state['_maps'] = None
+        return state
+
+    def _load_image(self, idx):
+        if self._maps is None:
+            self._maps = [np.memmap(path, dtype=np.uint8, mode='r') for path in self.shard_files]
+
+        start = self.offset[idx]
+        buffer = self._maps[self.shard[idx]][start:start + self.length[idx]]
+        img = cv2.imdecode(np.asarray(buffer), cv2.IMREAD_COLOR)
+        if img is None:
+            return np.zeros((self.img_size, self.img_size, 3), dtype=np.uint8)
+        return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+
+def uint8_collate(batch):
+    """
+    Collate uint8 HWC samples into one contiguous [B, H, W, 3] uint8 tensor
+
+    A quarter of the bytes of float32 samples cross the worker queue, and
+    no per-sample float conversion happens in the workers.
+    """
+    images = torch.from_numpy(np.stack([img for img, _ in batch]))
+    labels = torch.tensor([label for _, label in batch], dtype=torch.long)
+    return images, labels
+
+
+class NormalizedLoader:
+    """
+    Wraps a DataLoader yielding uint8_collate() batches and yields
+    normalized float32 NCHW batches on `device` (normalized once per batch
+    in the main process, after only uint8 pixels were copied)
+    """
+
+    def __init__(self, loader, device=None):
+        self.loader = loader
+        self.dataset = loader.dataset
+        self.sampler = loader.sampler
+        self.batch_sampler = loader.batch_sampler
+        self.device = device
+
+    def __len__(self):
+        return len(self.loader)
+
+    def __iter__(self):
+        for images, labels in self.loader:
+            yield normalize_batch(images, self.device), labels
+
+
+def seed_worker(worker_id):
+    """
+    Seed numpy and random (used by albumentations) in each DataLoader worker
+
+    torch already gives every worker base_seed + worker_id, with base_seed
+    drawn from the main process RNG, so augmentation streams follow the
+    training seed instead of the state inherited from the parent.
+    """
+    seed = torch.initial_seed() % 2**32
+    np.random.seed(seed)
+    random.seed(seed)
+
+
+def make_loader(dataset, batch_size, shuffle=False, sampler=None, drop_last=False,
+                collate_fn=None, num_workers=None, persistent=True, batch_sampler=None):
+    """
+    DataLoader with the training.* worker settings
+
+    Persistent workers survive between epochs, so each loader spawns its
+    workers (and imports the modules in them) once per run instead of once
+    per epoch. Use persistent=False for loaders iterated only once. A
+    `batch_sampler` replaces batch_size/shuffle/sampler/drop_last.
+    """
+    if num_workers is None:
+        num_workers = config['training'].get('num_workers', 4)
+
+    options = {}
+    if num_workers > 0:
+        options['persistent_workers'] = persistent and config['training'].get('persistent_workers', True)
+        options['prefetch_factor'] = config['training'].get('prefetch_factor', 2)
+        options['worker_init_fn'] = seed_worker
+
+    if batch_sampler is not None:
+        options['batch_sampler'] = batch_sampler
+    else:
+        options.update(batch_size=batch_size, shuffle=shuffle, sampler=sampler,
+                       drop_last=drop_last)
+
+    return DataLoader(
+        dataset,
+        num_workers=num_workers,
+        # Pinned host memory only pays off for host-to-GPU copies
+        pin_memory=torch.cuda.is_available(),
+        collate_fn=collate_fn,
+        **options
+    )
+
+
+def profile_loader(loader, name, max_batches=50):
+    """
+    Startup latency (time to the first batch) and steady-state throughput
+    of one pass over up to `max_batches` batches
+
+    Returns:
+        dict: startup_s, batches_per_s, images_per_s
+    """
+    start = time.perf_counter()
+    first = None
+    images_seen = 0
+    batches = 0
+    for images, _ in loader:
+        if first is None:
+            first = time.perf_counter()
+        else:
+            images_seen += len(images)
+        batches += 1
+        if batches >= max_batches:
+            break
+    end = time.perf_counter()
+
+    steady = max(end - first, 1e-9) if first is not None else float('nan')
+    result = {
+        'startup_s': (first or end) - start,
+        'batches_per_s': (batches - 1) / steady,
+        'images_per_s': images_seen / steady
+    }
+    print(f"  {name:14} startup {result['startup_s']:6.2f}s | "
+          f"{result['batches_per_s']:7.1f} batches/s | {result['images_per_s']:8.1f} images/s")
+    return result
+
+
 def get_balanced_class_weights(split_file, method='balanced', power=1.0, max_cap=5.0):
     """
     FIXED: Balanced class weights with capping
@@ -174,72 +356,151 @@ def get_balanced_class_weights(split_file, method='balanced', power=1.0, max_cap
     return weights
 
 
-def get_moderate_sampler(dataset, strategy='moderate'):
+# Oversampling power per strategy: weight = (max_count / count) ** power
+SAMPLING_POWERS = {
+    'conservative': 0.5,  # Gentle oversampling (square root)
+    'moderate': 0.75,  # Moderate oversampling
+    'aggressive': 1.0  # Strong oversampling
+}
+
+
+def class_sampling_weights(labels, strategy='moderate', max_weight=5.0):
+    """
+    Per-class oversampling weights for integer `labels`
+
+    Returns:
+        (class_counts, class_weights) numpy arrays indexed by class
+    """
+    counts = np.bincount(labels, minlength=len(config['classes']))
+    power = SAMPLING_POWERS.get(strategy, 0.75)
+
+    weights = np.zeros(len(counts))
+    present = counts > 0
+    # Cap to prevent extreme oversampling
+    weights[present] = np.minimum((counts.max() / counts[present]) ** power, max_weight)
+    return counts, weights
+
+
+def get_moderate_sampler(dataset, strategy='moderate', rank=0, world_size=1):
     """
     FIXED: Moderate weighted sampler (prevents over-sampling)
     
     Args:
         dataset: PyTorch dataset
         strategy: 'conservative', 'moderate', or 'aggressive'
+        rank, world_size: data-parallel position; with world_size > 1 each
+                          rank gets its share of the same weighted draw
     
     Returns:
-        WeightedRandomSampler
+        WeightedRandomSampler (DistributedWeightedSampler when distributed)
     """
-    labels = dataset.get_labels()
-    class_counts = Counter(labels)
-
-    # Calculate base weights
-    base_weights = {label: 1.0 / count for label, count in class_counts.items()}
-
-    # Apply strategy
-    if strategy == 'conservative':
-        # Gentle oversampling
-        power = 0.5  # Square root
-    elif strategy == 'moderate':
-        # Moderate oversampling
-        power = 0.75
-    elif strategy == 'aggressive':
-        # Strong oversampling
-        power = 1.0
-    else:
-        power = 0.75
+    labels = np.asarray(dataset.get_labels())
+    class_counts, class_weights = class_sampling_weights(labels, strategy)
 
-    # Apply power scaling and cap
-    max_count = max(class_counts.values())
-    min_count = min(class_counts.values())
+    # Create sample weights
+    sample_weights = torch.as_tensor(class_weights[labels], dtype=torch.double)
+
+    if world_size > 1:
+        sampler = DistributedWeightedSampler(
+            weights=sample_weights,
+            num_samples=len(sample_weights),
+            rank=rank,
+            world_size=world_size,
+            seed=config['data']['random_seed']
+        )
+    else:
+        sampler = WeightedRandomSampler(
+            weights=sample_weights,
+            num_samples=len(sample_weights),
+            replacement=True
+        )
 
-    adjusted_weights = {}
-    for label, count in class_counts.items():
-        # Scale weight based on strategy
-        weight = (max_count / count) ** power
-        # Cap to prevent extreme oversampling
-        weight = min(weight, 5.0)
-        adjusted_weights[label] = weight
+    print(f"✓ {strategy.upper()} weighted sampler created")
+    print_sampling_rates(strategy, class_counts, class_weights)
 
-    # Create sample weights
-    sample_weights = [adjusted_weights[label] for label in labels]
+    return sampler
 
-    sampler = WeightedRandomSampler(
-        weights=sample_weights,
-        num_samples=len(sample_weights),
-        replacement=True
-    )
 
-    print(f"✓ {strategy.upper()} weighted sampler created")
-    print(f"  Sampling power: {power}")
-    print(f"  Weight range: {min(adjusted_weights.values()):.2f} - {max(adjusted_weights.values()):.2f}")
+def print_sampling_rates(strategy, class_counts, class_weights):
+    present = class_counts > 0
+    print(f"  Sampling power: {SAMPLING_POWERS.get(strategy, 0.75)}")
+    print(f"  Weight range: {class_weights[present].min():.2f} - {class_weights[present].max():.2f}")
 
     # Show effective sampling rates
     print("\n  Effective sampling rates:")
     for cls_idx, cls_name in enumerate(config['classes']):
-        if cls_idx in adjusted_weights:
+        if present[cls_idx]:
             count = class_counts[cls_idx]
-            weight = adjusted_weights[cls_idx]
-            effective_count = count * weight
+            effective_count = count * class_weights[cls_idx]
             print(f"  {cls_name:25} : {count:4} → ~{effective_count:6.0f} per epoch")
     print()
 
-    return sampler
+
+class ClassBalancedBatchSampler(Sampler):
+    """
+    Batch sampler that draws the class counts of each batch, then indices
+
+    Classes are drawn in proportion to count × class weight, the same
+    expected mix as get_moderate_sampler, but every batch first gets one
+    sample of each class (when batch_size allows) and only the rest is
+    split by a multinomial draw. Indices come from per-class permutations,
+    so a sample repeats only after its whole class was used.
+
+    Each epoch is drawn at once with numpy, seeded by seed + epoch (call
+    set_epoch()); under torchrun the ranks take alternate batches of the
+    same global draw.
+    """
+
+    def __init__(self, labels, batch_size, class_weights, rank=0, world_size=1, seed=0):
+        labels = np.asarray(labels)
+        counts = np.bincount(labels, minlength=len(class_weights))
+        self.class_indices = [np.flatnonzero(labels == c) for c in range(len(counts))]
+        self.present = np.flatnonzero(counts > 0)
+
+        probs = counts * np.asarray(class_weights, dtype=np.float64)
+        self.class_probs = probs / probs.sum()
+
+        self.batch_size = batch_size
+        self.min_per_class = 1 if batch_size >= len(self.present) else 0
+        self.rank = rank
+        self.world_size = world_size
+        self.seed = seed
+        self.epoch = 0
+        # Like drop_last=True over one pass of the data
+        self.num_batches = max(len(labels) // (batch_size * world_size), 1)
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __len__(self):
+        return self.num_batches
+
+    def _draw(self, rng, cls, n):
+        """n indices of class `cls`, cycling through fresh permutations"""
+        pool = self.class_indices[cls]
+        cycles = -(-n // len(pool))
+        return np.concatenate([rng.permutation(pool) for _ in range(cycles)])[:n]
+
+    def __iter__(self):
+        rng = np.random.default_rng(self.seed + self.epoch)
+        total = self.num_batches * self.world_size
+        n_classes = len(self.class_probs)
+
+        counts = np.zeros((total, n_classes), dtype=np.int64)
+        counts[:, self.present] = self.min_per_class
+        remaining = self.batch_size - self.min_per_class * len(self.present)
+        counts += rng.multinomial(remaining, self.class_probs, size=total)
+
+        # Class of every batch slot, filled per class in slot order
+        slot_classes = np.repeat(np.tile(np.arange(n_classes), total), counts.ravel())
+        slots = np.empty(len(slot_classes), dtype=np.int64)
+        for cls in self.present:
+            positions = np.flatnonzero(slot_classes == cls)
+            slots[positions] = self._draw(rng, cls, len(positions))
+
+        batches = rng.permuted(slots.reshape(total, self.batch_size), axis=1)
+        for batch in batches[self.rank::self.world_size]:
+            yield batch.tolist()
 
 
 def mixup_data(x, y, alpha=0.2):
@@ -261,8 +522,17 @@ def mixup_data(x, y, alpha=0.2):
     return mixed_x, y_a, y_b, lam
 
 
-def get_data_loaders(batch_size=None, num_workers=None, use_weighted_sampler=True):
-    """Create optimized data loaders"""
+def get_data_loaders(batch_size=None, num_workers=None, use_weighted_sampler=True, device=None):
+    """
+    Create optimized data loaders
+
+    With training.cache_eval_splits the val/test loaders read from the
+    pre-decoded tensor cache and normalize each batch on `device`.
+
+    Under torchrun each rank gets its share of the (weighted) train draw
+    and a contiguous shard of val; the test loader always covers the full
+    split (the final test runs on rank 0 only).
+    """
 
     if batch_size is None:
         batch_size = config['training']['batch_size']
@@ -275,63 +545,144 @@ def get_data_loaders(batch_size=None, num_workers=None, use_weighted_sampler=Tru
     # Mixup alpha
     mixup_alpha = config['training'].get('mixup_alpha', 0.0)
 
+    # Shard files from pack_dataset.py, or one JPEG per sample
+    if config['training'].get('use_packed_dataset', False):
+        dataset_cls = PackedPlantHealthDataset
+        print(f"✓ Using packed dataset: {config['paths'].get('packed_data', 'data/packed')}")
+    else:
+        dataset_cls = PlantHealthDataset
+
+    # Per-batch tensor augmentation instead of per-sample albumentations
+    batch_augmentation = config['training'].get('batch_augmentation', False)
+    # Workers return uint8 HWC; normalization runs per batch in the main process
+    uint8_batches = batch_augmentation or config['training'].get('uint8_collate', False)
+
     # Datasets
-    train_dataset = PlantHealthDataset(
+    train_dataset = dataset_cls(
         split_file=os.path.join(splits_dir, 'train.txt'),
         augment=True,
-        mixup_alpha=mixup_alpha
+        mixup_alpha=mixup_alpha,
+        batch_augment=batch_augmentation,
+        uint8_output=uint8_batches
     )
 
-    val_dataset = PlantHealthDataset(
+    val_dataset = dataset_cls(
         split_file=os.path.join(splits_dir, 'val.txt'),
         augment=False
     )
 
-    test_dataset = PlantHealthDataset(
+    test_dataset = dataset_cls(
         split_file=os.path.join(splits_dir, 'test.txt'),
         augment=False
     )
 
+    rank, world_size = get_rank(), get_world_size()
+
     # Weighted sampler
     train_sampler = None
+    train_batch_sampler = None
     shuffle = True
 
     if use_weighted_sampler and config['training'].get('oversample_minority', True):
         strategy = config['training'].get('sampling_strategy', 'moderate')
-        train_sampler = get_moderate_sampler(train_dataset, strategy=strategy)
+        if config['training'].get('class_balanced_batches', False):
+            labels = np.asarray(train_dataset.get_labels())
+            class_counts, class_weights = class_sampling_weights(labels, strategy)
+            train_batch_sampler = ClassBalancedBatchSampler(
+                labels, batch_size, class_weights, rank=rank, world_size=world_size,
+                seed=config['data']['random_seed']
+            )
+            print(f"✓ {strategy.upper()} class-balanced batch sampler created")
+            print_sampling_rates(strategy, class_counts, class_weights)
+        else:
+            train_sampler = get_moderate_sampler(train_dataset, strategy=strategy,
+                                                 rank=rank, world_size=world_size)
+        shuffle = False
+    elif world_size > 1:
+        train_sampler = DistributedSampler(train_dataset, num_replicas=world_size, rank=rank,
+                                           shuffle=True, seed=config['data']['random_seed'])
         shuffle = False
 
     # Data loaders
-    train_loader = DataLoader(
+    train_loader = make_loader(
         train_dataset,
         batch_size=batch_size,
         shuffle=shuffle,
         sampler=train_sampler,
         num_workers=num_workers,
-        pin_memory=True,
-        drop_last=True
+        drop_last=True,
+        collate_fn=uint8_collate if uint8_batches else None,
+        batch_sampler=train_batch_sampler
     )
 
-    val_loader = DataLoader(
+    if batch_augmentation:
+        train_loader = AugmentedLoader(train_loader, device=device)
+        print("✓ Batched tensor augmentation enabled")
+    elif uint8_batches:
+        train_loader = NormalizedLoader(train_loader, device=device)
+        print("✓ uint8 collation with per-batch normalization enabled")
+
+    if config['training'].get('cache_eval_splits', False):
+        # Rank 0 builds missing caches; the other ranks wait, then map them
+        if rank != 0:
+            barrier()
+        val_loader = CachedSplitLoader(
+            val_dataset, os.path.join(splits_dir, 'val.txt'), batch_size, device=device,
+            rank=rank, world_size=world_size
+        )
+        test_loader = CachedSplitLoader(
+            test_dataset, os.path.join(splits_dir, 'test.txt'), batch_size, device=device
+        )
+        if rank == 0:
+            barrier()
+        return train_loader, val_loader, test_loader
+
+    val_loader = make_loader(
         val_dataset,
         batch_size=batch_size,
-        shuffle=False,
-        num_workers=num_workers,
-        pin_memory=True
+        sampler=ShardSampler(len(val_dataset), rank, world_size) if world_size > 1 else None,
+        num_workers=num_workers
     )
 
-    test_loader = DataLoader(
+    # Iterated once, after training: no idle workers during the epochs
+    test_loader = make_loader(
         test_dataset,
         batch_size=batch_size,
-        shuffle=False,
         num_workers=num_workers,
-        pin_memory=True
+        persistent=False
     )
 
     return train_loader, val_loader, test_loader
 
 
 if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Data loader check and profile')
+    parser.add_argument('--profile', action='store_true',
+                        help='Time startup and throughput of each loader over two epochs')
+    parser.add_argument('--batch_size', type=int, default=None)
+    parser.add_argument('--max_batches', type=int, default=50)
+    args = parser.parse_args()
+
+    if args.profile:
+        train_loader, val_loader, test_loader = get_data_loaders(batch_size=args.batch_size)
+        workers = config['training'].get('num_workers', 4)
+        print("\n" + "="*70)
+        print("DATA LOADER PROFILE")
+        print("="*70)
+        print(f"  Workers: {workers} | Prefetch: {config['training'].get('prefetch_factor', 2)} | "
+              f"Persistent: {config['training'].get('persistent_workers', True)}")
+        # The second epoch shows what remains of the startup with persistent workers
+        for epoch in (1, 2):
+            print(f"\n■ Epoch {epoch}")
+            profile_loader(train_loader, 'train', args.max_batches)
+            profile_loader(val_loader, 'val', args.max_batches)
+        print("\n■ Once")
+        profile_loader(test_loader, 'test', args.max_batches)
+        print("="*70)
+        raise SystemExit(0)
+
     print("Testing balanced data loader...")
 
     train_loader, val_loader, test_loader = get_data_loaders(batch_size=4)
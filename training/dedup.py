@@ -0,0 +1,570 @@
+"""
+Duplicate and Near-Duplicate Detection
+Builds a perceptual-hash (dHash) index over the processed dataset and
+groups images that are exact copies, near copies (small Hamming distance)
+or augmentations of the same raw photo. create_splits() in
+preprocessing.py keeps every group inside a single split so related
+images cannot leak from train into val/test.
+
+Near-duplicate search uses a BK-tree, so each lookup only visits the
+part of the index within the distance threshold instead of comparing
+every pair of images. Groups that grow past MAX_GROUP_FRACTION of a
+class through chains of similar photos are re-clustered around root
+hashes; check_split_leakage() reports the close pairs this cuts if they
+end up in different splits. Hashes are cached per output next to the
+preprocessing manifest, keyed by the source's SHA-256, so re-runs only
+hash new or changed images.
+
+Usage:
+    python dedup.py
+    python dedup.py --threshold 4 --workers 8
+"""
+
+import os
+import re
+import cv2
+import json
+import yaml
+import hashlib
+import argparse
+from pathlib import Path
+from collections import defaultdict, Counter
+from concurrent.futures import ProcessPoolExecutor
+
+# Load configuration
+with open('config.yaml', 'r') as f:
+    config = yaml.safe_load(f)
+
+PROCESSED_DIR = config['paths']['processed_data']
+SPLITS_DIR = config['paths']['splits']
+GROUPS_PATH = config['paths'].get('duplicate_groups', 'data/duplicate_groups.json')
+
+# Written by preprocessing.py: raw source -> processed output
+MANIFEST_PATH = os.path.join(PROCESSED_DIR, 'manifest.json')
+HASH_CACHE_PATH = os.path.join(PROCESSED_DIR, 'dhash_cache.json')
+HASH_CACHE_VERSION = 1
+
+HASH_SIZE = 8
+DEFAULT_THRESHOLD = 6
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp')
+
+# Groups holding more than this share of a class are reported: the whole
+# group lands in one split, which skews that class's split sizes
+MAX_GROUP_FRACTION = 0.05
+
+# augment_minority_classes.py names outputs <stem>_aug_0001.jpg
+AUGMENT_SUFFIX = re.compile(r'(_aug_\d{4})+$')
+
+
+# ============================================================================
+# HASHING
+# ============================================================================
+
+def dhash(img_gray, hash_size=HASH_SIZE):
+    """Difference hash: sign of horizontal gradients on a (size+1)×size thumbnail"""
+    small = cv2.resize(img_gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    diff = small[:, 1:] > small[:, :-1]
+
+    value = 0
+    for bit in diff.flatten():
+        value = (value << 1) | int(bit)
+    return value
+
+
+def hash_image(image_path):
+    """
+    Returns:
+        (image_path, dhash or None, sha256 of file contents or None)
+    """
+    try:
+        with open(image_path, 'rb') as f:
+            sha256 = hashlib.sha256(f.read()).hexdigest()
+
+        img = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+        if img is None:
+            return image_path, None, sha256
+
+        return image_path, dhash(img), sha256
+    except Exception:
+        return image_path, None, None
+
+
+def _init_worker():
+    # One OpenCV thread per process; the pool provides the parallelism
+    cv2.setNumThreads(1)
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+# ============================================================================
+# INDEX
+# ============================================================================
+
+class BKTree:
+    """
+    Burkhard-Keller tree over integer hashes with Hamming distance
+
+    Each node stores the ids of every item with that exact hash. The
+    triangle inequality limits a radius-r query to children whose edge
+    distance is within [d - r, d + r].
+    """
+
+    def __init__(self):
+        self.root = None
+
+    def add(self, value, item):
+        if self.root is None:
+            self.root = [value, [item], {}]
+            return
+
+        node = self.root
+        while True:
+            distance = hamming(value, node[0])
+            if distance == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [value, [item], {}]
+                return
+            node = child
+
+    def query(self, value, radius):
+        """All items whose hash is within `radius` of value"""
+        if self.root is None:
+            return []
+
+        matches = []
+        stack = [self.root]
+        while stack:
+            node_value, items, children = stack.pop()
+            distance = hamming(value, node_value)
+            if distance <= radius:
+                matches.extend(items)
+            for edge, child in children.items():
+                if distance - radius <= edge <= distance + radius:
+                    stack.append(child)
+        return matches
+
+
+class UnionFind:
+    """Disjoint sets over item ids with path halving"""
+
+    def __init__(self, items):
+        self.parent = {item: item for item in items}
+
+    def find(self, item):
+        parent = self.parent
+        while parent[item] != item:
+            parent[item] = parent[parent[item]]
+            item = parent[item]
+        return item
+
+    def union(self, a, b):
+        root_a, root_b = self.find(a), self.find(b)
+        if root_a != root_b:
+            # Smallest id becomes the root so group ids are deterministic
+            if root_b < root_a:
+                root_a, root_b = root_b, root_a
+            self.parent[root_b] = root_a
+
+    def groups(self):
+        members = defaultdict(list)
+        for item in self.parent:
+            members[self.find(item)].append(item)
+        return [sorted(group) for group in members.values()]
+
+
+# ============================================================================
+# DATASET SCAN
+# ============================================================================
+
+def collect_processed_images():
+    """Processed images as split-file entries (cls/img_name)"""
+    entries = []
+    for cls in sorted(os.listdir(PROCESSED_DIR)):
+        cls_path = os.path.join(PROCESSED_DIR, cls)
+        if not os.path.isdir(cls_path):
+            continue
+        for img_name in sorted(os.listdir(cls_path)):
+            if img_name.lower().endswith(IMAGE_EXTENSIONS):
+                entries.append(f"{cls}/{img_name}")
+    return entries
+
+
+def lineage_key(source):
+    """
+    (source directory without its 'augmented' component, stem without
+    _aug_NNNN suffixes) - shared by a raw photo and its augmentations
+    """
+    path = Path(source)
+    parent = tuple(part for part in path.parent.parts if part != 'augmented')
+    return parent, AUGMENT_SUFFIX.sub('', path.stem)
+
+
+def read_manifest():
+    """preprocessing.py manifest ({} if missing or unreadable)"""
+    if not os.path.exists(MANIFEST_PATH):
+        return {}
+    try:
+        with open(MANIFEST_PATH, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def load_hash_cache(settings):
+    """
+    {output: {source_sha256, dhash, sha256}} from HASH_CACHE_PATH, or {} if
+    it was written for other preprocessing settings (other output pixels)
+    """
+    if not os.path.exists(HASH_CACHE_PATH):
+        return {}
+    try:
+        with open(HASH_CACHE_PATH, 'r') as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if (cache.get('version') != HASH_CACHE_VERSION or cache.get('hash') != f'dhash{HASH_SIZE}'
+            or cache.get('settings') != settings):
+        return {}
+    return cache.get('outputs', {})
+
+
+def save_hash_cache(settings, outputs):
+    """Write the hash cache atomically"""
+    tmp_path = HASH_CACHE_PATH + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({
+            'version': HASH_CACHE_VERSION,
+            'hash': f'dhash{HASH_SIZE}',
+            'settings': settings,
+            'outputs': dict(sorted(outputs.items()))
+        }, f)
+    os.replace(tmp_path, HASH_CACHE_PATH)
+
+
+def augmentation_links(entries):
+    """
+    Pairs of processed entries that come from the same raw photo, using
+    the preprocessing manifest to map outputs back to their sources
+
+    augment_minority_classes.py writes every augmentation to <cls>/augmented,
+    so an augmentation of a photo in a class subfolder is linked to it only
+    when that stem is unique among the class's photos; photos that merely
+    share a stem (IMG_0001.jpg in two subfolders) are never joined.
+    """
+    files = read_manifest().get('files', {})
+    if not files:
+        return []
+
+    known = set(entries)
+    lineage = defaultdict(list)
+    augmented = []
+
+    for source, entry in files.items():
+        output = entry.get('output')
+        if not output or output not in known:
+            continue
+        if 'augmented' in Path(source).parent.parts:
+            augmented.append((lineage_key(source), output))
+        else:
+            lineage[lineage_key(source)].append(output)
+
+    # Photo keys per (class, stem), to resolve augmentations of subfolder photos
+    photos = set(lineage)
+    photo_keys = defaultdict(set)
+    for parent, stem in photos:
+        photo_keys[(parent[0], stem)].add((parent, stem))
+
+    for key, output in augmented:
+        if key not in photos:
+            candidates = photo_keys.get((key[0][0], key[1]), set())
+            if len(candidates) == 1:
+                key = next(iter(candidates))
+        lineage[key].append(output)
+
+    links = []
+    for outputs in lineage.values():
+        for other in outputs[1:]:
+            links.append((outputs[0], other))
+    return links
+
+
+def build_duplicate_groups(threshold=DEFAULT_THRESHOLD, workers=None, use_lineage=True):
+    """
+    Hash every processed image in parallel, find exact and near duplicates
+    and write the resulting groups to GROUPS_PATH
+
+    Returns:
+        List of groups (each a sorted list of cls/img_name entries, len > 1)
+    """
+    print("\n" + "="*70)
+    print("DUPLICATE DETECTION")
+    print("="*70 + "\n")
+
+    entries = collect_processed_images()
+    if not entries:
+        print("✗ No processed images found")
+        return []
+
+    # Outputs whose source SHA-256 matches the cache keep their hashes
+    manifest = read_manifest()
+    settings = manifest.get('settings')
+    source_sha = {entry['output']: entry['sha256']
+                  for entry in manifest.get('files', {}).values() if entry.get('output')}
+    cache = load_hash_cache(settings) if source_sha else {}
+
+    hashes = {}
+    to_hash = []
+    for entry in entries:
+        cached = cache.get(entry)
+        if cached is not None and cached['source_sha256'] == source_sha.get(entry):
+            hashes[entry] = (cached['dhash'], cached['sha256'])
+        else:
+            to_hash.append(entry)
+
+    workers = workers or os.cpu_count() or 1
+    paths = [os.path.join(PROCESSED_DIR, entry) for entry in to_hash]
+    chunksize = max(1, min(256, len(paths) // (workers * 8)))
+
+    print(f"Hashing {len(to_hash)} images with {workers} worker(s) "
+          f"({len(hashes)} cached)...")
+    if workers > 1 and len(paths) > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+            hashed = list(pool.map(hash_image, paths, chunksize=chunksize))
+    else:
+        hashed = [hash_image(path) for path in paths]
+
+    for entry, (_, value, sha256) in zip(to_hash, hashed):
+        hashes[entry] = (value, sha256)
+
+    if source_sha:
+        save_hash_cache(settings, {
+            entry: {'source_sha256': source_sha[entry], 'dhash': value, 'sha256': sha256}
+            for entry, (value, sha256) in hashes.items()
+            if entry in source_sha and value is not None and sha256 is not None
+        })
+
+    unreadable = []
+    by_sha = defaultdict(list)
+    by_hash = defaultdict(list)
+
+    for entry in entries:
+        value, sha256 = hashes[entry]
+        if sha256 is not None:
+            by_sha[sha256].append(entry)
+        if value is None:
+            unreadable.append(entry)
+        else:
+            by_hash[value].append(entry)
+
+    # Links that always hold: identical bytes, identical dHash, lineage
+    links = []
+    exact_pairs = 0
+    for members in by_sha.values():
+        for other in members[1:]:
+            links.append((members[0], other))
+            exact_pairs += 1
+    for members in by_hash.values():
+        for other in members[1:]:
+            links.append((members[0], other))
+
+    lineage_pairs = 0
+    if use_lineage:
+        for a, b in augmentation_links(entries):
+            links.append((a, b))
+            lineage_pairs += 1
+
+    # Near duplicates: one BK-tree node per distinct hash, every pair of
+    # hashes within `threshold` is linked
+    tree = BKTree()
+    for value in by_hash:
+        tree.add(value, value)
+    close = {value: [match for match in tree.query(value, threshold) if match != value]
+             for value in by_hash}
+    near_pairs = sum(len(matches) for matches in close.values()) // 2
+
+    uf = UnionFind(entries)
+    for a, b in links:
+        uf.union(a, b)
+    for value, matches in close.items():
+        for match in matches:
+            uf.union(by_hash[value][0], by_hash[match][0])
+
+    class_sizes = Counter(entry.split('/')[0] for entry in entries)
+
+    def oversized_classes(group):
+        return [(count / class_sizes[cls], cls, count)
+                for cls, count in Counter(entry.split('/')[0] for entry in group).items()
+                if count > MAX_GROUP_FRACTION * class_sizes[cls]]
+
+    # Chains of similar photos (e.g. on uniform backgrounds) can merge into
+    # one group too large for a single split. Only those groups are
+    # re-clustered: each unclaimed hash becomes a root and claims the
+    # unclaimed hashes within `threshold` of it, without chaining further.
+    # Close pairs cut this way are saved for check_split_leakage().
+    groups = []
+    cut_pairs = []
+    split_groups = 0
+    for group in uf.groups():
+        if len(group) < 2:
+            continue
+        if not oversized_classes(group):
+            groups.append(group)
+            continue
+
+        split_groups += 1
+        members = set(group)
+        sub = UnionFind(group)
+        for a, b in links:
+            if a in members:
+                sub.union(a, b)
+
+        values = sorted({hashes[entry][0] for entry in group} - {None})
+        claimed = set()
+        for value in values:
+            if value in claimed:
+                continue
+            claimed.add(value)
+            for match in close[value]:
+                if match not in claimed:
+                    claimed.add(match)
+                    sub.union(by_hash[value][0], by_hash[match][0])
+
+        for value in values:
+            for match in close[value]:
+                a, b = by_hash[value][0], by_hash[match][0]
+                if match > value and sub.find(a) != sub.find(b):
+                    cut_pairs.append([a, b])
+        groups.extend(g for g in sub.groups() if len(g) > 1)
+
+    groups.sort(key=lambda g: g[0])
+    cross_class = [g for g in groups if len({entry.split('/')[0] for entry in g}) > 1]
+
+    os.makedirs(os.path.dirname(GROUPS_PATH) or '.', exist_ok=True)
+    with open(GROUPS_PATH, 'w') as f:
+        json.dump({
+            'version': 1,
+            'hash': f'dhash{HASH_SIZE}',
+            'threshold': threshold,
+            'lineage': use_lineage,
+            'groups': groups,
+            'cut_pairs': sorted(cut_pairs)
+        }, f, indent=1)
+
+    grouped = sum(len(g) for g in groups)
+    print(f"\n  Exact duplicate pairs   : {exact_pairs}")
+    print(f"  Near-duplicate pairs    : {near_pairs} (Hamming ≤ {threshold})")
+    if use_lineage:
+        print(f"  Augmentation links      : {lineage_pairs}")
+    print(f"  Groups                  : {len(groups)} ({grouped} images)")
+    if groups:
+        print(f"  Largest group           : {max(len(g) for g in groups)} images")
+    if split_groups:
+        print(f"  Re-clustered            : {split_groups} oversized groups "
+              f"({len(cut_pairs)} near pairs cut)")
+    if unreadable:
+        print(f"  ✗ Unreadable            : {len(unreadable)}")
+
+    oversized = []
+    for group in groups:
+        for share, cls, count in oversized_classes(group):
+            oversized.append((share, cls, count, group[0]))
+    if oversized:
+        oversized.sort(reverse=True)
+        print(f"\n■ WARNING: {len(oversized)} groups still hold more than {MAX_GROUP_FRACTION:.0%} "
+              f"of a class and go to a single split:")
+        for share, cls, count, first in oversized[:5]:
+            print(f"  - {cls}: {count} images ({share:.0%}), e.g. {first}")
+        print(f"  Consider a lower --threshold (current: {threshold})")
+
+    if cross_class:
+        print(f"\n■ {len(cross_class)} groups span several classes (possible label conflicts):")
+        for group in cross_class[:5]:
+            print(f"  - {', '.join(group[:4])}{' ...' if len(group) > 4 else ''}")
+        if len(cross_class) > 5:
+            print(f"  ... and {len(cross_class) - 5} more")
+
+    print(f"\n✓ Duplicate groups saved: {GROUPS_PATH}\n")
+    return groups
+
+
+def load_duplicate_groups():
+    """Map cls/img_name -> group id (empty if dedup.py has not been run)"""
+    if not os.path.exists(GROUPS_PATH):
+        return {}
+
+    with open(GROUPS_PATH, 'r') as f:
+        groups = json.load(f).get('groups', [])
+
+    return {entry: group_id for group_id, group in enumerate(groups) for entry in group}
+
+
+def load_cut_pairs():
+    """Near-duplicate pairs cut when oversized groups were re-clustered"""
+    if not os.path.exists(GROUPS_PATH):
+        return []
+
+    with open(GROUPS_PATH, 'r') as f:
+        return json.load(f).get('cut_pairs', [])
+
+
+def check_split_leakage(group_of=None):
+    """
+    Report duplicate groups whose members ended up in different splits,
+    and near-duplicate pairs cut from oversized groups that did
+
+    Returns:
+        Number of leaking groups
+    """
+    group_of = load_duplicate_groups() if group_of is None else group_of
+    if not group_of:
+        return 0
+    cut_pairs = load_cut_pairs()
+
+    split_of = {}
+    for split_name in ['train', 'val', 'test']:
+        split_file = os.path.join(SPLITS_DIR, f'{split_name}.txt')
+        if not os.path.exists(split_file):
+            continue
+        with open(split_file, 'r') as f:
+            for line in f:
+                split_of[line.strip()] = split_name
+
+    splits_of = defaultdict(set)
+    for entry, split_name in split_of.items():
+        if entry in group_of:
+            splits_of[group_of[entry]].add(split_name)
+
+    leaking = sum(1 for splits in splits_of.values() if len(splits) > 1)
+    if leaking:
+        print(f"✗ {leaking} duplicate groups are split across train/val/test")
+    else:
+        print("✓ No duplicate groups cross split boundaries")
+
+    crossing = [(a, b) for a, b in cut_pairs
+                if a in split_of and b in split_of and split_of[a] != split_of[b]]
+    if crossing:
+        print(f"■ {len(crossing)} near-duplicate pairs from re-clustered groups "
+              f"cross split boundaries:")
+        for a, b in crossing[:5]:
+            print(f"  - {a} ({split_of[a]}) ~ {b} ({split_of[b]})")
+    return leaking
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Find duplicate and near-duplicate images')
+    parser.add_argument('--threshold', type=int, default=DEFAULT_THRESHOLD,
+                        help=f'Max Hamming distance between {HASH_SIZE*HASH_SIZE}-bit dHashes '
+                             f'(default: {DEFAULT_THRESHOLD})')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Hashing processes (default: all CPU cores)')
+    parser.add_argument('--no_lineage', action='store_true',
+                        help='Do not group augmented images with their source photo')
+    args = parser.parse_args()
+
+    build_duplicate_groups(args.threshold, args.workers, use_lineage=not args.no_lineage)
+    check_split_leakage()
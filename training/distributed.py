@@ -0,0 +1,139 @@
+"""
+Multi-Process Data-Parallel Training
+Helpers for running train.py under torchrun with DistributedDataParallel
+on the gloo backend, so training scales across the cores of several CPU
+nodes without a GPU:
+
+    torchrun --nproc_per_node=4 train.py                     # one node
+    torchrun --nnodes=2 --nproc_per_node=4 --node_rank=0 \\
+             --master_addr=10.0.0.1 --master_port=29500 train.py
+
+Without torchrun's environment variables everything here falls back to a
+single process (rank 0 of 1).
+"""
+
+import os
+import yaml
+import math
+import builtins
+import torch
+import torch.distributed as dist
+from torch.utils.data import Sampler
+
+# Load configuration
+with open('config.yaml', 'r') as f:
+    config = yaml.safe_load(f)
+
+
+def init_distributed():
+    """
+    Join the process group set up by torchrun (WORLD_SIZE > 1)
+
+    Returns:
+        (rank, world_size)
+    """
+    world_size = int(os.environ.get('WORLD_SIZE', 1))
+    if world_size > 1 and not dist.is_initialized():
+        backend = config['training'].get('dist_backend', 'gloo')
+        dist.init_process_group(backend=backend)
+    return get_rank(), get_world_size()
+
+
+def is_distributed():
+    return dist.is_available() and dist.is_initialized()
+
+
+def get_rank():
+    return dist.get_rank() if is_distributed() else 0
+
+
+def get_world_size():
+    return dist.get_world_size() if is_distributed() else 1
+
+
+def is_main_process():
+    return get_rank() == 0
+
+
+def barrier():
+    if is_distributed():
+        dist.barrier()
+
+
+def all_gather_object(obj):
+    """List with `obj` from every rank ([obj] in a single process)"""
+    if not is_distributed():
+        return [obj]
+    gathered = [None] * get_world_size()
+    dist.all_gather_object(gathered, obj)
+    return gathered
+
+
+def cleanup_distributed():
+    if is_distributed():
+        dist.destroy_process_group()
+
+
+def setup_for_distributed(is_main):
+    """Silence print() on all ranks but the main one (print(..., force=True) still prints)"""
+    builtin_print = builtins.print
+
+    def print(*args, **kwargs):
+        force = kwargs.pop('force', False)
+        if is_main or force:
+            builtin_print(*args, **kwargs)
+
+    builtins.print = print
+
+
+class DistributedWeightedSampler(Sampler):
+    """
+    WeightedRandomSampler split across ranks
+
+    Every rank draws the same global sample of `num_samples` indices with
+    replacement (seeded by seed + epoch) and keeps every world_size-th one,
+    so together the ranks see exactly what a single-process
+    WeightedRandomSampler would draw in one epoch. The draw is padded to a
+    multiple of world_size so all ranks run the same number of steps.
+    Call set_epoch() before each epoch.
+    """
+
+    def __init__(self, weights, num_samples, rank, world_size, seed=0):
+        self.weights = torch.as_tensor(weights, dtype=torch.double)
+        self.rank = rank
+        self.world_size = world_size
+        self.seed = seed
+        self.epoch = 0
+        self.num_samples = math.ceil(num_samples / world_size)
+        self.total_size = self.num_samples * world_size
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __iter__(self):
+        generator = torch.Generator()
+        generator.manual_seed(self.seed + self.epoch)
+        indices = torch.multinomial(self.weights, self.total_size, replacement=True,
+                                    generator=generator)
+        return iter(indices[self.rank:self.total_size:self.world_size].tolist())
+
+    def __len__(self):
+        return self.num_samples
+
+
+class ShardSampler(Sampler):
+    """
+    Contiguous, non-overlapping shard of an evaluation split (no padding,
+    so metrics summed over ranks count every sample exactly once)
+    """
+
+    def __init__(self, num_items, rank, world_size):
+        self.start = num_items * rank // world_size
+        self.end = num_items * (rank + 1) // world_size
+
+    def __iter__(self):
+        return iter(range(self.start, self.end))
+
+    def __len__(self):
+        return self.end - self.start
+
@@ -14,6 +14,7 @@ from tqdm import tqdm
 
 from model import load_model
 from data_loader import get_data_loaders
+from logits_cache import load_or_compute_logits, compute_logits
 
 # Load configuration
 with open('config.yaml', 'r') as f:
@@ -29,39 +30,26 @@ device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
 def evaluate_model(model_path, test_loader):
     """
     Comprehensive model evaluation
+    Logits are reused from the logits cache when this checkpoint has
+    already been evaluated on the test split.
     """
     print("\n" + "="*70)
     print("MODEL EVALUATION")
     print("="*70 + "\n")
     
-    # Load model
-    print(f"■ Loading model from: {model_path}")
-    model, checkpoint = load_model(model_path, device)
-    model.eval()
-    
-    # Get predictions
-    print("■ Generating predictions...")
-    y_true = []
-    y_pred = []
-    y_pred_proba = []
-    
-    with torch.no_grad():
-        for images, labels in tqdm(test_loader, desc="Evaluating"):
-            images = images.to(device)
-            labels = labels.to(device)
-            
-            outputs = model(images)
-            probabilities = torch.softmax(outputs, dim=1)
-            
-            _, predicted = torch.max(outputs, 1)
-            
-            y_true.extend(labels.cpu().numpy())
-            y_pred.extend(predicted.cpu().numpy())
-            y_pred_proba.extend(probabilities.cpu().numpy())
-    
-    y_true = np.array(y_true)
-    y_pred = np.array(y_pred)
-    y_pred_proba = np.array(y_pred_proba)
+    def run_model():
+        # Load model
+        print(f"■ Loading model from: {model_path}")
+        model, checkpoint = load_model(model_path, device)
+        
+        # Get predictions
+        print("■ Generating predictions...")
+        return compute_logits(model, test_loader, device)
+    
+    logits, y_true, _ = load_or_compute_logits(model_path, 'test', run_model)
+    
+    y_pred_proba = torch.softmax(torch.from_numpy(logits), dim=1).numpy()
+    y_pred = np.argmax(logits, axis=1)
     
     return y_true, y_pred, y_pred_proba
 
@@ -259,7 +247,7 @@ def main():
     """Main evaluation pipeline"""
     
     # Load test data
-    _, _, test_loader = get_data_loaders(batch_size=16)
+    _, _, test_loader = get_data_loaders(batch_size=16, device=device)
     
     # Model path
     model_path = f"{config['paths']['models']}/best_model.pth"
@@ -0,0 +1,248 @@
+"""
+Frozen-Backbone Feature Cache for Phase 1
+The backbone is frozen during phase 1, so its features for a given input
+never change. They are computed once per training image (a clean view
+plus K fixed, seeded augmentations) and once per validation image, stored
+as memory-mapped float16 arrays, and phase 1 then trains only the
+classifier head on batches of cached features.
+
+Differences from end-to-end phase 1:
+    - Features come from the backbone in eval mode (BatchNorm running
+      statistics). End-to-end phase 1 runs model.train(), so frozen
+      BatchNorm layers normalize with batch statistics and keep updating
+      their running averages. With the cache, phase 2 starts from the
+      pretrained running statistics.
+    - Augmentation diversity is limited to the K stored views.
+    - Mixup is applied to feature vectors instead of pixels.
+"""
+
+import os
+import json
+import yaml
+import random
+import hashlib
+import numpy as np
+import torch
+from tqdm import tqdm
+from torch.utils.data import Dataset, DataLoader
+
+from tensor_cache import split_fingerprint
+
+# Load configuration
+with open('config.yaml', 'r') as f:
+    config = yaml.safe_load(f)
+
+CACHE_DIR = os.path.join(config['paths'].get('cache', 'data/cache'), 'features')
+SPLITS_DIR = config['paths']['splits']
+
+FEATURE_CACHE_VERSION = 1
+
+
+class SeededViewDataset(Dataset):
+    """
+    Wraps an augmenting dataset so that view `view` of sample `idx` always
+    gets the same random augmentation, whatever the worker or order
+    """
+
+    def __init__(self, dataset, view, seed):
+        self.dataset = dataset
+        self.view = view
+        self.seed = seed
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __getitem__(self, idx):
+        sample_seed = (self.seed * 1_000_003 + self.view * 100_003 + idx) % (2 ** 32)
+        random.seed(sample_seed)
+        np.random.seed(sample_seed)
+        return self.dataset[idx]
+
+
+def backbone_fingerprint(model, views, seed):
+    """Hash of backbone weights, train/val split contents and view settings"""
+    digest = hashlib.sha256()
+    digest.update(json.dumps({
+        'version': FEATURE_CACHE_VERSION,
+        'model_name': model.model_name,
+        'views': views,
+        'seed': seed,
+        'augmentation': config['augmentation']
+    }, sort_keys=True).encode('utf-8'))
+
+    for name, tensor in model.base_model.state_dict().items():
+        digest.update(name.encode('utf-8'))
+        digest.update(tensor.detach().cpu().contiguous().numpy().tobytes())
+
+    for split_name in ['train', 'val']:
+        digest.update(split_fingerprint(os.path.join(SPLITS_DIR, f'{split_name}.txt')).encode('utf-8'))
+
+    return digest.hexdigest()[:16]
+
+
+@torch.no_grad()
+def extract_features(model, loader, out, device, desc):
+    """Run the frozen backbone over `loader` and write features into `out` in order"""
+    start = 0
+    for images, _ in tqdm(loader, desc=desc):
+        images = images.to(device, non_blocking=True)
+        features = model.base_model(images)
+        out[start:start + features.size(0)] = features.float().cpu().numpy().astype(np.float16)
+        start += features.size(0)
+
+
+def feature_cache_datasets(train_dataset, split_file):
+    """
+    Clean and augmented train datasets for build_feature_cache()
+
+    Both return normalized float tensors per sample. A train dataset built
+    for uint8 collation or batched augmentation (uint8_output) returns raw
+    uint8 arrays instead, so an equivalent per-sample dataset is built.
+
+    Returns:
+        (clean_train_dataset, augment_train_dataset)
+    """
+    dataset_cls = type(train_dataset)
+    clean_train_dataset = dataset_cls(split_file=split_file, augment=False)
+
+    augment_train_dataset = train_dataset
+    if getattr(train_dataset, 'uint8_output', False):
+        augment_train_dataset = dataset_cls(split_file=split_file, augment=True,
+                                            uint8_output=False)
+    return clean_train_dataset, augment_train_dataset
+
+
+def build_feature_cache(model, clean_train_dataset, augment_train_dataset, val_loader,
+                        views, device, batch_size=64, num_workers=None, seed=None):
+    """
+    Compute (or reuse) the phase 1 feature store
+
+    Args:
+        clean_train_dataset: train split without augmentation (view 0)
+        augment_train_dataset: train split with the training transform (views 1..K)
+        val_loader: non-shuffled validation loader
+
+    Returns:
+        dict with train_features [1+K, N, D], train_labels [N],
+        val_features [M, D], val_labels [M] (memory-mapped)
+    """
+    if num_workers is None:
+        num_workers = config['training'].get('num_workers', 4)
+    if seed is None:
+        seed = config['data']['random_seed']
+
+    fingerprint = backbone_fingerprint(model, views, seed)
+    base = os.path.join(CACHE_DIR, f'phase1_{fingerprint}')
+    meta_path = base + '_meta.json'
+    paths = {
+        'train_features': base + '_train_features.npy',
+        'train_labels': base + '_train_labels.npy',
+        'val_features': base + '_val_features.npy',
+        'val_labels': base + '_val_labels.npy'
+    }
+
+    if not os.path.exists(meta_path):
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        was_training = model.training
+        model.eval()
+
+        feature_dim = model.base_model.num_features
+        n_train = len(clean_train_dataset)
+        n_val = len(val_loader.dataset)
+
+        print(f"\n■ Building phase 1 feature cache: {n_train} train images × {1 + views} views, "
+              f"{n_val} val images")
+
+        train_features = np.lib.format.open_memmap(
+            paths['train_features'], mode='w+', dtype=np.float16,
+            shape=(1 + views, n_train, feature_dim)
+        )
+        for view in range(1 + views):
+            dataset = (clean_train_dataset if view == 0
+                       else SeededViewDataset(augment_train_dataset, view, seed))
+            loader = DataLoader(dataset, batch_size=batch_size, shuffle=False,
+                                num_workers=num_workers, pin_memory=torch.cuda.is_available())
+            extract_features(model, loader, train_features[view], device,
+                             desc=f"  Train view {view}/{views}")
+        train_features.flush()
+        del train_features
+
+        val_features = np.lib.format.open_memmap(
+            paths['val_features'], mode='w+', dtype=np.float16, shape=(n_val, feature_dim)
+        )
+        extract_features(model, val_loader, val_features, device, desc="  Val")
+        val_features.flush()
+        del val_features
+
+        np.save(paths['train_labels'], np.asarray(clean_train_dataset.get_labels(), dtype=np.int64))
+        np.save(paths['val_labels'], np.asarray(val_loader.dataset.get_labels(), dtype=np.int64))
+
+        # Metadata last: the store is only valid once it exists
+        with open(meta_path, 'w') as f:
+            json.dump({'fingerprint': fingerprint, 'views': views, 'seed': seed,
+                       'train': n_train, 'val': n_val, 'feature_dim': feature_dim}, f, indent=2)
+
+        model.train(was_training)
+    else:
+        print(f"\n✓ Reusing phase 1 feature cache: {base}")
+
+    return {key: np.load(path, mmap_mode='r') for key, path in paths.items()}
+
+
+class FeatureLoader:
+    """
+    Yields (features, labels) batches from cached features like a DataLoader
+
+    Training loaders draw sample indices from `sampler` (e.g. the weighted
+    sampler of the image loader), whole batches from `batch_sampler`, or a
+    random permutation, and pick one of the stored views per sample.
+    """
+
+    def __init__(self, features, labels, batch_size, device, sampler=None,
+                 shuffle=False, drop_last=False, batch_sampler=None):
+        # The whole store fits in memory (N × D × 2 bytes per view)
+        self.features = torch.from_numpy(np.ascontiguousarray(features)).to(device)
+        self.labels = torch.from_numpy(np.ascontiguousarray(labels)).to(device)
+        self.batch_size = batch_size
+        self.sampler = sampler
+        self.batch_sampler = batch_sampler
+        if batch_sampler is not None:
+            self.batch_size = batch_sampler.batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.has_views = self.features.dim() == 3
+
+    def _num_samples(self):
+        return len(self.sampler) if self.sampler is not None else len(self.labels)
+
+    def __len__(self):
+        if self.batch_sampler is not None:
+            return len(self.batch_sampler)
+        n = self._num_samples()
+        if self.drop_last:
+            return n // self.batch_size
+        return (n + self.batch_size - 1) // self.batch_size
+
+    def __iter__(self):
+        device = self.labels.device
+        if self.batch_sampler is not None:
+            # Equal-size batches, so consecutive slices reproduce them
+            indices = torch.as_tensor(list(iter(self.batch_sampler)), dtype=torch.long).view(-1)
+        elif self.sampler is not None:
+            indices = torch.as_tensor(list(iter(self.sampler)), dtype=torch.long)
+        elif self.shuffle:
+            indices = torch.randperm(len(self.labels))
+        else:
+            indices = torch.arange(len(self.labels))
+        indices = indices.to(device)
+
+        if self.has_views:
+            views = torch.randint(0, self.features.size(0), (len(indices),), device=device)
+
+        for b in range(len(self)):
+            batch = indices[b * self.batch_size:(b + 1) * self.batch_size]
+            if self.has_views:
+                features = self.features[views[b * self.batch_size:(b + 1) * self.batch_size], batch]
+            else:
+                features = self.features[batch]
+            yield features.float(), self.labels[batch]
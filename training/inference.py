@@ -13,19 +13,17 @@ Usage remains the same:
 """
 
 import os
-from unittest import result
-import cv2
+import sys
 import yaml
 import argparse
-import numpy as np
 import torch
-import torch.nn as nn
-from torch.nn import functional as F
-import albumentations as A
-from albumentations.pytorch import ToTensorV2
 
 from model import load_model
 
+# Shared inference engine (preprocessing, batched softmax, response building)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend', 'ai'))
+from inference_engine import InferenceEngine, get_calibration
+
 # Load configuration
 with open('config.yaml', 'r') as f:
     config = yaml.safe_load(f)
@@ -62,8 +60,7 @@ class PlantHealthPredictor:
         self.model.eval()
         
         # Check for temperature calibration
-        self.temperature = self.checkpoint.get('temperature', 1.0)
-        self.is_calibrated = self.checkpoint.get('calibrated', False)
+        self.temperature, self.is_calibrated = get_calibration(self.checkpoint)
         
         if self.is_calibrated:
             print(f"✓ Model is calibrated (Temperature: {self.temperature:.4f})")
@@ -72,185 +69,93 @@ class PlantHealthPredictor:
             print("■ Model is not calibrated")
             print("  → Run: python calibrate_confidence.py")
         
-        self.img_size = config['image']['size']
         self.class_names = config['classes']
         
-        # EXACT same normalization as training
-        self.transform = A.Compose([
-            A.Normalize(
-                mean=config['image']['normalize_mean'],
-                std=config['image']['normalize_std'],
-                max_pixel_value=config['image']['max_pixel_value']
-            ),
-            ToTensorV2()
-        ])
+        # Same engine as the production server; temperature applied in its softmax
+        self.engine = InferenceEngine(
+            self.model, device,
+            config=config,
+            temperature=self.temperature,
+            calibrated=self.is_calibrated
+        )
         
         print(f"✓ Model loaded")
         print(f" Classes: {', '.join(self.class_names)}")
     
-    def preprocess_image(self, image_path):
+    def predict_many(self, image_paths, return_probabilities=False,
+                     confidence_threshold=None):
         """
-        Consistent preprocessing
+        Batched prediction with automatic temperature scaling
         """
-        # Read image
-        img = cv2.imread(image_path)
-        
-        if img is None:
-            raise ValueError(f"Cannot read image: {image_path}")
-        
-        # Convert BGR to RGB
-        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        
-        # Resize with same interpolation as training
-        img = cv2.resize(img, (self.img_size, self.img_size),
-                        interpolation=cv2.INTER_LANCZOS4)
+        if confidence_threshold is None:
+            confidence_threshold = config['evaluation'].get('default_threshold', 0.5)
         
-        # Apply EXACT same normalization as training
-        img = self.transform(image=img)['image']
+        results = self.engine.predict_many(image_paths)
         
-        # Add batch dimension
-        img = img.unsqueeze(0)
+        for result in results:
+            all_probs = result.pop('all_probabilities')
+            
+            result['low_confidence'] = result['confidence'] < confidence_threshold
+            result['threshold'] = confidence_threshold
+            result['is_calibrated'] = self.is_calibrated
+            
+            if return_probabilities:
+                probs_by_class = {p['class']: p['confidence'] for p in all_probs}
+                result['all_probabilities'] = {
+                    name: probs_by_class[name] for name in self.class_names
+                }
+            
+            # Top 3 predictions (engine output is sorted by confidence)
+            result['top3'] = [
+                {'class': p['class'], 'confidence': p['confidence']}
+                for p in all_probs[:3]
+            ]
         
-        return img
+        return results
     
     def predict(self, image_path, return_probabilities=False, 
                 confidence_threshold=None):
         """
         UPDATED: Prediction with automatic temperature scaling
         """
-        if confidence_threshold is None:
-            confidence_threshold = config['evaluation'].get('default_threshold', 0.5)
-        
-        # Preprocess
-        img = self.preprocess_image(image_path)
-        img = img.to(device)
-        
-        # Predict with temperature scaling
-        with torch.no_grad():
-            logits = self.model(img)
-            
-            # Apply temperature scaling if calibrated
-            if self.is_calibrated:
-                scaled_logits = logits / self.temperature
-            else:
-                scaled_logits = logits
-            
-            probabilities = torch.softmax(scaled_logits, dim=1)[0]
-        
-        probabilities = probabilities.cpu().numpy()
-        
-        # Get prediction
-        predicted_idx = np.argmax(probabilities)
-        predicted_class = self.class_names[predicted_idx]
-        confidence = float(probabilities[predicted_idx])
-        
-        # Check threshold
-        low_confidence = confidence < confidence_threshold
-        
-        # Category mapping
-        if predicted_class.startswith("Pest_"):
-            category = "Pest"
-            subtype = predicted_class.replace("Pest_", "")
-        elif predicted_class.startswith("Nutrient_"):
-            category = "Nutrient Deficiency"
-            subtype = predicted_class.replace("Nutrient_", "")
-        elif predicted_class == "Not_Plant":  
-            category = "Invalid Input"  
-            subtype = None
-        else:
-            category = predicted_class
-            subtype = None
-        
-        result = {
-            'predicted_class': predicted_class,
-            'category': category,
-            'subtype': subtype,
-            'confidence': confidence,
-            'confidence_percentage': confidence * 100,
-            'low_confidence': low_confidence,
-            'threshold': confidence_threshold,
-            'is_calibrated': self.is_calibrated,  # NEW
-            'temperature': self.temperature  # NEW
-        }
-        
-        if return_probabilities:
-            result['all_probabilities'] = {
-                name: float(prob)
-                for name, prob in zip(self.class_names, probabilities)
-            }
-        
-        # Top 3 predictions
-        top3_idx = np.argsort(probabilities)[-3:][::-1]
-        result['top3'] = [
-            {
-                'class': self.class_names[idx],
-                'confidence': float(probabilities[idx])
-            }
-            for idx in top3_idx
-        ]
-        
-        return result
+        return self.predict_many(
+            [image_path],
+            return_probabilities=return_probabilities,
+            confidence_threshold=confidence_threshold
+        )[0]
     
     def predict_with_explanation(self, image_path):
         """Enhanced prediction with explanations"""
         result = self.predict(image_path, return_probabilities=True)
         
-        # Complete explanations
-        explanations = {
-            "Healthy": "Plant appears healthy. No visible issues detected.",
-            "Pest_Fungal": "Fungal infection detected. Look for powdery spots, mold, or discoloration. Treatment: fungicide.",
-            "Pest_Bacterial": "Bacterial infection detected. Water-soaked lesions or wilting. Treatment: copper-based spray.",
-            "Pest_Insect": "Insect damage detected. Holes, chewed edges, or insect presence. Treatment: insecticide or natural predators.",
-            "Nutrient_Nitrogen": "Nitrogen deficiency. Yellowing of older leaves, stunted growth. Treatment: nitrogen fertilizer.",
-            "Nutrient_Potassium": "Potassium deficiency. Leaf edge browning, weak stems. Treatment: potassium fertilizer.",
-            "Water_Stress": "Water stress detected. Wilting or dry soil. Treatment: adjust watering schedule.",
-            "Not_Plant": "This is not a plant image. Please upload a clear image of a plant leaf for disease detection."
-        }
-        
-        result['explanation'] = explanations.get(
-            result['predicted_class'],
-            "Unable to provide specific explanation."
-        )
-        
-        # UPDATED: Confidence interpretation (calibrated models more reliable)
-        conf = result['confidence']
+        # Explanation and confidence level come from the shared engine
+        level = result['confidence_level']
         
         if self.is_calibrated:
-            if conf > 0.80:
-                result['confidence_level'] = "Very High"
-                result['reliability'] = "Highly reliable - calibrated confidence"
-            elif conf > 0.65:
-                result['confidence_level'] = "High"
-                result['reliability'] = "Reliable - calibrated confidence"
-            elif conf > 0.50:
-                result['confidence_level'] = "Moderate"
-                result['reliability'] = "Moderately reliable - consider context"
-            else:
-                result['confidence_level'] = "Low"
-                result['reliability'] = "Low confidence - manual inspection recommended"
-   
-                if result['predicted_class'] == 'Not_Plant':
-                    result['warning'] = "■ Non-plant image detected. Please upload a plant leaf image."
-                else:
-                    result['warning'] = "■ Low confidence prediction. Consider retaking image or consulting expert."
+            reliability = {
+                "Very High": "Highly reliable - calibrated confidence",
+                "High": "Reliable - calibrated confidence",
+                "Moderate": "Moderately reliable - consider context",
+                "Low": "Low confidence - manual inspection recommended"
+            }
+            low_warning = "■ Low confidence prediction. Consider retaking image or consulting expert."
         else:
-            # Uncalibrated (original thresholds - less reliable)
-            if conf > 0.85:
-                result['confidence_level'] = "Very High"
-                result['reliability'] = "Likely reliable (uncalibrated - may be overconfident)"
-            elif conf > 0.70:
-                result['confidence_level'] = "High"
-                result['reliability'] = "Moderately reliable (uncalibrated)"
-            elif conf > 0.55:
-                result['confidence_level'] = "Moderate"
-                result['reliability'] = "Uncertain (uncalibrated - calibration recommended)"
+            # Uncalibrated (less reliable)
+            reliability = {
+                "Very High": "Likely reliable (uncalibrated - may be overconfident)",
+                "High": "Moderately reliable (uncalibrated)",
+                "Moderate": "Uncertain (uncalibrated - calibration recommended)",
+                "Low": "Low confidence - manual inspection recommended"
+            }
+            low_warning = "■ Low confidence. Model not calibrated - run calibrate_confidence.py"
+        
+        result['reliability'] = reliability[level]
+        
+        if level == "Low":
+            if result['predicted_class'] == 'Not_Plant':
+                result['warning'] = "■ Non-plant image detected. Please upload a plant leaf image."
             else:
-                result['confidence_level'] = "Low"
-                result['reliability'] = "Low confidence - manual inspection recommended"
-                if result['predicted_class'] == 'Not_Plant':
-                    result['warning'] = "■ Non-plant image detected. Please upload a plant leaf image."
-                else:
-                    result['warning'] = "■ Low confidence. Model not calibrated - run calibrate_confidence.py"
+                result['warning'] = low_warning
         
         return result
 
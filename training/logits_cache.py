@@ -0,0 +1,122 @@
+"""
+Split Logits Cache
+Stores the logits of a checkpoint on a split so evaluate.py,
+calibrate_confidence.py and the final test in train.py never repeat the
+forward passes for a checkpoint that has already been evaluated.
+
+Entries are compressed .npz files (logits, labels, image ids) keyed by
+    - SHA-256 of the checkpoint file
+    - fingerprint of the split (entries + image size/mtime)
+    - preprocessing config (image size and normalization)
+
+Logits are always computed in float32 without autocast, so every tool
+sees identical numbers for the same key.
+"""
+
+import os
+import json
+import yaml
+import hashlib
+import numpy as np
+import torch
+from tqdm import tqdm
+
+from tensor_cache import split_fingerprint
+
+# Load configuration
+with open('config.yaml', 'r') as f:
+    config = yaml.safe_load(f)
+
+CACHE_DIR = os.path.join(config['paths'].get('cache', 'data/cache'), 'logits')
+SPLITS_DIR = config['paths']['splits']
+
+LOGITS_CACHE_VERSION = 1
+
+_checkpoint_hashes = {}
+
+
+def checkpoint_sha256(checkpoint_path):
+    """SHA-256 of a checkpoint file, memoized per (path, size, mtime)"""
+    stat = os.stat(checkpoint_path)
+    key = (os.path.abspath(checkpoint_path), stat.st_size, stat.st_mtime_ns)
+
+    if key not in _checkpoint_hashes:
+        digest = hashlib.sha256()
+        with open(checkpoint_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        _checkpoint_hashes[key] = digest.hexdigest()
+
+    return _checkpoint_hashes[key]
+
+
+def cache_key(checkpoint_path, split_name):
+    split_file = os.path.join(SPLITS_DIR, f'{split_name}.txt')
+    payload = json.dumps({
+        'version': LOGITS_CACHE_VERSION,
+        'checkpoint': checkpoint_sha256(checkpoint_path),
+        'split': split_fingerprint(split_file),
+        'image': config['image']
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]
+
+
+def read_split_ids(split_name):
+    with open(os.path.join(SPLITS_DIR, f'{split_name}.txt'), 'r') as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+@torch.no_grad()
+def compute_logits(model, loader, device):
+    """Float32 logits and labels for every batch of a non-shuffled loader"""
+    model.eval()
+
+    all_logits = []
+    all_labels = []
+
+    for images, labels in tqdm(loader, desc='Computing logits'):
+        images = images.to(device, non_blocking=True)
+        all_logits.append(model(images).float())
+        all_labels.append(labels)
+
+    # Single host transfer at the end
+    logits = torch.cat(all_logits).cpu().numpy()
+    labels = torch.cat(all_labels).cpu().numpy().astype(np.int64)
+    return logits, labels
+
+
+def load_or_compute_logits(checkpoint_path, split_name, compute_fn):
+    """
+    Cached (logits, labels, ids) for a checkpoint on a split
+
+    Args:
+        compute_fn: called only on a cache miss; returns (logits, labels)
+                    as numpy arrays in split-file order
+
+    Returns:
+        logits float32 [N, C], labels int64 [N], ids (list of cls/img_name)
+    """
+    key = cache_key(checkpoint_path, split_name)
+    cache_path = os.path.join(CACHE_DIR, f'{split_name}_{key}.npz')
+
+    if os.path.exists(cache_path):
+        with np.load(cache_path) as data:
+            print(f"✓ Reusing cached {split_name} logits: {cache_path}")
+            return data['logits'], data['labels'], data['ids'].tolist()
+
+    logits, labels = compute_fn()
+    ids = read_split_ids(split_name)
+
+    if len(ids) != len(labels):
+        raise ValueError(
+            f"{split_name}: got {len(labels)} logits for {len(ids)} split entries"
+        )
+
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmp_path = cache_path + '.tmp.npz'
+    np.savez_compressed(tmp_path, logits=np.asarray(logits, dtype=np.float32),
+                        labels=np.asarray(labels, dtype=np.int64), ids=np.array(ids))
+    os.replace(tmp_path, cache_path)
+    print(f"✓ Cached {split_name} logits: {cache_path}")
+
+    return np.asarray(logits, dtype=np.float32), np.asarray(labels, dtype=np.int64), ids
@@ -0,0 +1,104 @@
+"""
+Streaming Classification Metrics
+A confusion matrix accumulated on the model device with torch.bincount.
+Loss and accuracy are summed as tensors too, so a training or validation
+loop never waits on the device; everything is copied to the host once,
+in compute().
+
+Macro-F1, per-class F1 and balanced accuracy follow sklearn's
+f1_score(average='macro', zero_division=0) and balanced_accuracy_score:
+macro-F1 averages over classes present in labels or predictions,
+balanced accuracy over classes present in labels.
+
+Under data-parallel training each rank accumulates its own shard and
+sync() sums the counts over all ranks before compute().
+"""
+
+import numpy as np
+import torch
+import torch.distributed as dist
+
+
+class ConfusionMatrixMeter:
+    """Running confusion matrix (rows = true class, columns = prediction)"""
+
+    def __init__(self, num_classes, device):
+        self.num_classes = num_classes
+        self.device = device
+        self.reset()
+
+    def reset(self):
+        self.matrix = torch.zeros(self.num_classes * self.num_classes,
+                                  dtype=torch.long, device=self.device)
+        self.loss_sum = torch.zeros((), dtype=torch.float64, device=self.device)
+        self.correct_sum = torch.zeros((), dtype=torch.float64, device=self.device)
+        self.count = 0
+
+    @torch.no_grad()
+    def update(self, preds, labels, loss=None, correct=None):
+        """
+        Args:
+            preds, labels: (N,) class index tensors on the meter's device
+            loss: batch-mean loss tensor (weighted by N)
+            correct: number of correct samples as a tensor; defaults to
+                     (preds == labels).sum(), pass a soft count for mixup
+        """
+        n = labels.size(0)
+        self.matrix += torch.bincount(labels * self.num_classes + preds,
+                                      minlength=self.num_classes * self.num_classes)
+        if loss is not None:
+            self.loss_sum += loss.detach().double() * n
+        if correct is None:
+            correct = (preds == labels).sum()
+        self.correct_sum += correct.detach().double()
+        self.count += n
+
+    def sync(self):
+        """Sum the matrix, loss, correct and sample counts over all ranks"""
+        if not (dist.is_available() and dist.is_initialized()):
+            return
+        totals = torch.stack([self.loss_sum, self.correct_sum,
+                              torch.tensor(float(self.count), dtype=torch.float64,
+                                           device=self.device)])
+        dist.all_reduce(self.matrix)
+        dist.all_reduce(totals)
+        self.loss_sum, self.correct_sum = totals[0], totals[1]
+        self.count = int(totals[2].item())
+
+    def compute(self):
+        """
+        Returns:
+            dict with loss, accuracy, macro_f1, balanced_accuracy,
+            per_class_f1 (one entry per class) and confusion_matrix
+        """
+        cm = self.matrix.view(self.num_classes, self.num_classes).cpu().numpy()
+        count = max(self.count, 1)
+
+        results = metrics_from_confusion(cm)
+        results['loss'] = self.loss_sum.item() / count
+        results['accuracy'] = self.correct_sum.item() / count
+        return results
+
+
+def metrics_from_confusion(cm):
+    """sklearn-equivalent macro-F1, per-class F1 and balanced accuracy"""
+    cm = np.asarray(cm, dtype=np.float64)
+    true_pos = np.diag(cm)
+    support = cm.sum(axis=1)
+    predicted = cm.sum(axis=0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        per_class_f1 = np.where(support + predicted > 0,
+                                2 * true_pos / (support + predicted), 0.0)
+        recall = np.where(support > 0, true_pos / support, 0.0)
+
+    present = (support + predicted) > 0
+    macro_f1 = float(per_class_f1[present].mean()) if present.any() else 0.0
+    balanced_accuracy = float(recall[support > 0].mean()) if (support > 0).any() else 0.0
+
+    return {
+        'macro_f1': macro_f1,
+        'balanced_accuracy': balanced_accuracy,
+        'per_class_f1': per_class_f1,
+        'confusion_matrix': cm.astype(np.int64)
+    }
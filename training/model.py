@@ -3,6 +3,8 @@ import torch
 import torch.nn as nn
 import timm
 
+from checkpoint_writer import write_checkpoint
+
 # Load configuration
 with open('config.yaml', 'r') as f:
     config = yaml.safe_load(f)
@@ -257,8 +259,14 @@ def print_model_summary(model, input_size=(3, 224, 224)):
     print("="*70 + "\n")
 
 
-def save_model(model, optimizer, epoch, best_metric, save_path, metric_name='accuracy'):
-    """Save model checkpoint"""
+def save_model(model, optimizer, epoch, best_metric, save_path, metric_name='accuracy',
+               writer=None, keep=1):
+    """
+    Save model checkpoint
+
+    Keeps `keep` rotated copies of save_path. With an AsyncCheckpointWriter
+    the checkpoint is snapshotted to CPU and written in the background.
+    """
     checkpoint = {
         'epoch': epoch,
         'model_state_dict': model.state_dict(),
@@ -269,11 +277,15 @@ def save_model(model, optimizer, epoch, best_metric, save_path, metric_name='acc
         'num_classes': model.num_classes,
         'config': config
     }
-    torch.save(checkpoint, save_path)
-    print(f"✓ Model saved: {save_path}")
+    if writer is not None:
+        writer.save(checkpoint, save_path, keep=keep)
+        print(f"✓ Model queued for writing: {save_path}")
+    else:
+        write_checkpoint(checkpoint, save_path, keep=keep)
+        print(f"✓ Model saved: {save_path}")
 
 
-def load_model(load_path, device='cuda'):
+def load_checkpoint(load_path, device='cuda'):
     """
     Safely load old PyTorch checkpoints with numpy types in PyTorch >=2.6
     """
@@ -291,7 +303,14 @@ def load_model(load_path, device='cuda'):
 
     # Use safe_globals context
     with torch.serialization.safe_globals(safe_globals):
-        checkpoint = torch.load(load_path, map_location=device, weights_only=False)
+        return torch.load(load_path, map_location=device, weights_only=False)
+
+
+def load_model(load_path, device='cuda'):
+    """
+    Load a checkpoint and rebuild the model it was saved from
+    """
+    checkpoint = load_checkpoint(load_path, device)
 
     # Build model
     model = PlantHealthModel(
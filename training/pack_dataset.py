@@ -0,0 +1,184 @@
+"""
+Packed Dataset Builder
+Packs the processed JPEGs of each split into a few large shard files plus
+an offset index, so training reads from a handful of big files instead of
+opening one small file per sample.
+
+Layout (paths.packed_data):
+    train-00000.bin, train-00001.bin, ...   concatenated JPEG bytes
+    train.idx.npz                           names, labels, shard, offset, length
+
+Images are copied byte-for-byte (no re-encode), so a packed split decodes
+to exactly the same pixels as the processed files.
+
+Usage:
+    python pack_dataset.py
+    python pack_dataset.py --splits train --shard_size_mb 512
+"""
+
+import os
+import yaml
+import hashlib
+import argparse
+import numpy as np
+from tqdm import tqdm
+
+# Load configuration
+with open('config.yaml', 'r') as f:
+    config = yaml.safe_load(f)
+
+PROCESSED_DIR = config['paths']['processed_data']
+SPLITS_DIR = config['paths']['splits']
+PACKED_DIR = config['paths'].get('packed_data', 'data/packed')
+
+PACK_VERSION = 2
+DEFAULT_SHARD_SIZE_MB = 256
+
+
+def index_path(split_name):
+    return os.path.join(PACKED_DIR, f'{split_name}.idx.npz')
+
+
+def split_digest(entries):
+    """Hash of the split entries and the size/mtime of every image, used to detect a stale pack"""
+    digest = hashlib.sha256()
+    for entry in entries:
+        try:
+            stat = os.stat(os.path.join(PROCESSED_DIR, entry))
+            digest.update(f"{entry}:{stat.st_size}:{stat.st_mtime_ns}\n".encode('utf-8'))
+        except OSError:
+            digest.update(f"{entry}:missing\n".encode('utf-8'))
+    return digest.hexdigest()
+
+
+def read_split(split_name):
+    with open(os.path.join(SPLITS_DIR, f'{split_name}.txt'), 'r') as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def pack_split(split_name, shard_size_mb=DEFAULT_SHARD_SIZE_MB):
+    """
+    Pack one split into shard files and write its index
+
+    Returns:
+        (number of images, total bytes, number of shards)
+    """
+    entries = read_split(split_name)
+    # Taken before reading: an image rewritten while packing leaves the pack stale
+    digest = split_digest(entries)
+    label_map = {cls: idx for idx, cls in enumerate(config['classes'])}
+    shard_limit = shard_size_mb * 1024 * 1024
+
+    shard_files = []
+    shard_ids = np.zeros(len(entries), dtype=np.int32)
+    offsets = np.zeros(len(entries), dtype=np.int64)
+    lengths = np.zeros(len(entries), dtype=np.int64)
+    labels = np.zeros(len(entries), dtype=np.int64)
+
+    shard = None
+    shard_bytes = 0
+    total_bytes = 0
+
+    try:
+        for i, entry in enumerate(tqdm(entries, desc=f"  {split_name}")):
+            cls = entry.split('/')[0]
+            with open(os.path.join(PROCESSED_DIR, entry), 'rb') as f:
+                data = f.read()
+
+            if shard is None or (shard_bytes and shard_bytes + len(data) > shard_limit):
+                if shard is not None:
+                    shard.close()
+                shard_name = f'{split_name}-{len(shard_files):05d}.bin'
+                shard_files.append(shard_name)
+                shard = open(os.path.join(PACKED_DIR, shard_name), 'wb')
+                shard_bytes = 0
+
+            shard.write(data)
+            shard_ids[i] = len(shard_files) - 1
+            offsets[i] = shard_bytes
+            lengths[i] = len(data)
+            labels[i] = label_map[cls]
+
+            shard_bytes += len(data)
+            total_bytes += len(data)
+    finally:
+        if shard is not None:
+            shard.close()
+
+    # Index last, atomically: a pack is only valid once its index exists
+    tmp_path = index_path(split_name) + '.tmp.npz'
+    np.savez(
+        tmp_path,
+        version=np.array(PACK_VERSION),
+        digest=np.array(digest),
+        names=np.array(entries),
+        labels=labels,
+        shard=shard_ids,
+        offset=offsets,
+        length=lengths,
+        shard_files=np.array(shard_files)
+    )
+    os.replace(tmp_path, index_path(split_name))
+
+    return len(entries), total_bytes, len(shard_files)
+
+
+def load_index(split_name, entries):
+    """
+    Load a split index and check that it matches the current split file
+
+    Raises:
+        FileNotFoundError: if the split has not been packed
+        ValueError: if the pack is from another version or a different split
+    """
+    path = index_path(split_name)
+    if not os.path.exists(path):
+        raise FileNotFoundError(
+            f"Packed dataset not found: {path}\n  Run: python pack_dataset.py"
+        )
+
+    with np.load(path) as index:
+        index = {key: index[key] for key in index.files}
+
+    if int(index['version']) != PACK_VERSION or str(index['digest']) != split_digest(entries):
+        raise ValueError(
+            f"Packed dataset is stale for split '{split_name}'\n  Run: python pack_dataset.py"
+        )
+
+    index['shard_files'] = [os.path.join(PACKED_DIR, name) for name in index['shard_files']]
+    return index
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Pack split images into shard files')
+    parser.add_argument('--splits', nargs='+', default=['train', 'val', 'test'],
+                        help='Splits to pack (default: train val test)')
+    parser.add_argument('--shard_size_mb', type=int, default=DEFAULT_SHARD_SIZE_MB,
+                        help=f'Target shard size in MB (default: {DEFAULT_SHARD_SIZE_MB})')
+    args = parser.parse_args()
+
+    os.makedirs(PACKED_DIR, exist_ok=True)
+
+    print("\n" + "="*70)
+    print("PACKING DATASET")
+    print("="*70 + "\n")
+
+    for split_name in args.splits:
+        # Invalidate a previous pack of this split before touching its shards:
+        # an interrupted run must not leave the old index over rewritten shards
+        if os.path.exists(index_path(split_name)):
+            os.remove(index_path(split_name))
+        for name in os.listdir(PACKED_DIR):
+            if name.startswith(f'{split_name}-') and name.endswith('.bin'):
+                os.remove(os.path.join(PACKED_DIR, name))
+
+        count, total_bytes, shards = pack_split(split_name, args.shard_size_mb)
+        print(f"  ✓ {split_name:5} : {count:6} images | "
+              f"{total_bytes / 1024 / 1024:8.1f} MB | {shards} shard(s)")
+
+    print(f"\n✓ Packed dataset saved: {PACKED_DIR}")
+    print("  Enable with training.use_packed_dataset: true in config.yaml\n")
+
+
+if __name__ == "__main__":
+    main()
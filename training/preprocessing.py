@@ -1,10 +1,17 @@
 import os
 import cv2
+import json
 import yaml
 import random
+import hashlib
+import argparse
 import numpy as np
 from tqdm import tqdm
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from image_probe import probe_image
+from collections import defaultdict
+from dedup import build_duplicate_groups, load_duplicate_groups, check_split_leakage
 
 # Load configuration
 with open('config.yaml', 'r') as f:
@@ -18,6 +25,10 @@ RANDOM_SEED = config['data']['random_seed']
 RAW_DIR = config['paths']['raw_data']
 PROCESSED_DIR = config['paths']['processed_data']
 SPLITS_DIR = config['paths']['splits']
+MIN_IMAGE_SIZE = 50
+JPEG_QUALITY = 95
+MANIFEST_PATH = os.path.join(PROCESSED_DIR, 'manifest.json')
+MANIFEST_VERSION = 1
 
 
 def collect_images_from_nested_dirs(class_dir):
@@ -37,28 +48,215 @@ def collect_images_from_nested_dirs(class_dir):
     return image_files
 
 
-def preprocess_images():
+def file_sha256(path, chunk_size=1024 * 1024):
+    """SHA-256 of a file's contents"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def manifest_settings():
+    """Settings that change processed output; any change forces a full rebuild"""
+    return {
+        'img_size': IMG_SIZE,
+        'jpeg_quality': JPEG_QUALITY,
+        'min_image_size': MIN_IMAGE_SIZE
+    }
+
+
+def load_manifest():
+    """
+    Load {source: {size, mtime_ns, sha256, output, error}} from MANIFEST_PATH
+
+    Sources and outputs are relative to RAW_DIR / PROCESSED_DIR with '/'
+    separators. Returns an empty dict if the manifest is missing, unreadable
+    or was written with different preprocessing settings.
+    """
+    if not os.path.exists(MANIFEST_PATH):
+        return {}
+    
+    try:
+        with open(MANIFEST_PATH, 'r') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"■ Warning: Could not read manifest ({e}) - reprocessing everything")
+        return {}
+    
+    if manifest.get('version') != MANIFEST_VERSION or manifest.get('settings') != manifest_settings():
+        print("■ Preprocessing settings changed - reprocessing everything")
+        return {}
+    
+    return manifest.get('files', {})
+
+
+def save_manifest(files):
+    """Write the manifest atomically"""
+    manifest = {
+        'version': MANIFEST_VERSION,
+        'settings': manifest_settings(),
+        'files': dict(sorted(files.items()))
+    }
+    tmp_path = MANIFEST_PATH + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp_path, MANIFEST_PATH)
+
+
+def plan_output_names(image_files, proc_cls_path, reserved=()):
+    """
+    Assign every source image its output path up front
+
+    Names are derived from the sorted source list only (stem.jpg, then
+    stem_1.jpg, stem_2.jpg, ... for repeated stems from different
+    subdirectories), skipping `reserved` names already owned by other
+    sources, so no two workers ever write the same file.
+    """
+    used = {name.lower() for name in reserved}
+    tasks = []
+    
+    for img_path in sorted(image_files):
+        original_name = Path(img_path).stem
+        save_name = f"{original_name}.jpg"
+        
+        counter = 1
+        while save_name.lower() in used:
+            save_name = f"{original_name}_{counter}.jpg"
+            counter += 1
+        
+        used.add(save_name.lower())
+        tasks.append((img_path, os.path.join(proc_cls_path, save_name)))
+    
+    return tasks
+
+
+def _init_worker():
+    # One OpenCV thread per process; the pool provides the parallelism
+    cv2.setNumThreads(1)
+
+
+def process_image(task):
+    """
+    Resize one raw image and save it as a high-quality JPEG
+
+    If the content hash matches `expected_sha256` and the output exists
+    (source only touched or copied), the image is not decoded again.
+
+    Returns:
+        (img_path, error message or None, manifest fields)
+    """
+    img_path, save_path, expected_sha256 = task
+    
+    try:
+        stat = os.stat(img_path)
+        info = {
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'sha256': file_sha256(img_path),
+            'skipped': False
+        }
+    except OSError as e:
+        return img_path, f"Could not read: {e}", None
+    
+    if info['sha256'] == expected_sha256 and os.path.exists(save_path):
+        info['skipped'] = True
+        return img_path, None, info
+    
+    try:
+        # Reject unreadable and tiny images from the header alone
+        header = probe_image(img_path)
+        
+        if header is None:
+            return img_path, "Could not read", info
+        
+        width, height, _ = header
+        if height < MIN_IMAGE_SIZE or width < MIN_IMAGE_SIZE:
+            return img_path, "Image too small", info
+        
+        # Read image
+        img = cv2.imread(img_path)
+        
+        if img is None:
+            return img_path, "Could not read", info
+        
+        # Resize with high-quality interpolation
+        img = cv2.resize(img, (IMG_SIZE, IMG_SIZE), 
+                        interpolation=cv2.INTER_LANCZOS4)
+        
+        # Save with high quality
+        if not cv2.imwrite(save_path, img, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY]):
+            return img_path, "Could not write output", info
+        
+        return img_path, None, info
+        
+    except Exception as e:
+        return img_path, f"Error processing: {e}", info
+
+
+def _relative(path, base):
+    return Path(os.path.relpath(path, base)).as_posix()
+
+
+def prune_unowned_outputs(files):
+    """
+    Delete processed images that no manifest entry owns: outputs of earlier
+    runs under names that are no longer planned (old _1/_2 copies) or of
+    sources deleted before a rebuild from an empty manifest
+
+    Returns:
+        Number of files removed
+    """
+    owned = {entry['output'] for entry in files.values() if entry.get('output')}
+    removed = 0
+    
+    for cls in sorted(os.listdir(PROCESSED_DIR)):
+        cls_path = os.path.join(PROCESSED_DIR, cls)
+        if not os.path.isdir(cls_path):
+            continue
+        for img_name in os.listdir(cls_path):
+            if (img_name.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp'))
+                    and f"{cls}/{img_name}" not in owned):
+                os.remove(os.path.join(cls_path, img_name))
+                removed += 1
+    
+    return removed
+
+
+def preprocess_images(workers=None, force=False):
     """
     Preprocess raw images: resize and normalize
     Handles nested directory structure
+    
+    Incremental: sources whose size and mtime match the manifest are
+    skipped, new or changed sources are processed, and outputs of deleted
+    sources (and any other file the manifest does not own) are removed.
+    Work is sharded across a process pool; output names are planned in
+    the parent so parallel writes never collide.
     """
     os.makedirs(PROCESSED_DIR, exist_ok=True)
+    workers = workers or os.cpu_count() or 1
     
     print("\n" + "="*70)
     print("IMAGE PREPROCESSING PIPELINE")
     print("="*70 + "\n")
     
+    manifest = {} if force else load_manifest()
+    files = {}
+    
     total_images = 0
     class_counts = {}
+    class_tasks = {}
+    failures = {}
+    unchanged = {}
+    rehashed = {}
     
-    for cls in os.listdir(RAW_DIR):
+    for cls in sorted(os.listdir(RAW_DIR)):
         raw_cls_path = os.path.join(RAW_DIR, cls)
         
         if not os.path.isdir(raw_cls_path):
             continue
         
-        print(f"■ Processing class: {cls}")
-        
         # Create output directory
         proc_cls_path = os.path.join(PROCESSED_DIR, cls)
         os.makedirs(proc_cls_path, exist_ok=True)
@@ -67,62 +265,127 @@ def preprocess_images():
         image_files = collect_images_from_nested_dirs(raw_cls_path)
         
         if len(image_files) == 0:
-            print(f"  ■ Warning: No images found in {cls}")
+            print(f"■ Warning: No images found in {cls}")
             continue
         
-        successful = 0
-        failed = 0
+        failures[cls] = []
+        unchanged[cls] = 0
+        rehashed[cls] = 0
+        tasks = []
+        new_files = []
+        reserved = []
         
-        for img_path in tqdm(image_files, desc=f"  Processing"):
-            try:
-                # Read image
-                img = cv2.imread(img_path)
-                
-                if img is None:
-                    print(f"  ✗ Could not read: {os.path.basename(img_path)}")
-                    failed += 1
-                    continue
-                
-                # Check if image is too small
-                if img.shape[0] < 50 or img.shape[1] < 50:
-                    print(f"  ✗ Image too small: {os.path.basename(img_path)}")
-                    failed += 1
-                    continue
-                
-                # Resize with high-quality interpolation
-                img = cv2.resize(img, (IMG_SIZE, IMG_SIZE), 
-                                interpolation=cv2.INTER_LANCZOS4)
-                
-                # Generate unique filename (avoid conflicts from subdirs)
-                original_name = Path(img_path).stem
-                extension = Path(img_path).suffix
-                
-                # Keep original filename but ensure .jpg extension
-                save_name = f"{original_name}.jpg"
-                save_path = os.path.join(proc_cls_path, save_name)
-                
-                # If filename exists, add counter
-                counter = 1
-                while os.path.exists(save_path):
-                    save_name = f"{original_name}_{counter}.jpg"
-                    save_path = os.path.join(proc_cls_path, save_name)
-                    counter += 1
-                
-                # Save with high quality
-                cv2.imwrite(save_path, img, [cv2.IMWRITE_JPEG_QUALITY, 95])
-                successful += 1
-                
-            except Exception as e:
-                print(f"  ✗ Error processing {os.path.basename(img_path)}: {e}")
-                failed += 1
+        for img_path in image_files:
+            source = _relative(img_path, RAW_DIR)
+            entry = manifest.get(source)
+            
+            if entry is None:
+                new_files.append(img_path)
                 continue
+            
+            if entry['output']:
+                reserved.append(Path(entry['output']).name)
+            
+            stat = os.stat(img_path)
+            output_path = os.path.join(PROCESSED_DIR, entry['output']) if entry['output'] else None
+            
+            if (entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns
+                    and (output_path is None or os.path.exists(output_path))):
+                files[source] = entry
+                unchanged[cls] += 1
+                if entry.get('error'):
+                    failures[cls].append((img_path, entry['error']))
+            elif output_path is not None:
+                # Changed source keeps its output name
+                tasks.append((img_path, output_path, entry['sha256']))
+            else:
+                new_files.append(img_path)
+        
+        for img_path, save_path in plan_output_names(new_files, proc_cls_path, reserved):
+            tasks.append((img_path, save_path, None))
         
+        class_tasks[cls] = tasks
+        print(f"■ {cls:25} : {len(image_files):5} images "
+              f"({unchanged[cls]} unchanged, {len(tasks)} to process)")
+    
+    # Drop outputs whose source was deleted (or moved to another class)
+    seen = set(files) | {
+        _relative(task[0], RAW_DIR) for cls_tasks in class_tasks.values() for task in cls_tasks
+    }
+    removed = 0
+    for source, entry in manifest.items():
+        if source in seen:
+            continue
+        if entry['output']:
+            output_path = os.path.join(PROCESSED_DIR, entry['output'])
+            if os.path.exists(output_path):
+                os.remove(output_path)
+        removed += 1
+    
+    if removed:
+        print(f"\n■ Removed {removed} outputs of deleted source images")
+    
+    tasks = [(cls, task) for cls, cls_tasks in class_tasks.items() for task in cls_tasks]
+    
+    print(f"\nProcessing {len(tasks)} images with {workers} worker(s)\n")
+    
+    if workers > 1 and len(tasks) > 1:
+        chunksize = max(1, min(64, len(tasks) // (workers * 8)))
+        pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker)
+        results = pool.map(process_image, [task for _, task in tasks], chunksize=chunksize)
+    else:
+        pool = None
+        results = map(process_image, [task for _, task in tasks])
+    
+    try:
+        for (cls, task), (img_path, error, info) in tqdm(zip(tasks, results), total=len(tasks),
+                                                         desc="  Processing"):
+            if error is not None:
+                failures[cls].append((img_path, error))
+                # A changed source that now fails must not leave its old output behind
+                if task[2] is not None and os.path.exists(task[1]):
+                    os.remove(task[1])
+            if info is None:
+                continue
+            if info.pop('skipped'):
+                rehashed[cls] += 1
+            files[_relative(img_path, RAW_DIR)] = dict(
+                info,
+                output=None if error else _relative(task[1], PROCESSED_DIR),
+                error=error
+            )
+    finally:
+        if pool is not None:
+            # On Ctrl-C, drop queued chunks instead of finishing the whole run
+            pool.shutdown(wait=True, cancel_futures=True)
+        # Unfinished tasks keep their previous entry, so their output names
+        # stay reserved and the next run picks them up again
+        for _, task in tasks:
+            source = _relative(task[0], RAW_DIR)
+            if source not in files and source in manifest:
+                files[source] = manifest[source]
+        # Persist progress even if interrupted
+        save_manifest(files)
+    
+    # Only after a complete run: every current output is in the manifest now
+    pruned = prune_unowned_outputs(files)
+    if pruned:
+        print(f"\n■ Removed {pruned} processed images not owned by any source")
+    
+    for cls, cls_tasks in class_tasks.items():
+        successful = unchanged[cls] + len(cls_tasks) - len(failures[cls])
         class_counts[cls] = successful
         total_images += successful
         
-        print(f"  ✓ Processed: {successful} images")
-        if failed > 0:
-            print(f"  ✗ Failed: {failed} images")
+        print(f"■ {cls}")
+        print(f"  ✓ Processed: {successful} images "
+              f"({unchanged[cls] + rehashed[cls]} unchanged)")
+        if failures[cls]:
+            print(f"  ✗ Failed: {len(failures[cls])} images")
+            for img_path, error in failures[cls][:10]:
+                print(f"    ✗ {error}: {os.path.basename(img_path)}")
+            if len(failures[cls]) > 10:
+                print(f"    ... and {len(failures[cls]) - 10} more")
     
     print("\n" + "="*70)
     print("PREPROCESSING SUMMARY")
@@ -152,10 +415,53 @@ def preprocess_images():
     print("✓ Image preprocessing completed\n")
 
 
+def assign_group_splits(cls, images, train_end, val_end, group_of, group_split):
+    """
+    Split one class so that every duplicate group lands in a single split
+
+    Groups already placed by another class (cross-class duplicates) keep
+    that split; the remaining units, largest first, go to whichever split
+    is furthest below its target size.
+
+    Returns:
+        List of split names aligned with `images`
+    """
+    targets = {'train': train_end, 'val': val_end - train_end, 'test': len(images) - val_end}
+    counts = dict.fromkeys(targets, 0)
+    assignment = [None] * len(images)
+    
+    units = defaultdict(list)
+    for i, img in enumerate(images):
+        units[group_of.get(f"{cls}/{img}", ('single', i))].append(i)
+    
+    pending = []
+    for key, members in units.items():
+        if key in group_split:
+            for i in members:
+                assignment[i] = group_split[key]
+            counts[group_split[key]] += len(members)
+        else:
+            pending.append((key, members))
+    
+    # Stable sort: equal-sized units keep the shuffled order
+    pending.sort(key=lambda unit: len(unit[1]), reverse=True)
+    
+    for key, members in pending:
+        split = max(targets, key=lambda name: targets[name] - counts[name])
+        for i in members:
+            assignment[i] = split
+        counts[split] += len(members)
+        if not isinstance(key, tuple):
+            group_split[key] = split
+    
+    return assignment
+
+
 def create_splits():
     """
     Create train/val/test splits with stratification
     Handles class imbalance by ensuring minimum samples in each split
+    Duplicate groups from dedup.py are kept inside a single split
     """
     os.makedirs(SPLITS_DIR, exist_ok=True)
     
@@ -165,13 +471,20 @@ def create_splits():
     print("CREATING DATA SPLITS")
     print("="*70 + "\n")
     
-    train_f = open(os.path.join(SPLITS_DIR, 'train.txt'), 'w')
-    val_f = open(os.path.join(SPLITS_DIR, 'val.txt'), 'w')
-    test_f = open(os.path.join(SPLITS_DIR, 'test.txt'), 'w')
+    split_files = {
+        name: open(os.path.join(SPLITS_DIR, f'{name}.txt'), 'w')
+        for name in ['train', 'val', 'test']
+    }
     
     total_counts = {'train': 0, 'val': 0, 'test': 0}
     class_details = {}
     
+    group_of = load_duplicate_groups()
+    group_split = {}
+    if group_of:
+        print(f"■ Group-aware splitting: {len(set(group_of.values()))} duplicate groups "
+              f"({len(group_of)} images) kept together\n")
+    
     for cls in os.listdir(PROCESSED_DIR):
         cls_path = os.path.join(PROCESSED_DIR, cls)
         
@@ -207,29 +520,24 @@ def create_splits():
         
         class_counts = {'train': 0, 'val': 0, 'test': 0}
         
-        for i, img in enumerate(images):
-            line = f"{cls}/{img}\n"
-            
-            if i < train_end:
-                train_f.write(line)
-                class_counts['train'] += 1
-                total_counts['train'] += 1
-            elif i < val_end:
-                val_f.write(line)
-                class_counts['val'] += 1
-                total_counts['val'] += 1
-            else:
-                test_f.write(line)
-                class_counts['test'] += 1
-                total_counts['test'] += 1
+        if group_of:
+            assignment = assign_group_splits(cls, images, train_end, val_end,
+                                             group_of, group_split)
+        else:
+            assignment = ['train' if i < train_end else 'val' if i < val_end else 'test'
+                          for i in range(n)]
+        
+        for img, split in zip(images, assignment):
+            split_files[split].write(f"{cls}/{img}\n")
+            class_counts[split] += 1
+            total_counts[split] += 1
         
         class_details[cls] = class_counts
         print(f"{cls:25} | Train: {class_counts['train']:3} | "
               f"Val: {class_counts['val']:3} | Test: {class_counts['test']:3}")
     
-    train_f.close()
-    val_f.close()
-    test_f.close()
+    for split_f in split_files.values():
+        split_f.close()
     
     print("\n" + "-"*70)
     print(f"{'TOTAL':25} | Train: {total_counts['train']:3} | "
@@ -297,6 +605,15 @@ def verify_data_integrity():
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Preprocess raw images and create splits')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Preprocessing processes (default: all CPU cores)')
+    parser.add_argument('--force', action='store_true',
+                        help='Ignore the manifest and reprocess every image')
+    parser.add_argument('--no_dedup', action='store_true',
+                        help='Skip duplicate detection (an existing groups file is still used)')
+    args = parser.parse_args()
+    
     # Create necessary directories
     os.makedirs(RAW_DIR, exist_ok=True)
     os.makedirs(PROCESSED_DIR, exist_ok=True)
@@ -307,8 +624,11 @@ if __name__ == "__main__":
     print("="*70)
     
     # Run preprocessing pipeline
-    preprocess_images()
+    preprocess_images(workers=args.workers, force=args.force)
+    if not args.no_dedup:
+        build_duplicate_groups(workers=args.workers)
     create_splits()
+    check_split_leakage()
     verify_data_integrity()
     
     print("="*70)
@@ -0,0 +1,201 @@
+"""
+Pre-decoded Evaluation Cache
+Decodes a non-augmented split once into a memory-mapped uint8 array
+[N, 224, 224, 3] (~150 KB per image) plus a label array. Later epochs
+and runs read batches straight from the mapping and normalize them in
+torch, so validation, evaluation and calibration cost only the forward
+passes.
+
+The cache is rebuilt automatically when the split file, the processed
+images (size/mtime) or the image size change.
+
+Usage:
+    python tensor_cache.py                 # build val + test caches
+    python tensor_cache.py --splits val
+"""
+
+import os
+import json
+import yaml
+import hashlib
+import argparse
+import numpy as np
+import torch
+from tqdm import tqdm
+from concurrent.futures import ThreadPoolExecutor
+
+# Load configuration
+with open('config.yaml', 'r') as f:
+    config = yaml.safe_load(f)
+
+PROCESSED_DIR = config['paths']['processed_data']
+SPLITS_DIR = config['paths']['splits']
+CACHE_DIR = config['paths'].get('cache', 'data/cache')
+IMG_SIZE = config['image']['size']
+
+CACHE_VERSION = 1
+
+
+def _cache_paths(split_name):
+    base = os.path.join(CACHE_DIR, split_name)
+    return base + '_images.npy', base + '_labels.npy', base + '_meta.json'
+
+
+def split_fingerprint(split_file):
+    """Hash of the split entries and the size/mtime of every image"""
+    digest = hashlib.sha256(f"{CACHE_VERSION}:{IMG_SIZE}".encode('utf-8'))
+    with open(split_file, 'r') as f:
+        for line in f:
+            entry = line.strip()
+            if not entry:
+                continue
+            try:
+                stat = os.stat(os.path.join(PROCESSED_DIR, entry))
+                digest.update(f"{entry}:{stat.st_size}:{stat.st_mtime_ns}\n".encode('utf-8'))
+            except OSError:
+                digest.update(f"{entry}:missing\n".encode('utf-8'))
+    return digest.hexdigest()
+
+
+def build_split_cache(dataset, split_name, fingerprint, workers=None):
+    """
+    Decode every sample of a non-augmented dataset into the memmap cache
+
+    Args:
+        dataset: PlantHealthDataset (or packed variant); only its
+                 _load_image() hook is used, so no transform is applied
+    """
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    images_path, labels_path, meta_path = _cache_paths(split_name)
+
+    n = len(dataset)
+    tmp_images = images_path + '.tmp.npy'
+    images = np.lib.format.open_memmap(
+        tmp_images, mode='w+', dtype=np.uint8, shape=(n, IMG_SIZE, IMG_SIZE, 3)
+    )
+
+    def fill(idx):
+        img = dataset._load_image(idx)
+        if img.shape != (IMG_SIZE, IMG_SIZE, 3):
+            raise ValueError(
+                f"{dataset.data[idx][0]}: expected {IMG_SIZE}x{IMG_SIZE}x3, got {img.shape} "
+                f"- re-run preprocessing.py"
+            )
+        images[idx] = img
+
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+        list(tqdm(pool.map(fill, range(n)), total=n, desc=f"  Caching {split_name}"))
+
+    images.flush()
+    del images
+
+    np.save(labels_path, np.asarray(dataset.get_labels(), dtype=np.int64))
+    os.replace(tmp_images, images_path)
+
+    # Metadata last: the cache is only valid once it exists
+    with open(meta_path, 'w') as f:
+        json.dump({'version': CACHE_VERSION, 'fingerprint': fingerprint,
+                   'count': n, 'img_size': IMG_SIZE}, f, indent=2)
+
+
+def load_split_cache(dataset, split_file, workers=None):
+    """
+    Memory-mapped (images, labels) for a split, building the cache if it
+    is missing or stale
+    """
+    split_name = os.path.splitext(os.path.basename(split_file))[0]
+    images_path, labels_path, meta_path = _cache_paths(split_name)
+    fingerprint = split_fingerprint(split_file)
+
+    valid = False
+    if os.path.exists(meta_path) and os.path.exists(images_path):
+        with open(meta_path, 'r') as f:
+            meta = json.load(f)
+        valid = meta.get('fingerprint') == fingerprint and meta.get('count') == len(dataset)
+
+    if not valid:
+        print(f"■ Building {split_name} tensor cache ({len(dataset)} images)...")
+        build_split_cache(dataset, split_name, fingerprint, workers)
+
+    images = np.load(images_path, mmap_mode='r')
+    labels = np.load(labels_path)
+    return images, labels
+
+
+def normalize_batch(images, device=None):
+    """
+    uint8 NHWC batch -> normalized float32 NCHW tensor
+
+    Same result as A.Normalize + ToTensorV2 in the non-augmented transform,
+    computed for the whole batch (on `device` if given, so only uint8
+    pixels cross the host-device link).
+    """
+    max_pixel = config['image']['max_pixel_value']
+    mean = torch.tensor(config['image']['normalize_mean'], dtype=torch.float32)
+    std = torch.tensor(config['image']['normalize_std'], dtype=torch.float32)
+
+    batch = torch.as_tensor(images)
+    if device is not None:
+        batch = batch.to(device, non_blocking=True)
+
+    batch = batch.permute(0, 3, 1, 2).float()
+    mean = (mean * max_pixel).view(1, 3, 1, 1).to(batch.device)
+    std = (std * max_pixel).view(1, 3, 1, 1).to(batch.device)
+    return (batch - mean) / std
+
+
+class CachedSplitLoader:
+    """
+    Drop-in replacement for a non-shuffled evaluation DataLoader
+
+    Yields (images, labels) like the DataLoader it replaces; images are
+    already normalized, on `device` when one is given. With world_size > 1
+    only the rank's contiguous shard of the split is read.
+    """
+
+    def __init__(self, dataset, split_file, batch_size, device=None, workers=None,
+                 rank=0, world_size=1):
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.device = device
+        self.images, self.labels = load_split_cache(dataset, split_file, workers)
+        self.shard_start = len(self.labels) * rank // world_size
+        self.shard_end = len(self.labels) * (rank + 1) // world_size
+
+    def __len__(self):
+        return (self.shard_end - self.shard_start + self.batch_size - 1) // self.batch_size
+
+    def __iter__(self):
+        pin = self.device is not None and self.device.type == 'cuda'
+        for start in range(self.shard_start, self.shard_end, self.batch_size):
+            end = min(start + self.batch_size, self.shard_end)
+            images = torch.from_numpy(np.ascontiguousarray(self.images[start:end]))
+            labels = torch.from_numpy(self.labels[start:end])
+            if pin:
+                images = images.pin_memory()
+            yield normalize_batch(images, self.device), labels
+
+
+def main():
+    from data_loader import PlantHealthDataset, PackedPlantHealthDataset
+
+    parser = argparse.ArgumentParser(description='Build pre-decoded evaluation caches')
+    parser.add_argument('--splits', nargs='+', default=['val', 'test'],
+                        help='Splits to cache (default: val test)')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Decoding threads (default: all CPU cores)')
+    args = parser.parse_args()
+
+    dataset_cls = (PackedPlantHealthDataset if config['training'].get('use_packed_dataset', False)
+                   else PlantHealthDataset)
+
+    for split_name in args.splits:
+        split_file = os.path.join(SPLITS_DIR, f'{split_name}.txt')
+        dataset = dataset_cls(split_file=split_file, augment=False)
+        images, _ = load_split_cache(dataset, split_file, args.workers)
+        print(f"✓ {split_name:5} : {images.shape[0]} images | "
+              f"{images.nbytes / 1024 / 1024:.1f} MB | {_cache_paths(split_name)[0]}")
+
+
+if __name__ == "__main__":
+    main()
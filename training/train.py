@@ -1,19 +1,32 @@
 import os
+import math
+import time
 import yaml
+import random
 import argparse
+from contextlib import nullcontext
 import numpy as np
 import pandas as pd  # ADD THIS IMPORT
 import torch
 import torch.nn as nn
 import torch.optim as optim
-from torch.cuda.amp import GradScaler, autocast
+from torch.cuda.amp import GradScaler
+from torch.nn.parallel import DistributedDataParallel as DDP
 from datetime import datetime
 from tqdm import tqdm
-from sklearn.metrics import f1_score, balanced_accuracy_score, confusion_matrix
 
 from model import (build_model, print_model_summary, save_model,
                    FocalLoss, LabelSmoothingCrossEntropy)
-from data_loader import (get_data_loaders, get_balanced_class_weights, mixup_data)
+from data_loader import (get_data_loaders, get_balanced_class_weights, mixup_data,
+                         ClassBalancedBatchSampler)
+from feature_cache import build_feature_cache, feature_cache_datasets, FeatureLoader
+from logits_cache import load_or_compute_logits, compute_logits
+from metrics import ConfusionMatrixMeter
+from checkpoint_writer import AsyncCheckpointWriter, write_checkpoint
+from batch_size_probe import probe_batch_size
+from ema import ModelEMA
+from distributed import (init_distributed, cleanup_distributed, setup_for_distributed,
+                         is_main_process, get_rank, get_world_size, all_gather_object)
 
 with open('config.yaml', 'r') as f:
     config = yaml.safe_load(f)
@@ -23,22 +36,152 @@ os.makedirs(config['paths']['logs'], exist_ok=True)
 
 device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
 
+# Steps between progress-bar loss/acc refreshes (each refresh syncs the device)
+PROGRESS_INTERVAL = 50
+
+# Autocast: float16 + GradScaler on CUDA, bfloat16 (no loss scaling needed) on CPU
+AMP_DTYPE = torch.float16 if device.type == 'cuda' else torch.bfloat16
+
+# NHWC activations: faster convolutions with oneDNN on CPU and tensor cores on CUDA
+CHANNELS_LAST = config['training'].get('channels_last', True)
+
+# Full training state written at epoch boundaries (see --resume)
+RESUME_PATH = os.path.join(config['paths']['models'], 'last_state.pth')
+
+# Rotated copies kept of best_model*.pth and last_state.pth
+KEEP_BEST = config['training'].get('checkpoint_keep_best', 1)
+KEEP_LAST = config['training'].get('checkpoint_keep_last', 1)
+
+
+def cpu_supports_bf16():
+    """True if oneDNN has native bf16 kernels (AVX512-BF16 / AMX); emulated bf16 is slower than fp32"""
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except (AttributeError, RuntimeError):
+        return False
+
+
+def configure_cpu_threads(num_workers):
+    """
+    Intra-op threads for CPU training: by default every core not used by a
+    DataLoader worker, so workers and the compute pool don't oversubscribe
+    """
+    threads = config['training'].get('cpu_threads')
+    if not threads:
+        # torchrun starts LOCAL_WORLD_SIZE processes per node; split the cores between them
+        cores = (os.cpu_count() or 1) // int(os.environ.get('LOCAL_WORLD_SIZE', 1))
+        threads = max(1, cores - num_workers)
+    torch.set_num_threads(threads)
+    print(f"✓ CPU threads: {threads} compute + {num_workers} data loader workers")
+    return threads
+
+
+def set_sampler_epoch(loader, epoch):
+    """Per-epoch draw of (distributed / class-balanced) samplers"""
+    for sampler in (getattr(loader, 'sampler', None), getattr(loader, 'batch_sampler', None)):
+        if hasattr(sampler, 'set_epoch'):
+            sampler.set_epoch(epoch)
+
+
+def to_device(images):
+    """Move an input batch to the device (channels_last for image batches)"""
+    images = images.to(device, non_blocking=True)
+    if CHANNELS_LAST and images.dim() == 4:
+        images = images.contiguous(memory_format=torch.channels_last)
+    return images
+
+
+def capture_rng_state():
+    """Python, NumPy and torch (CPU + CUDA) generator states"""
+    state = {
+        'python': random.getstate(),
+        'numpy': np.random.get_state(),
+        'torch': torch.get_rng_state()
+    }
+    if torch.cuda.is_available():
+        state['cuda'] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def restore_rng_state(state):
+    random.setstate(state['python'])
+    np.random.set_state(state['numpy'])
+    torch.set_rng_state(state['torch'])
+    if 'cuda' in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state['cuda'])
+
+
+def rank_rng_state(state):
+    """This rank's RNG state from a training state (distributed runs store one per rank)"""
+    rng_states = state.get('rng_states')
+    if rng_states and len(rng_states) == get_world_size():
+        return rng_states[get_rank()]
+    return state['rng_state']
+
+
+def build_forward_model(model, compile_model=False):
+    """
+    Module that runs the training forward passes: DDP under torchrun, then
+    optionally torch.compile. `model` itself stays the module that is saved.
+    DDP only registers parameters that require grad, so rebuild after
+    unfreezing the backbone.
+    """
+    forward_model = model
+    if get_world_size() > 1:
+        device_ids = [torch.cuda.current_device()] if device.type == 'cuda' else None
+        forward_model = DDP(model, device_ids=device_ids)
+    if compile_model:
+        forward_model = torch.compile(forward_model)
+    return forward_model
+
+
+def save_training_state(save_path, model, optimizer, scheduler, scaler, phase, epoch,
+                        best_macro_f1, epochs_no_improve, history, finished, extra=None,
+                        writer=None):
+    """
+    Full-state checkpoint at an epoch boundary
+
+    Everything needed to continue the run as if it never stopped: weights,
+    optimizer, scheduler and GradScaler states, early-stopping counters,
+    history and all RNG states (the next epoch's sampler order and
+    augmentations are drawn from them). With `writer` the file is written
+    in the background.
+    """
+    state = {
+        'phase': phase,
+        'epoch': epoch,
+        'finished': finished,
+        'model_state_dict': model.state_dict(),
+        'optimizer_state_dict': optimizer.state_dict(),
+        'scheduler_state_dict': scheduler.state_dict(),
+        'scaler_state_dict': scaler.state_dict(),
+        'best_macro_f1': best_macro_f1,
+        'epochs_no_improve': epochs_no_improve,
+        'history': history,
+        'rng_state': capture_rng_state(),
+        'model_name': model.model_name,
+        'num_classes': model.num_classes,
+        'config': config
+    }
+    if extra:
+        state.update(extra)
+    
+    # Both paths write then rename, so an interruption never leaves a truncated file
+    if writer is not None:
+        writer.save(state, save_path, keep=KEEP_LAST)
+    else:
+        write_checkpoint(state, save_path, keep=KEEP_LAST)
 
-class AverageMeter:
-    def __init__(self):
-        self.reset()
-    
-    def reset(self):
-        self.val = 0
-        self.avg = 0
-        self.sum = 0
-        self.count = 0
-    
-    def update(self, val, n=1):
-        self.val = val
-        self.sum += val * n
-        self.count += n
-        self.avg = self.sum / self.count
+
+def load_training_state(load_path):
+    """Load a save_training_state() checkpoint (weights_only=False: RNG states are pickled)"""
+    state = torch.load(load_path, map_location='cpu', weights_only=False)
+    print(f"✓ Resuming from {load_path}")
+    print(f"  Phase {state['phase']}, {state['epoch']} epochs done"
+          f"{' (phase finished)' if state['finished'] else ''}")
+    print(f"  Best Macro-F1: {state['best_macro_f1']:.3f} | "
+          f"No improvement: {state['epochs_no_improve']} epochs")
+    return state
 
 
 def get_loss_function(class_weights=None):
@@ -79,141 +222,185 @@ def mixup_criterion(criterion, pred, y_a, y_b, lam):
     return lam * criterion(pred, y_a) + (1 - lam) * criterion(pred, y_b)
 
 
-def train_epoch(model, loader, criterion, optimizer, scaler, use_amp=True, use_mixup=False):
-    """Training with optional mixup"""
+def train_epoch(model, loader, criterion, optimizer, scaler, use_amp=True, use_mixup=False,
+                accumulation_steps=1, ema=None):
+    """
+    Training with optional mixup
+
+    With accumulation_steps > 1 the gradients of that many micro-batches
+    are summed before each unscale/clip/optimizer step. Each micro-batch
+    loss is divided by the size of its group (the last group of an epoch
+    may be shorter), so every step uses the mean gradient of its group.
+    `ema` (ModelEMA) is updated after every optimizer step.
+    """
     model.train()
     
-    losses = AverageMeter()
-    accuracies = AverageMeter()
+    meter = ConfusionMatrixMeter(len(config['classes']), device)
     
-    all_preds = []
-    all_labels = []
+    num_batches = len(loader)
+    # DDP: all-reduce gradients only on the micro-batch that completes a step
+    no_sync = getattr(model, 'no_sync', None)
     
-    pbar = tqdm(loader, desc='Training')
+    optimizer.zero_grad()
     
-    for batch_data in pbar:
+    pbar = tqdm(loader, desc='Training', disable=not is_main_process())
+    
+    for step, batch_data in enumerate(pbar):
+        group_start = step - step % accumulation_steps
+        group_size = min(accumulation_steps, num_batches - group_start)
+        is_update_step = step == group_start + group_size - 1
+        
         images, labels = batch_data
         
-        images = images.to(device, non_blocking=True)
+        images = to_device(images)
         labels = labels.to(device, non_blocking=True)
         
-        # Apply mixup
-        if use_mixup and np.random.rand() < 0.5:
-            mixed_images, labels_a, labels_b, lam = mixup_data(
-                images, labels,
-                alpha=config['training'].get('mixup_alpha', 0.2)
-            )
-            
-            # Forward with mixup
-            if use_amp:
-                with torch.amp.autocast(device_type='cuda', enabled=True):
+        sync_context = no_sync() if no_sync is not None and not is_update_step else nullcontext()
+        
+        with sync_context:
+            # Apply mixup
+            if use_mixup and np.random.rand() < 0.5:
+                mixed_images, labels_a, labels_b, lam = mixup_data(
+                    images, labels,
+                    alpha=config['training'].get('mixup_alpha', 0.2)
+                )
+                
+                # Forward with mixup
+                if use_amp:
+                    with torch.autocast(device_type=device.type, dtype=AMP_DTYPE):
+                        outputs = model(mixed_images)
+                        loss = mixup_criterion(criterion, outputs, labels_a, labels_b, lam)
+                else:
                     outputs = model(mixed_images)
                     loss = mixup_criterion(criterion, outputs, labels_a, labels_b, lam)
+                
+                # For metrics, use original labels
+                predicted = outputs.argmax(dim=1)
+                correct = (lam * (predicted == labels_a).float() + 
+                           (1 - lam) * (predicted == labels_b).float()).sum()
             else:
-                outputs = model(mixed_images)
-                loss = mixup_criterion(criterion, outputs, labels_a, labels_b, lam)
-            
-            # For metrics, use original labels
-            _, predicted = torch.max(outputs, 1)
-            acc = (lam * (predicted == labels_a).float() + 
-                   (1 - lam) * (predicted == labels_b).float()).mean()
-        else:
-            # Standard forward
-            if use_amp:
-                with torch.amp.autocast(device_type='cuda', enabled=True):
+                # Standard forward
+                if use_amp:
+                    with torch.autocast(device_type=device.type, dtype=AMP_DTYPE):
+                        outputs = model(images)
+                        loss = criterion(outputs, labels)
+                else:
                     outputs = model(images)
                     loss = criterion(outputs, labels)
-            else:
-                outputs = model(images)
-                loss = criterion(outputs, labels)
+                
+                predicted = outputs.argmax(dim=1)
+                correct = None
             
-            _, predicted = torch.max(outputs, 1)
-            acc = (predicted == labels).float().mean()
-        
-        # Backward
-        optimizer.zero_grad()
+            # Backward (a disabled GradScaler passes the loss through unscaled)
+            scaler.scale(loss / group_size).backward()
         
-        if use_amp:
-            scaler.scale(loss).backward()
-            scaler.unscale_(optimizer)
+        # Step once the group's gradients are summed
+        if is_update_step:
+            # float16 needs loss scaling; bfloat16 and float32 step directly
+            if scaler.is_enabled():
+                scaler.unscale_(optimizer)
             torch.nn.utils.clip_grad_norm_(model.parameters(),
                                          config['training']['gradient_clip'])
             scaler.step(optimizer)
             scaler.update()
-        else:
-            loss.backward()
-            torch.nn.utils.clip_grad_norm_(model.parameters(),
-                                         config['training']['gradient_clip'])
-            optimizer.step()
-        
-        # Track
-        losses.update(loss.item(), images.size(0))
-        accuracies.update(acc.item(), images.size(0))
+            optimizer.zero_grad()
+            if ema is not None:
+                ema.update()
         
-        all_preds.extend(predicted.cpu().numpy())
-        all_labels.extend(labels.cpu().numpy())
+        # Track (on device, no host sync)
+        meter.update(predicted, labels, loss=loss, correct=correct)
         
-        pbar.set_postfix({
-            'loss': f'{losses.avg:.4f}',
-            'acc': f'{accuracies.avg:.4f}'
-        })
+        if (step + 1) % PROGRESS_INTERVAL == 0:
+            running = meter.compute()
+            pbar.set_postfix({
+                'loss': f"{running['loss']:.4f}",
+                'acc': f"{running['accuracy']:.4f}"
+            })
     
-    # Macro metrics
-    macro_f1 = f1_score(all_labels, all_preds, average='macro', zero_division=0)
-    balanced_acc = balanced_accuracy_score(all_labels, all_preds)
+    # Totals over all data-parallel ranks
+    meter.sync()
+    results = meter.compute()
     
-    return losses.avg, accuracies.avg, macro_f1, balanced_acc
+    return results['loss'], results['accuracy'], results['macro_f1'], results['balanced_accuracy']
 
 
 def validate(model, loader, criterion, use_amp=True):
-    """Comprehensive validation"""
-    model.eval()
+    """
+    Comprehensive validation
     
-    losses = AverageMeter()
-    accuracies = AverageMeter()
+    Returns:
+        loss, accuracy, macro_f1, balanced_accuracy, per_class_f1, confusion_matrix
+    """
+    model.eval()
     
-    all_preds = []
-    all_labels = []
-    all_probs = []
+    meter = ConfusionMatrixMeter(len(config['classes']), device)
     
     with torch.no_grad():
-        pbar = tqdm(loader, desc='Validation')
+        pbar = tqdm(loader, desc='Validation', disable=not is_main_process())
         
         for images, labels in pbar:
-            images = images.to(device, non_blocking=True)
+            images = to_device(images)
             labels = labels.to(device, non_blocking=True)
             
             if use_amp:
-                with torch.amp.autocast(device_type='cuda', enabled=True):
+                with torch.autocast(device_type=device.type, dtype=AMP_DTYPE):
                     outputs = model(images)
                     loss = criterion(outputs, labels)
             else:
                 outputs = model(images)
                 loss = criterion(outputs, labels)
             
-            probabilities = torch.softmax(outputs, dim=1)
-            _, predicted = torch.max(outputs, 1)
-            acc = (predicted == labels).float().mean()
-            
-            losses.update(loss.item(), images.size(0))
-            accuracies.update(acc.item(), images.size(0))
-            
-            all_preds.extend(predicted.cpu().numpy())
-            all_labels.extend(labels.cpu().numpy())
-            all_probs.extend(probabilities.cpu().numpy())
-            
-            pbar.set_postfix({
-                'loss': f'{losses.avg:.4f}',
-                'acc': f'{accuracies.avg:.4f}'
-            })
+            meter.update(outputs.argmax(dim=1), labels, loss=loss)
     
-    # Metrics
-    macro_f1 = f1_score(all_labels, all_preds, average='macro', zero_division=0)
-    balanced_acc = balanced_accuracy_score(all_labels, all_preds)
-    per_class_f1 = f1_score(all_labels, all_preds, average=None, zero_division=0)
+    # Each rank validated its own shard
+    meter.sync()
+    results = meter.compute()
     
-    return (losses.avg, accuracies.avg, macro_f1, balanced_acc,
-            per_class_f1, all_labels, all_preds, all_probs)
+    return (results['loss'], results['accuracy'], results['macro_f1'],
+            results['balanced_accuracy'], results['per_class_f1'], results['confusion_matrix'])
+
+
+def validate_ema(ema, val_loader, criterion, use_amp, epoch, save_path, optimizer,
+                 train_time, writer=None, head=False):
+    """
+    Validate the EMA weights, save them to `save_path` when their Macro-F1
+    improves, and report the EMA update overhead of the epoch
+
+    Returns:
+        ema_accuracy, ema_macro_f1
+    """
+    module = ema.module.classifier if head else ema.module
+    _, ema_acc, ema_f1, ema_bal_acc, _, _ = validate(module, val_loader, criterion, use_amp)
+    overhead, updates = ema.pop_overhead()
+    
+    print(f"  EMA:   Acc={ema_acc*100:.2f}% | F1={ema_f1:.3f} | Bal-Acc={ema_bal_acc:.3f}")
+    if updates:
+        print(f"  EMA update: {overhead / updates * 1000:.2f} ms/step "
+              f"({overhead / max(train_time, 1e-9) * 100:.1f}% of training time)")
+    
+    if ema_f1 > ema.best_macro_f1:
+        ema.best_macro_f1 = ema_f1
+        print(f"  ✓ NEW BEST EMA Macro-F1: {ema_f1:.3f}")
+        if is_main_process():
+            save_model(ema.module, optimizer, epoch, ema_f1, save_path, 'macro_f1',
+                       writer=writer, keep=KEEP_BEST)
+    
+    return ema_acc, ema_f1
+
+
+def evaluate_logits(logits, labels, criterion):
+    """validate()-style metrics from precomputed logits (no forward passes)"""
+    logits_t = torch.from_numpy(logits).to(device)
+    labels_t = torch.from_numpy(labels).to(device)
+    
+    meter = ConfusionMatrixMeter(len(config['classes']), device)
+    with torch.no_grad():
+        meter.update(logits_t.argmax(dim=1), labels_t, loss=criterion(logits_t, labels_t))
+    
+    results = meter.compute()
+    
+    return (results['loss'], results['accuracy'], results['macro_f1'],
+            results['balanced_accuracy'], results['per_class_f1'], results['confusion_matrix'])
 
 
 def print_per_class_metrics(per_class_f1, classes, class_counts=None):
@@ -245,9 +432,8 @@ def print_per_class_metrics(per_class_f1, classes, class_counts=None):
         print(f"  {status} {cls:25} : {f1:.3f}{count_str}")
 
 
-def check_class_confusion(labels, preds, classes):
-    """Analyze confusion between specific classes"""
-    cm = confusion_matrix(labels, preds)
+def check_class_confusion(cm, classes):
+    """Analyze confusion between specific classes (cm rows = true class)"""
     
     # Check if Healthy is being confused with Nutrients
     healthy_idx = classes.index('Healthy')
@@ -285,8 +471,23 @@ def save_history_to_csv(history, phase_name):
 
 
 def train_phase1(model, train_loader, val_loader, criterion, optimizer,
-                 scheduler, scaler, max_epochs, patience, use_amp=True, use_mixup=False):
-    """Phase 1 with calibrated metrics"""
+                 scheduler, scaler, max_epochs, patience, use_amp=True, use_mixup=False,
+                 head=None, resume=None, on_epoch_end=None, writer=None, forward_module=None,
+                 accumulation_steps=1, ema=None):
+    """
+    Phase 1 with calibrated metrics
+
+    With `head` (the classifier), the loaders yield cached backbone
+    features and only the head is run; checkpoints still hold the full model.
+    `resume` (a training state of this phase) continues after its last
+    epoch; `on_epoch_end` is called after every epoch for checkpointing.
+    Best checkpoints go through `writer` (AsyncCheckpointWriter) if given.
+    `forward_module` (e.g. the torch.compile'd model) runs the forward
+    passes when no head is given; `model` is what gets saved.
+    `accumulation_steps` micro-batches make one optimizer step. `ema`
+    (ModelEMA) is validated every epoch and its best weights saved next to
+    the raw ones; early stopping still follows the raw weights.
+    """
     print("\n" + "="*70)
     print("PHASE 1: Training Classification Head")
     print("="*70)
@@ -297,22 +498,41 @@ def train_phase1(model, train_loader, val_loader, criterion, optimizer,
     best_macro_f1 = 0.0
     epochs_no_improve = 0
     history = []
+    start_epoch = 0
+    
+    if resume is not None:
+        best_macro_f1 = resume['best_macro_f1']
+        epochs_no_improve = resume['epochs_no_improve']
+        history = list(resume['history'])
+        start_epoch = resume['epoch']
+        restore_rng_state(rank_rng_state(resume))
     
     # Class counts for reference
     class_counts = config.get('class_counts', {})
     
-    for epoch in range(max_epochs):
+    if head is not None:
+        forward_module = head
+    elif forward_module is None:
+        forward_module = model
+    
+    for epoch in range(start_epoch, max_epochs):
         print(f"\nEpoch [{epoch+1}/{max_epochs}]")
         print("-" * 70)
         
+        # Distributed samplers draw a new (rank-consistent) order per epoch
+        set_sampler_epoch(train_loader, epoch)
+        
         # Train
+        train_start = time.perf_counter()
         train_loss, train_acc, train_f1, train_bal_acc = train_epoch(
-            model, train_loader, criterion, optimizer, scaler, use_amp, use_mixup
+            forward_module, train_loader, criterion, optimizer, scaler, use_amp, use_mixup,
+            accumulation_steps, ema
         )
+        train_time = time.perf_counter() - train_start
         
         # Validate
         (val_loss, val_acc, val_f1, val_bal_acc, per_class_f1,
-         val_labels, val_preds, _) = validate(model, val_loader, criterion, use_amp)
+         val_cm) = validate(forward_module, val_loader, criterion, use_amp)
         
         scheduler.step(val_f1)
         
@@ -323,10 +543,17 @@ def train_phase1(model, train_loader, val_loader, criterion, optimizer,
               f"F1={val_f1:.3f} | Bal-Acc={val_bal_acc:.3f}")
         print(f"  LR: {optimizer.param_groups[0]['lr']:.6f}")
         
+        if ema is not None:
+            ema_acc, ema_f1 = validate_ema(
+                ema, val_loader, criterion, use_amp, epoch,
+                os.path.join(config['paths']['models'], 'best_model_phase1_ema.pth'),
+                optimizer, train_time, writer, head=head is not None
+            )
+        
         print_per_class_metrics(per_class_f1, config['classes'], class_counts)
         
         # Check for problematic confusion
-        confusion_issue = check_class_confusion(val_labels, val_preds, config['classes'])
+        confusion_issue = check_class_confusion(val_cm, config['classes'])
         
         # History - ADD PROPER STRUCTURE FOR CSV
         history.append({
@@ -341,6 +568,8 @@ def train_phase1(model, train_loader, val_loader, criterion, optimizer,
             'val_bal_acc': val_bal_acc,
             'lr': optimizer.param_groups[0]['lr']
         })
+        if ema is not None:
+            history[-1].update(ema_val_acc=ema_acc, ema_val_f1=ema_f1)
         
         # Check improvement
         if val_f1 > best_macro_f1:
@@ -350,11 +579,17 @@ def train_phase1(model, train_loader, val_loader, criterion, optimizer,
             print(f"\n  ✓ NEW BEST Macro-F1: {best_macro_f1:.3f} (+{improvement:.3f})")
             
             save_path = os.path.join(config['paths']['models'], 'best_model_phase1.pth')
-            save_model(model, optimizer, epoch, best_macro_f1, save_path, 'macro_f1')
+            if is_main_process():
+                save_model(model, optimizer, epoch, best_macro_f1, save_path, 'macro_f1',
+                           writer=writer, keep=KEEP_BEST)
         else:
             epochs_no_improve += 1
             print(f"\n  ■ No improvement: {epochs_no_improve}/{patience} epochs")
         
+        finished = epochs_no_improve >= patience or epoch + 1 == max_epochs
+        if on_epoch_end is not None:
+            on_epoch_end(epoch + 1, best_macro_f1, epochs_no_improve, history, finished)
+        
         # Phase transition
         if epochs_no_improve >= patience:
             print(f"\n{'='*70}")
@@ -362,18 +597,27 @@ def train_phase1(model, train_loader, val_loader, criterion, optimizer,
             print(f"{'='*70}\n")
             break
     
-    print(f"\n■ Phase 1 Complete: {epoch+1} epochs")
+    print(f"\n■ Phase 1 Complete: {len(history)} epochs")
     print(f"  Best Macro-F1: {best_macro_f1:.3f}")
+    if ema is not None:
+        print(f"  Best EMA Macro-F1: {ema.best_macro_f1:.3f}")
     
     # SAVE PHASE 1 HISTORY TO CSV
-    save_history_to_csv(history, 'phase1')
+    if is_main_process():
+        save_history_to_csv(history, 'phase1')
     
     return history, best_macro_f1
 
 
 def train_phase2(model, train_loader, val_loader, criterion, optimizer,
-                 scheduler, scaler, max_epochs, patience, use_amp=True, use_mixup=False):
-    """Phase 2 with very low LR"""
+                 scheduler, scaler, max_epochs, patience, use_amp=True, use_mixup=False,
+                 resume=None, on_epoch_end=None, writer=None, forward_module=None,
+                 sampler_epoch_offset=0, accumulation_steps=1, ema=None):
+    """
+    Phase 2 with very low LR (`resume`/`on_epoch_end`/`writer`/`forward_module`/
+    `accumulation_steps`/`ema` as in train_phase1; `sampler_epoch_offset` keeps
+    distributed sampler draws distinct from phase 1's)
+    """
     print("\n" + "="*70)
     print("PHASE 2: Fine-Tuning Entire Model")
     print("="*70)
@@ -383,19 +627,35 @@ def train_phase2(model, train_loader, val_loader, criterion, optimizer,
     best_macro_f1 = 0.0
     epochs_no_improve = 0
     history = []
+    start_epoch = 0
+    
+    if resume is not None:
+        best_macro_f1 = resume['best_macro_f1']
+        epochs_no_improve = resume['epochs_no_improve']
+        history = list(resume['history'])
+        start_epoch = resume['epoch']
+        restore_rng_state(rank_rng_state(resume))
     
     class_counts = config.get('class_counts', {})
     
-    for epoch in range(max_epochs):
+    if forward_module is None:
+        forward_module = model
+    
+    for epoch in range(start_epoch, max_epochs):
         print(f"\nEpoch [{epoch+1}/{max_epochs}]")
         print("-" * 70)
         
+        set_sampler_epoch(train_loader, sampler_epoch_offset + epoch)
+        
+        train_start = time.perf_counter()
         train_loss, train_acc, train_f1, train_bal_acc = train_epoch(
-            model, train_loader, criterion, optimizer, scaler, use_amp, use_mixup
+            forward_module, train_loader, criterion, optimizer, scaler, use_amp, use_mixup,
+            accumulation_steps, ema
         )
+        train_time = time.perf_counter() - train_start
         
         (val_loss, val_acc, val_f1, val_bal_acc, per_class_f1,
-         val_labels, val_preds, _) = validate(model, val_loader, criterion, use_amp)
+         val_cm) = validate(forward_module, val_loader, criterion, use_amp)
         
         scheduler.step(val_f1)
         
@@ -405,8 +665,15 @@ def train_phase2(model, train_loader, val_loader, criterion, optimizer,
               f"F1={val_f1:.3f} | Bal-Acc={val_bal_acc:.3f}")
         print(f"  LR: {optimizer.param_groups[0]['lr']:.6f}")
         
+        if ema is not None:
+            ema_acc, ema_f1 = validate_ema(
+                ema, val_loader, criterion, use_amp, epoch,
+                os.path.join(config['paths']['models'], 'best_model_ema.pth'),
+                optimizer, train_time, writer
+            )
+        
         print_per_class_metrics(per_class_f1, config['classes'], class_counts)
-        confusion_issue = check_class_confusion(val_labels, val_preds, config['classes'])
+        confusion_issue = check_class_confusion(val_cm, config['classes'])
         
         # History - ADD PROPER STRUCTURE FOR CSV
         history.append({
@@ -421,6 +688,8 @@ def train_phase2(model, train_loader, val_loader, criterion, optimizer,
             'val_bal_acc': val_bal_acc,
             'lr': optimizer.param_groups[0]['lr']
         })
+        if ema is not None:
+            history[-1].update(ema_val_acc=ema_acc, ema_val_f1=ema_f1)
         
         if val_f1 > best_macro_f1:
             improvement = val_f1 - best_macro_f1
@@ -429,28 +698,43 @@ def train_phase2(model, train_loader, val_loader, criterion, optimizer,
             print(f"\n  ✓ NEW BEST Macro-F1: {best_macro_f1:.3f} (+{improvement:.3f})")
             
             save_path = os.path.join(config['paths']['models'], 'best_model.pth')
-            save_model(model, optimizer, epoch, best_macro_f1, save_path, 'macro_f1')
+            if is_main_process():
+                save_model(model, optimizer, epoch, best_macro_f1, save_path, 'macro_f1',
+                           writer=writer, keep=KEEP_BEST)
         else:
             epochs_no_improve += 1
             print(f"\n  ■ No improvement: {epochs_no_improve}/{patience} epochs")
         
+        finished = epochs_no_improve >= patience or epoch + 1 == max_epochs
+        if on_epoch_end is not None:
+            on_epoch_end(epoch + 1, best_macro_f1, epochs_no_improve, history, finished)
+        
         if epochs_no_improve >= patience:
             print(f"\n{'='*70}")
             print(f"■ EARLY STOPPING")
             print(f"{'='*70}\n")
             break
     
-    print(f"\n■ Phase 2 Complete: {epoch+1} epochs")
+    print(f"\n■ Phase 2 Complete: {len(history)} epochs")
     print(f"  Best Macro-F1: {best_macro_f1:.3f}")
+    if ema is not None:
+        print(f"  Best EMA Macro-F1: {ema.best_macro_f1:.3f}")
     
     # SAVE PHASE 2 HISTORY TO CSV
-    save_history_to_csv(history, 'phase2')
+    if is_main_process():
+        save_history_to_csv(history, 'phase2')
     
     return history, best_macro_f1
 
 
 def main(args):
     """Calibrated training pipeline"""
+    # Data-parallel under torchrun; rank 0 of 1 otherwise
+    rank, world_size = init_distributed()
+    setup_for_distributed(rank == 0)
+    if world_size > 1 and device.type == 'cuda':
+        torch.cuda.set_device(int(os.environ.get('LOCAL_RANK', 0)))
+    
     print("\n" + "="*70)
     print("CALIBRATED TRAINING - Plant Health Monitoring")
     print(f"Started: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
@@ -474,9 +758,13 @@ def main(args):
     print("  ✓ Confusion monitoring (Healthy vs Nutrients)")
     print("="*70 + "\n")
     
-    # Seeds
-    torch.manual_seed(config['data']['random_seed'])
-    np.random.seed(config['data']['random_seed'])
+    if world_size > 1:
+        print(f"■ Distributed: {world_size} processes ({config['training'].get('dist_backend', 'gloo')})\n")
+    
+    # Seeds (per rank, so augmentation and mixup draws differ between ranks;
+    # DDP broadcasts rank 0's initial weights)
+    torch.manual_seed(config['data']['random_seed'] + rank)
+    np.random.seed(config['data']['random_seed'] + rank)
     
     # Model
     model = build_model(
@@ -485,12 +773,53 @@ def main(args):
         pretrained=not args.no_pretrained
     )
     model = model.to(device)
+    if CHANNELS_LAST:
+        model = model.to(memory_format=torch.channels_last)
+    
+    if device.type == 'cpu':
+        configure_cpu_threads(config['training'].get('num_workers', 4))
+    
+    resume_state = None
+    if args.resume:
+        resume_state = load_training_state(args.resume)
+        if resume_state['phase'] == 2:
+            model.unfreeze_base()
+        model.load_state_dict(resume_state['model_state_dict'])
+    
     print_model_summary(model)
     
+    # Mixed precision
+    use_amp = config['training']['use_mixed_precision'] and not args.no_mixed_precision
+    if use_amp and device.type == 'cpu' and not cpu_supports_bf16():
+        print("\n■ CPU has no native bf16 support → training in float32")
+        use_amp = False
+    if use_amp:
+        print(f"\n✓ Mixed precision: {device.type} autocast ({str(AMP_DTYPE).replace('torch.', '')})")
+    # Loss scaling is only needed for float16
+    scaler = GradScaler(enabled=use_amp and AMP_DTYPE == torch.float16)
+    
+    # Batch: micro-batches of `batch_size`, one optimizer step per `accumulation_steps`
+    batch_size = config['training']['batch_size']
+    accumulation_steps = args.accumulation_steps or config['training'].get('accumulation_steps', 1)
+    
+    if args.auto_batch_size or config['training'].get('auto_batch_size', False):
+        effective_batch = batch_size * accumulation_steps
+        fitting = probe_batch_size(model, device, use_amp, AMP_DTYPE, CHANNELS_LAST,
+                                   max_batch_size=effective_batch)
+        # Every rank must run the same number of micro-batches
+        batch_size = min(all_gather_object(fitting))
+        accumulation_steps = math.ceil(effective_batch / batch_size)
+    
+    if accumulation_steps > 1 or world_size > 1:
+        print(f"\n✓ Samples per optimizer step: {batch_size} (micro-batch) × {accumulation_steps} "
+              f"(accumulation) × {world_size} (processes) = "
+              f"{batch_size * accumulation_steps * world_size}")
+    
     # Data
     train_loader, val_loader, test_loader = get_data_loaders(
-        batch_size=config['training']['batch_size'],
-        use_weighted_sampler=not args.no_weighted_sampler
+        batch_size=batch_size,
+        use_weighted_sampler=not args.no_weighted_sampler,
+        device=device
     )
     
     # Class weights
@@ -512,15 +841,46 @@ def main(args):
     # Loss
     criterion = get_loss_function(class_weights)
     
-    # Mixed precision
-    use_amp = config['training']['use_mixed_precision'] and not args.no_mixed_precision
-    scaler = GradScaler(enabled=use_amp)
+    # Optional graph compilation (applied in build_forward_model)
+    compile_model = args.compile or config['training'].get('compile', False)
+    if compile_model:
+        print("✓ torch.compile enabled (first epoch includes compilation)")
     
     # Mixup
     use_mixup = config['training'].get('mixup_alpha', 0.0) > 0
     if use_mixup:
         print(f"\n✓ Mixup enabled (alpha={config['training']['mixup_alpha']})")
     
+    # Checkpoints are snapshotted to CPU and written on a background thread
+    writer = None
+    if config['training'].get('async_checkpoints', True) and is_main_process():
+        writer = AsyncCheckpointWriter()
+        print("\n✓ Asynchronous checkpoint writing enabled")
+    
+    # EMA shadow weights (a new one per phase: phase 2 trains other parameters)
+    use_ema = args.ema or config['training'].get('ema', False)
+    ema_decay = config['training'].get('ema_decay', 0.999)
+    if use_ema:
+        print(f"\n✓ EMA of weights enabled (decay={ema_decay})")
+    
+    def checkpoint_callback(phase, optimizer, scheduler, extra=None, ema=None):
+        """on_epoch_end hook writing the full training state to RESUME_PATH"""
+        def on_epoch_end(epoch, best_macro_f1, epochs_no_improve, history, finished):
+            if epoch % args.checkpoint_every == 0 or finished:
+                # Collective: every rank contributes its RNG state, rank 0 writes
+                state_extra = dict(extra or {}, rng_states=all_gather_object(capture_rng_state()))
+                if ema is not None:
+                    state_extra['ema_state_dict'] = ema.state_dict()
+                if is_main_process():
+                    save_training_state(RESUME_PATH, model, optimizer, scheduler, scaler,
+                                        phase, epoch, best_macro_f1, epochs_no_improve,
+                                        history, finished, state_extra, writer)
+        return on_epoch_end
+    
+    # Phase 1 state to resume from (None = start fresh, skipped when already done)
+    resume_p1 = resume_state if resume_state and resume_state['phase'] == 1 else None
+    skip_phase1 = resume_state is not None and (resume_state['phase'] == 2 or resume_state['finished'])
+    
     # ==================== PHASE 1 ====================
     print("\n" + "="*70)
     print("PHASE 1 START")
@@ -540,21 +900,83 @@ def main(args):
         min_lr=config['training']['min_lr'],
     )
     
-    history1, best_f1_p1 = train_phase1(
-        model, train_loader, val_loader, criterion,
-        optimizer_p1, scheduler_p1, scaler,
-        max_epochs=args.max_epochs_phase1,
-        patience=config['training']['phase1_transition_patience'],
-        use_amp=use_amp,
-        use_mixup=use_mixup
-    )
+    ema_p1 = ModelEMA(model, ema_decay) if use_ema and not skip_phase1 else None
+    
+    if resume_p1 is not None:
+        optimizer_p1.load_state_dict(resume_p1['optimizer_state_dict'])
+        scheduler_p1.load_state_dict(resume_p1['scheduler_state_dict'])
+        scaler.load_state_dict(resume_p1['scaler_state_dict'])
+        if ema_p1 is not None and 'ema_state_dict' in resume_p1:
+            ema_p1.load_state_dict(resume_p1['ema_state_dict'])
+    
+    # Optional: train the head on cached frozen-backbone features
+    p1_train_loader, p1_val_loader, p1_head = train_loader, val_loader, None
+    use_feature_cache = (not skip_phase1 and
+                         (args.feature_cache or config['training'].get('phase1_feature_cache', False)))
+    if use_feature_cache and world_size > 1:
+        print("■ Feature cache is single-process only → phase 1 runs end-to-end")
+        use_feature_cache = False
+    
+    if use_feature_cache:
+        views = (args.feature_views if args.feature_views is not None
+                 else config['training'].get('phase1_feature_views', 4))
+        # Cached views are normalized per sample (the uint8 paths return raw pixels)
+        clean_train_dataset, augmented_train_dataset = feature_cache_datasets(
+            train_loader.dataset, os.path.join(config['paths']['splits'], 'train.txt')
+        )
+        store = build_feature_cache(
+            model, clean_train_dataset, augmented_train_dataset, val_loader, views, device
+        )
+        p1_train_loader = FeatureLoader(
+            store['train_features'], store['train_labels'],
+            batch_size, device,
+            sampler=train_loader.sampler, drop_last=True,
+            batch_sampler=(train_loader.batch_sampler
+                           if isinstance(train_loader.batch_sampler, ClassBalancedBatchSampler)
+                           else None)
+        )
+        p1_val_loader = FeatureLoader(
+            store['val_features'], store['val_labels'],
+            batch_size, device
+        )
+        p1_head = model.classifier
+        print(f"✓ Phase 1 trains the head on cached features ({1 + views} views per image)")
+        print("  Backbone features use BatchNorm running statistics (eval mode)")
+    
+    if skip_phase1:
+        # Phase 1 already finished in the resumed run
+        history1 = resume_state.get('history1', resume_state['history'])
+        best_f1_p1 = resume_state.get('best_f1_p1', resume_state['best_macro_f1'])
+        if resume_p1 is not None:
+            restore_rng_state(rank_rng_state(resume_p1))
+        print(f"\n✓ Phase 1 already complete ({len(history1)} epochs, "
+              f"best Macro-F1: {best_f1_p1:.3f})")
+    else:
+        history1, best_f1_p1 = train_phase1(
+            model, p1_train_loader, p1_val_loader, criterion,
+            optimizer_p1, scheduler_p1, scaler,
+            max_epochs=args.max_epochs_phase1,
+            patience=config['training']['phase1_transition_patience'],
+            use_amp=use_amp,
+            use_mixup=use_mixup,
+            head=p1_head,
+            accumulation_steps=accumulation_steps,
+            resume=resume_p1,
+            on_epoch_end=checkpoint_callback(1, optimizer_p1, scheduler_p1, ema=ema_p1),
+            writer=writer,
+            forward_module=build_forward_model(model, compile_model),
+            ema=ema_p1
+        )
     
     # ==================== PHASE 2 ====================
     print("\n" + "="*70)
     print("PHASE 2 START")
     print("="*70)
     
-    model.unfreeze_base()
+    if not (resume_state and resume_state['phase'] == 2):
+        model.unfreeze_base()
+    # Phase 1 shadow no longer needed (its best weights are on disk)
+    ema_p1 = None
     
     # CRITICAL: Very low LR
     lr_phase2 = config['training']['initial_lr'] / 25
@@ -576,14 +998,45 @@ def main(args):
         min_lr=config['training']['min_lr'],
     )
     
-    history2, best_f1_p2 = train_phase2(
-        model, train_loader, val_loader, criterion,
-        optimizer_p2, scheduler_p2, scaler,
-        max_epochs=args.max_epochs_phase2,
-        patience=config['training']['patience'],
-        use_amp=use_amp,
-        use_mixup=use_mixup
-    )
+    resume_p2 = resume_state if resume_state and resume_state['phase'] == 2 else None
+    ema_p2 = ModelEMA(model, ema_decay) if use_ema else None
+    if resume_p2 is not None:
+        optimizer_p2.load_state_dict(resume_p2['optimizer_state_dict'])
+        scheduler_p2.load_state_dict(resume_p2['scheduler_state_dict'])
+        scaler.load_state_dict(resume_p2['scaler_state_dict'])
+        if ema_p2 is not None and 'ema_state_dict' in resume_p2:
+            ema_p2.load_state_dict(resume_p2['ema_state_dict'])
+    
+    if resume_p2 is not None and resume_p2['finished']:
+        history2, best_f1_p2 = resume_p2['history'], resume_p2['best_macro_f1']
+        print(f"✓ Phase 2 already complete ({len(history2)} epochs)")
+    else:
+        history2, best_f1_p2 = train_phase2(
+            model, train_loader, val_loader, criterion,
+            optimizer_p2, scheduler_p2, scaler,
+            max_epochs=args.max_epochs_phase2,
+            patience=config['training']['patience'],
+            use_amp=use_amp,
+            use_mixup=use_mixup,
+            resume=resume_p2,
+            on_epoch_end=checkpoint_callback(2, optimizer_p2, scheduler_p2,
+                                             {'history1': history1, 'best_f1_p1': best_f1_p1},
+                                             ema=ema_p2),
+            writer=writer,
+            forward_module=build_forward_model(model, compile_model),
+            sampler_epoch_offset=args.max_epochs_phase1,
+            accumulation_steps=accumulation_steps,
+            ema=ema_p2
+        )
+    
+    # Every checkpoint must be on disk before the test reads best_model.pth
+    if writer is not None:
+        writer.close()
+    
+    # The final test runs on rank 0 only
+    if not is_main_process():
+        cleanup_distributed()
+        return
     
     # ==================== FINAL TEST ====================
     print("\n" + "="*70)
@@ -591,11 +1044,21 @@ def main(args):
     print("="*70 + "\n")
     
     best_path = os.path.join(config['paths']['models'], 'best_model.pth')
+    # The EMA weights are tested instead when they validated better
+    if ema_p2 is not None and ema_p2.best_macro_f1 > best_f1_p2:
+        best_path = os.path.join(config['paths']['models'], 'best_model_ema.pth')
+        print(f"✓ Testing EMA weights (val Macro-F1 {ema_p2.best_macro_f1:.3f} vs "
+              f"{best_f1_p2:.3f} raw)\n")
     checkpoint = torch.load(best_path)
     model.load_state_dict(checkpoint['model_state_dict'])
     
+    # Float32 test logits, cached for evaluate.py
+    test_logits, test_label_array, _ = load_or_compute_logits(
+        best_path, 'test', lambda: compute_logits(model, test_loader, device)
+    )
+    
     (test_loss, test_acc, test_f1, test_bal_acc, test_per_class_f1,
-     test_labels, test_preds, _) = validate(model, test_loader, criterion, use_amp)
+     test_cm) = evaluate_logits(test_logits, test_label_array, criterion)
     
     # Analysis
     print("\n" + "="*70)
@@ -610,7 +1073,7 @@ def main(args):
     print_per_class_metrics(test_per_class_f1, config['classes'], config.get('class_counts'))
     
     # Check specific issues
-    check_class_confusion(test_labels, test_preds, config['classes'])
+    check_class_confusion(test_cm, config['classes'])
     
     # Minority analysis
     minority_indices = [4, 5, 6, 7]  # Nitrogen, Potassium, Water_Stress, Not_Plant
@@ -634,6 +1097,7 @@ def main(args):
         f.write("CALIBRATED TRAINING RESULTS\n")
         f.write("="*70 + "\n\n")
         f.write(f"Total Epochs: {len(history1) + len(history2)}\n")
+        f.write(f"Checkpoint: {os.path.basename(best_path)}\n")
         f.write(f"Test Accuracy: {test_acc:.4f}\n")
         f.write(f"Test Macro-F1: {test_f1:.4f}\n")
         f.write(f"Minority Avg F1: {minority_f1:.4f}\n\n")
@@ -645,6 +1109,8 @@ def main(args):
     print("\n" + "="*70)
     print("✓ TRAINING COMPLETE!")
     print("="*70 + "\n")
+    
+    cleanup_distributed()
 
 
 if __name__ == "__main__":
@@ -662,6 +1128,30 @@ if __name__ == "__main__":
     parser.add_argument('--no_class_weights', action='store_true')
     parser.add_argument('--no_weighted_sampler', action='store_true')
     
+    parser.add_argument('--feature_cache', action='store_true',
+                       help='Phase 1: train the head on cached backbone features')
+    parser.add_argument('--feature_views', type=int, default=None,
+                       help='Augmented views per image in the feature cache '
+                            '(default: training.phase1_feature_views)')
+    
+    parser.add_argument('--compile', action='store_true',
+                       help='Wrap the model in torch.compile for training')
+    
+    parser.add_argument('--accumulation_steps', type=int, default=None,
+                       help='Micro-batches per optimizer step (default: training.accumulation_steps)')
+    parser.add_argument('--auto_batch_size', action='store_true',
+                       help='Use the largest micro-batch that fits in memory, keeping the '
+                            'effective batch via gradient accumulation')
+    
+    parser.add_argument('--ema', action='store_true',
+                       help='Keep, validate and save an EMA of the weights (best_model_ema.pth)')
+    
+    parser.add_argument('--resume', nargs='?', const=RESUME_PATH, default=None,
+                       help=f'Continue an interrupted run from a full-state checkpoint '
+                            f'(default: {RESUME_PATH})')
+    parser.add_argument('--checkpoint_every', type=int, default=1,
+                       help='Epochs between full-state checkpoints (default: 1)')
+    
     args = parser.parse_args()
     
     main(args)
\ No newline at end of file
@@ -10,6 +10,7 @@ Run this script to verify:
 5. Training pipeline
 6. Inference capability
 7. All 8 classes including Not_Plant
+8. Feature cache inputs under uint8 collation
 
 Usage:
     python verify_system.py
@@ -530,6 +531,52 @@ def verify_class_distribution():
     return True
 
 
+# ============================================================================
+# VERIFICATION 8: Feature Cache Inputs
+# ============================================================================
+def verify_feature_cache_inputs():
+    print_header("VERIFICATION 8: Feature Cache Inputs")
+    
+    with open('config.yaml', 'r') as f:
+        config = yaml.safe_load(f)
+    
+    train_split = os.path.join(config['paths']['splits'], 'train.txt')
+    if not os.path.exists(train_split):
+        print_warning("Data splits not created yet")
+        print_info("Run: python preprocessing.py")
+        return False
+    
+    # uint8_collate / batch_augmentation combined with phase1_feature_cache:
+    # the backbone must still receive normalized float CHW tensors
+    try:
+        from data_loader import PlantHealthDataset
+        from feature_cache import feature_cache_datasets
+        
+        for flags in ({'uint8_output': True}, {'batch_augment': True}):
+            train_dataset = PlantHealthDataset(train_split, augment=True, **flags)
+            datasets = feature_cache_datasets(train_dataset, train_split)
+            
+            for name, dataset in zip(['clean', 'augmented'], datasets):
+                image, _ = dataset[0]
+                size = config['image']['size']
+                if not (torch.is_tensor(image) and image.dtype == torch.float32
+                        and tuple(image.shape) == (3, size, size)):
+                    print_error(f"{', '.join(flags)}: {name} view returns "
+                                f"{type(image).__name__} {getattr(image, 'dtype', '')}")
+                    return False
+            print_success(f"{', '.join(flags)}: cached views get float32 [3, {size}, {size}] tensors")
+        
+        print()
+        print_success("Feature cache inputs are normalized ✓")
+        return True
+        
+    except Exception as e:
+        print_error(f"Feature cache input test failed: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
 # ============================================================================
 # MAIN VERIFICATION
 # ============================================================================
@@ -551,6 +598,7 @@ def main():
     results['data_loader'] = verify_data_loader()
     results['loss_functions'] = verify_loss_functions()
     results['distribution'] = verify_class_distribution()
+    results['feature_cache_inputs'] = verify_feature_cache_inputs()
     
     # Final summary
     print_header("FINAL VERIFICATION SUMMARY")